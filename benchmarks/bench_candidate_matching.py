@@ -0,0 +1,152 @@
+#! /usr/bin/env python3.8
+
+"""Settlement matching through CandidateIndex compared with the scan of all names it replaced.
+
+Random lookups mix region aliases, name prefixes, municipalities matching as substrings, several codes and ties on
+the end date. The benchmark times both and checks that every key gets the same code from them.
+
+Usage: python3 -m benchmarks.bench_candidate_matching [--cases N] [--seed N]
+"""
+import argparse
+import json
+import random
+import time
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from grao_tables_processing.common.custom_types import SettlementDataTuple, SettlementNamesForPeriod
+from grao_tables_processing.settlement_disambiguation.settlement_disambiguation import CandidateIndex
+
+
+Lookup = Dict[str, List[SettlementNamesForPeriod]]
+
+REGIONS = ['СОФИЙСКА', 'СОФИЯ', 'СМОЛЯН', 'ПЛОВДИВСКА', 'ПЛОВДИВ', 'ПАЗАРДЖИК', 'ПАЗАРДЖИШКИ', 'ДОБРИЧ']
+MUNICIPALITIES = ['ДОБРИЧ', 'ДОБРИЧ-СЕЛСКА', 'ЕЛИН ПЕЛИН', 'ПЕЛИН', 'СМОЛЯН', 'БРАЦИГОВО']
+SETTLEMENTS = ['ГОРНА БАНЯ', 'БАНЯ', 'ЛОЗЕН', 'ДОЛНИ ЛОЗЕН', 'ВЕЛИНГРАД']
+PREFIXES = ['с. ', 'гр. ', 'с.', '']
+
+
+def mach_key_with_code(settlement: SettlementDataTuple) -> SettlementDataTuple:
+  """The matching CandidateIndex replaced, scanning every name of the lookup for every key."""
+  ker_region = settlement.key[0].lower()
+  ker_municipality = settlement.key[1].lower()
+  ker_settlement = settlement.key[2].lower()
+
+  result = SettlementDataTuple(settlement.key)
+  result_list = []
+
+  for code, names_list in settlement.data.items():
+    for name_data in names_list:
+      region_name = name_data.name[0].lower()
+      municipality_name = name_data.name[1].lower()
+      settlement_name = name_data.name[2].lower()
+
+      region_match = any([
+        region_name.find(ker_region) != -1,
+        ker_region == 'софийска' and region_name.find('софия') != -1,
+        ker_region == 'смолян' and region_name.find('пловдивска') != -1,
+        ker_region == 'пазарджик' and region_name.find('пазарджишки') != -1
+      ])
+
+      municipality_and_settlement_match = all([
+        municipality_name.find(ker_municipality) != -1,
+        settlement_name.split('.')[-1].strip() == ker_settlement
+      ])
+
+      if region_match and municipality_and_settlement_match:
+        result_list.append((name_data.end, SettlementDataTuple(settlement.key, code)))
+
+  # if there are multiple matching names take the most recent one
+  result_list = sorted(result_list)
+  if len(result_list) > 0:
+    result = result_list[-1][1]
+
+  return result
+
+
+def random_name(rng: random.Random, key: Tuple[str, str, str]) -> Tuple[str, str, str]:
+  # Every part is often taken from the key, so the names match it, or nearly, in many ways
+  region, municipality, settlement = (part if rng.random() < 0.6 else rng.choice(choices)
+                                      for part, choices in zip(key, (REGIONS, MUNICIPALITIES, SETTLEMENTS)))
+
+  return (region, municipality, rng.choice(PREFIXES) + settlement)
+
+
+def random_lookup(rng: random.Random, key: Tuple[str, str, str], codes: int) -> Lookup:
+  # Few distinct end dates, so several matching names often end on the same day
+  ends = [datetime(2000, 1, 1) + timedelta(days=365 * years) for years in range(4)]
+
+  return {
+    f'{rng.randrange(100000):05d}': [
+      SettlementNamesForPeriod(random_name(rng, key), datetime(1899, 12, 31), rng.choice(ends))
+      for _ in range(rng.randint(1, 3))
+    ]
+    for _ in range(codes)
+  }
+
+
+def random_keys(rng: random.Random, count: int) -> List[Tuple[str, str, str]]:
+  return [(rng.choice(REGIONS), rng.choice(MUNICIPALITIES), rng.choice(SETTLEMENTS)) for _ in range(count)]
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares CandidateIndex with the matching it replaced")
+  parser.add_argument("--cases",
+                      type=int, default=20000,
+                      help="Number of random lookups, each matched against one key.")
+  parser.add_argument("--shared_keys",
+                      type=int, default=1000,
+                      help="Number of keys matched against a single large lookup.")
+  parser.add_argument("--seed",
+                      type=int, default=0,
+                      help="Seed of the random lookups.")
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  keys = random_keys(rng, args.cases)
+  cases = [SettlementDataTuple(key, random_lookup(rng, key, rng.randint(1, 4))) for key in keys]
+  indexes = [CandidateIndex(case.data) for case in cases]
+  mismatches = [case for case, index in zip(cases, indexes) if index.match(case) != mach_key_with_code(case)]
+
+  # Many keys sharing one lookup, as the settlements found under the same name on NSI's website do
+  lookup = random_lookup(rng, random_keys(rng, 1)[0], 500)
+  keys = random_keys(rng, args.shared_keys)
+
+  start = time.perf_counter()
+  expected = [mach_key_with_code(SettlementDataTuple(key, lookup)) for key in keys]
+  scan_seconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  index = CandidateIndex(lookup)
+  indexed = [index.match(SettlementDataTuple(key)) for key in keys]
+  index_seconds = time.perf_counter() - start
+
+  print(json.dumps({
+    'random_cases': len(cases),
+    'random_cases_matched': sum(mach_key_with_code(case).data is not None for case in cases),
+    'random_cases_ambiguous': sum(bool(index.ambiguous) for index in indexes),
+    'keys': len(keys),
+    'scan_seconds': scan_seconds,
+    'index_seconds': index_seconds,
+    'matched': sum(result.data is not None for result in indexed),
+    'ambiguous': len(index.ambiguous),
+  }))
+
+  checks = {
+    'random_cases_match': not mismatches,
+    'shared_lookup_matches': [result.data for result in indexed] == [result.data for result in expected],
+    # Without several codes matching a key the tie-breaking would not be checked
+    'ambiguous_cases_covered': any(index.ambiguous for index in indexes),
+  }
+  print(json.dumps(checks))
+
+  for case in mismatches[:5]:
+    print(f'{case.key}: {CandidateIndex(case.data).match(case).data} != {mach_key_with_code(case).data}')
+
+  if not all(checks.values()):
+    raise SystemExit('CandidateIndex matched the settlements differently than the scan it replaced!')
+
+
+if __name__ == "__main__":
+  main()
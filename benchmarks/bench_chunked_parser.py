@@ -0,0 +1,113 @@
+#! /usr/bin/env python3.8
+
+"""Intra-table parallel parsing compared with the serial stream, on synthetic tables in all four formats.
+
+Times both and checks that every chunk size gives the settlement records of the serial parser, including chunks
+whose nominal split lands right after an old ОБЛАСТ: header line, which the splitter has to move past.
+
+Usage: python3 -m benchmarks.bench_chunked_parser [--scale 1] [--jobs 2] [--chunk_lines 1 50 1000]
+"""
+import argparse
+import json
+import time
+
+from functools import partial
+from typing import Any, Callable, Dict, List, Tuple
+
+from grao_tables_processing.common.custom_types import DataTuple, HeaderEnum, LineTypeEnum, MunicipalityBlock
+from grao_tables_processing.common.custom_types import TableTypeEnum
+from grao_tables_processing.common.regex_pattern_wrapper import RegexPatternWrapper
+from grao_tables_processing.table_parsing.table_parsing import parallel_settlement_records, split_into_chunks
+from grao_tables_processing.table_parsing.table_parsing import stream_settlement_records
+
+from benchmarks.synthetic_tables import DEFAULT_CSV_PATH, table_lines
+
+
+def records(function: Callable[[DataTuple], DataTuple], data_tuple: DataTuple) -> Tuple[List[MunicipalityBlock], float]:
+  start = time.perf_counter()
+  result = [(municipality_id, list(settlements)) for municipality_id, settlements in function(data_tuple).data]
+
+  return result, time.perf_counter() - start
+
+
+def after_region_header(lines: List[str], header_type: HeaderEnum, table_type: TableTypeEnum) -> int:
+  # The chunk size putting the first nominal split on the line right after an old region header
+  classify_line = RegexPatternWrapper().classify_line
+
+  return next(index + 1 for index, line in enumerate(lines)
+              if classify_line(line, header_type, table_type)[0] == LineTypeEnum.RegionHeader)
+
+
+def splits_after_region_header(lines: List[str], header_type: HeaderEnum, table_type: TableTypeEnum, chunk_lines: int) -> int:
+  classify_line = RegexPatternWrapper().classify_line
+  chunks = split_into_chunks(lines, header_type, table_type, chunk_lines)
+  ends = [chunk[-1] for chunk in chunks[:-1]]
+
+  return sum(classify_line(line, header_type, table_type)[0] == LineTypeEnum.RegionHeader for line in ends)
+
+
+def check_format(
+  header_type: HeaderEnum,
+  table_type: TableTypeEnum,
+  args: argparse.Namespace
+) -> Tuple[List[Dict[str, Any]], Dict[str, bool]]:
+  lines = table_lines(args.csv_path, header_type, table_type, args.scale)
+  data_tuple = DataTuple(lines, header_type, table_type)
+  expected, serial_seconds = records(stream_settlement_records, data_tuple)
+
+  chunk_sizes = args.chunk_lines + [len(lines)]
+  if header_type == HeaderEnum.Old:
+    chunk_sizes.append(after_region_header(lines, header_type, table_type))
+
+  results = []
+  checks = {}
+  for chunk_lines in chunk_sizes:
+    parallel, parallel_seconds = records(partial(parallel_settlement_records, num_jobs=args.jobs, chunk_lines=chunk_lines),
+                                         data_tuple)
+    name = f'{header_type.name}_{table_type.name}_{chunk_lines}'
+
+    checks[name] = parallel == expected and splits_after_region_header(lines, header_type, table_type, chunk_lines) == 0
+    results.append({
+      'table': name,
+      'lines': len(lines),
+      'serial_seconds': serial_seconds,
+      'parallel_seconds': parallel_seconds,
+    })
+
+  return results, checks
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares the parallel table parsing with the serial one")
+  parser.add_argument("--csv_path",
+                      type=str, default=DEFAULT_CSV_PATH,
+                      help="Processed table used as a source of realistic names and numbers.")
+  parser.add_argument("--scale",
+                      type=float, default=1,
+                      help="Size of the synthetic tables relative to a real one.")
+  parser.add_argument("--jobs",
+                      type=int, default=2,
+                      help="Number of processes parsing the chunks.")
+  parser.add_argument("--chunk_lines",
+                      type=int, nargs='+', default=[1, 50, 1000],
+                      help="Chunk sizes checked besides a single chunk for the whole table.")
+  args = parser.parse_args()
+
+  results: List[Dict[str, Any]] = []
+  checks: Dict[str, bool] = {}
+  for header_type in HeaderEnum:
+    for table_type in TableTypeEnum:
+      format_results, format_checks = check_format(header_type, table_type, args)
+      results += format_results
+      checks.update(format_checks)
+
+  for result in results:
+    print(json.dumps(result))
+  print(json.dumps(checks))
+
+  if not all(checks.values()):
+    raise SystemExit('The parallel parsing gave other settlement records than the serial one!')
+
+
+if __name__ == "__main__":
+  main()
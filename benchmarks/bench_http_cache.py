@@ -0,0 +1,235 @@
+#! /usr/bin/env python3.8
+
+"""Cold, warm and offline fetches of synthetic tables through the HTTP cache, against a local stand-in for GRAO's server.
+
+The server answers conditional requests with 304 while a table is unchanged, so no network access is needed. Besides
+the timings the results tell if the cache behaved as expected, the script fails if it did not.
+
+Usage: python3 -m benchmarks.bench_http_cache [--tables 8] [--output results.json]
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+from requests import get as get_request
+
+from grao_tables_processing.common.custom_types import HeaderEnum, OfflineCacheMissError, TableTypeEnum
+from grao_tables_processing.common.http_cache import HTTPCache
+
+from benchmarks.synthetic_tables import DEFAULT_CSV_PATH, synthetic_table
+
+
+ENCODING = 'windows-1251'
+
+
+class TableServer():
+  def __init__(self, bodies: List[bytes], latency: float):
+    self.bodies = bodies
+    self.versions = [0 for _ in bodies]
+    self.latency = latency
+    self.lock = threading.Lock()
+    self.counts = {'full': 0, 'not_modified': 0}
+    self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+    self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+  def handler(self) -> Any:
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        index = int(self.path.rsplit('/', 1)[-1])
+        body, etag = server.table(index)
+        time.sleep(server.latency)
+
+        if self.headers.get('If-None-Match') == etag:
+          server.count('not_modified')
+          self.send_response(304)
+          self.send_header('ETag', etag)
+          self.end_headers()
+          return
+
+        server.count('full')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args: Any):
+        pass
+
+    return Handler
+
+  def table(self, index: int) -> Any:
+    with self.lock:
+      return self.bodies[index], f'"{index}-{self.versions[index]}"'
+
+  def change(self, index: int):
+    with self.lock:
+      self.bodies[index] += b'\r\n'
+      self.versions[index] += 1
+
+  def count(self, name: str):
+    with self.lock:
+      self.counts[name] += 1
+
+  def take_counts(self) -> Dict[str, int]:
+    with self.lock:
+      counts = dict(self.counts)
+      self.counts = {name: 0 for name in counts}
+
+    return counts
+
+  def url(self, index: int) -> str:
+    return f'http://127.0.0.1:{self.httpd.server_address[1]}/tables/{index}'
+
+  def __enter__(self) -> 'TableServer':
+    self.thread.start()
+    return self
+
+  def __exit__(self, *args: Any):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+
+class InterleavedCache(HTTPCache):
+  """Stores the pending responses right after an eviction pass read the index, as a concurrent download could."""
+
+  def __init__(self, directory: str):
+    super().__init__(directory)
+    self.pending: List[Tuple[str, Any]] = []
+
+  def _load_all_entries(self) -> List[Tuple[str, Dict[str, Any]]]:
+    entries = super()._load_all_entries()
+
+    while self.pending:
+      self.store(*self.pending.pop())
+
+    return entries
+
+
+def fetch_all(cache: HTTPCache, server: TableServer, indices: List[int]) -> bool:
+  # True if every table came back as the server has it now
+  return all(cache.fetch(server.url(index), {}, ENCODING).content == server.table(index)[0] for index in indices)
+
+
+def run_phase(name: str, cache: HTTPCache, server: TableServer, indices: List[int]) -> Dict[str, Any]:
+  start = time.perf_counter()
+  try:
+    correct = fetch_all(cache, server, indices)
+  except OfflineCacheMissError:
+    correct = False
+
+  return {'phase': name, 'wall_seconds': time.perf_counter() - start, 'correct': correct, 'server': server.take_counts()}
+
+
+def dangling_entries(cache: HTTPCache) -> int:
+  # Entries whose body is missing or truncated, which the cache would have to download again
+  return sum(cache._load_body(entry) is None for _, entry in cache._load_all_entries())
+
+
+def run_concurrent(directory: str, server: TableServer, threads: int, rounds: int) -> Dict[str, Any]:
+  # The cache holds fewer tables than are fetched, so every download is stored and followed by an eviction
+  cache = HTTPCache(directory, max_size=2 * max(len(body) for body in server.bodies))
+  indices = [index for _ in range(rounds) for index in range(len(server.bodies))]
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=threads) as executor:
+    correct = all(executor.map(lambda index: fetch_all(cache, server, [index]), indices))
+
+  return {
+    'phase': 'concurrent_eviction',
+    'wall_seconds': time.perf_counter() - start,
+    'correct': correct,
+    'dangling_entries': dangling_entries(cache),
+    'server': server.take_counts(),
+  }
+
+
+def run_interleaved(directory: str, server: TableServer) -> Dict[str, Any]:
+  cache = InterleavedCache(directory)
+  fetch_all(cache, server, [0])
+
+  response = get_request(server.url(1))
+  cache.pending.append((server.url(1), response))
+  cache.evict()
+
+  return {
+    'phase': 'interleaved_eviction',
+    'correct': cache.fetch(server.url(1), {}, ENCODING).content == server.table(1)[0],
+    'dangling_entries': dangling_entries(cache),
+    'server': server.take_counts(),
+  }
+
+
+def expected(result: Dict[str, Any], full: int, not_modified: int) -> bool:
+  return result['correct'] and result['server'] == {'full': full, 'not_modified': not_modified}
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Measures the HTTP cache against a local server and checks its behavior")
+  parser.add_argument("--tables",
+                      type=int, default=8,
+                      help="Number of synthetic tables served.")
+  parser.add_argument("--latency",
+                      type=float, default=0.05,
+                      help="Seconds the server takes to answer a request.")
+  parser.add_argument("--threads",
+                      type=int, default=8,
+                      help="Number of threads fetching at once while the cache evicts.")
+  parser.add_argument("--rounds",
+                      type=int, default=10,
+                      help="Number of times every table is fetched while the cache evicts.")
+  parser.add_argument("--csv_path",
+                      type=str, default=DEFAULT_CSV_PATH,
+                      help="Processed table used as a source of realistic names and numbers.")
+  parser.add_argument("--output",
+                      type=str, default=None,
+                      help="Path to a JSON file where the results will be written.")
+  args = parser.parse_args()
+
+  table_types = [(HeaderEnum.New, TableTypeEnum.Quarterly), (HeaderEnum.Old, TableTypeEnum.Yearly)]
+  bodies = [synthetic_table(*table_types[index % 2], scale=0.1, csv_path=args.csv_path).data.content
+            for index in range(args.tables)]
+  indices = list(range(args.tables))
+
+  with TableServer(bodies, args.latency) as server, tempfile.TemporaryDirectory() as directory:
+    cache = HTTPCache(f'{directory}/cache')
+    results = [run_phase('cold', cache, server, indices), run_phase('warm', cache, server, indices)]
+    server.change(0)
+    results.append(run_phase('one_changed', cache, server, indices))
+    results.append(run_phase('offline', HTTPCache(f'{directory}/cache', offline=True), server, indices))
+    results.append(run_concurrent(f'{directory}/concurrent', server, args.threads, args.rounds))
+    results.append(run_interleaved(f'{directory}/interleaved', server))
+
+  cold, warm, changed, offline, concurrent, interleaved = results
+  checks = {
+    'cold_downloads_all': expected(cold, args.tables, 0),
+    'warm_revalidates_all': expected(warm, 0, args.tables),
+    'changed_downloads_one': expected(changed, 1, args.tables - 1),
+    'offline_sends_nothing': expected(offline, 0, 0),
+    'concurrent_keeps_bodies': concurrent['correct'] and concurrent['dangling_entries'] == 0,
+    # The table stored during the eviction is revalidated instead of downloaded again
+    'eviction_keeps_new_body': expected(interleaved, 2, 1) and interleaved['dangling_entries'] == 0,
+  }
+
+  for result in results:
+    print(json.dumps(result))
+  print(json.dumps(checks))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'results': results, 'checks': checks}, f, indent=2)
+
+  if not all(checks.values()):
+    raise SystemExit('The HTTP cache did not behave as expected!')
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,138 @@
+#! /usr/bin/env python3.8
+
+"""Micro-benchmark for the line classification in table_parsing.iter_parsed_lines.
+
+Compares it with the separate header and settlement searches it replaced, timing both and checking that they
+parse the synthetic tables and randomly mixed lines the same way.
+
+Usage: python3 -m benchmarks.bench_line_classifier [--repeat N] [--random_lines N]
+"""
+import argparse
+import json
+import random
+import time
+
+from collections import deque
+from regex import search  # type: ignore
+from typing import Any, Callable, Iterable, Iterator, List, Match, Optional, Tuple, Union
+
+from grao_tables_processing.common.custom_types import HeaderEnum, MunicipalityIdentifier, SettlementInfo, TableTypeEnum
+from grao_tables_processing.common.name_normalization import fix_names
+from grao_tables_processing.common.regex_pattern_wrapper import RegexPatternWrapper
+from grao_tables_processing.table_parsing.table_parsing import iter_parsed_lines, settlement_info_from_groups
+
+from benchmarks.synthetic_tables import DEFAULT_CSV_PATH, header_lines, settlement_line, table_lines
+
+
+ParsedLine = Tuple[int, Union[MunicipalityIdentifier, SettlementInfo]]
+
+
+def parse_data_line(line: str, table_type: TableTypeEnum) -> Optional[SettlementInfo]:
+  if table_type == TableTypeEnum.Quarterly:
+    settlement_info_re = RegexPatternWrapper().settlement_info_quarterly
+  else:
+    settlement_info_re = RegexPatternWrapper().settlement_info_yearly
+
+  settlement_info = None
+  if settlement_info_group := search(settlement_info_re, line):
+    settlement_info = settlement_info_from_groups(settlement_info_group.groups(), table_type)
+
+  return settlement_info
+
+
+def parse_header_line(
+  line: str,
+  header_type: HeaderEnum,
+  old_header_state: Optional[Match]
+) -> Tuple[Optional[MunicipalityIdentifier], Optional[Match]]:
+  region_name = None
+
+  if header_type == HeaderEnum.New and (region_gr := search(RegexPatternWrapper().region_name_new, line)):
+    region_name = MunicipalityIdentifier(region_gr.group(1).strip(), region_gr.group(2).strip())
+
+  elif header_type == HeaderEnum.Old:
+    if old_header_state is None:
+      old_header_state = search(RegexPatternWrapper().old_reg, line)
+    elif mun_gr := search(RegexPatternWrapper().old_mun, line):
+      region_name = MunicipalityIdentifier(fix_names(old_header_state.group(1).strip()), fix_names(mun_gr.group(1).strip()))
+    else:
+      old_header_state = None
+
+  return (region_name, old_header_state)
+
+
+def baseline_parsed_lines(lines: Iterable[str], header_type: HeaderEnum, table_type: TableTypeEnum) -> Iterator[ParsedLine]:
+  """The line by line searches the classifier replaced, kept here as the reference it is measured against."""
+  old_header_state = None
+
+  for line_num, line in enumerate(lines):
+    municipality_id, old_header_state = parse_header_line(line, header_type, old_header_state)
+    if municipality_id:
+      yield (line_num, municipality_id)
+      continue
+
+    settlement_info = parse_data_line(line, table_type)
+    if settlement_info:
+      yield (line_num, settlement_info)
+
+
+def random_lines(count: int, seed: int) -> List[str]:
+  # Headers and settlement rows of all formats, noise, and lines joining two of them, in random order
+  rng = random.Random(seed)
+  fragments = [line for header_type in HeaderEnum for line in header_lines('СОФИЯ', 'СТОЛИЧНА', header_type)]
+  fragments += [settlement_line(name, '120', '95', table_type)
+                for name in ('ГР. СОФИЯ', 'С. ГОРНА-БАНЯ', 'С.ДОЛНИ ЛОЗЕН') for table_type in TableTypeEnum]
+  fragments += ['ТАБЛИЦА НА НАСЕЛЕНИЕТО ПО ПОСТОЯНЕН И НАСТОЯЩ АДРЕС', '| ОБЩО | 12 | 10 |', 'ОБЛАСТ:', 'община']
+
+  return [
+    rng.choice(fragments) if rng.random() < 0.8 else rng.choice(fragments) + rng.choice(fragments)
+    for _ in range(count)
+  ]
+
+
+def measure(parse: Callable[..., Iterable[Any]], lines: List[str], header_type: HeaderEnum, table_type: TableTypeEnum,
+            repeat: int) -> float:
+  start = time.perf_counter()
+  for _ in range(repeat):
+    deque(parse(lines, header_type, table_type), maxlen=0)
+
+  return len(lines) * repeat / (time.perf_counter() - start)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Measures how many lines per second iter_parsed_lines classifies")
+  parser.add_argument("--csv_path",
+                      type=str, default=DEFAULT_CSV_PATH,
+                      help="Processed table used as a source of realistic names and numbers.")
+  parser.add_argument("--repeat",
+                      type=int, default=5,
+                      help="Number of times each table is parsed.")
+  parser.add_argument("--random_lines",
+                      type=int, default=20000,
+                      help="Number of randomly mixed lines checked in every format.")
+  args = parser.parse_args()
+
+  checks = {}
+  for header_type in HeaderEnum:
+    for table_type in TableTypeEnum:
+      lines = table_lines(args.csv_path, header_type, table_type)
+      baseline = measure(baseline_parsed_lines, lines, header_type, table_type, args.repeat)
+      classifier = measure(iter_parsed_lines, lines, header_type, table_type, args.repeat)
+
+      print(f'{header_type.name:>4} {table_type.name:>9}: {baseline:12,.0f} lines/s before, '
+            f'{classifier:12,.0f} lines/s with the classifier ({classifier / baseline:.1f}x)')
+
+      for name, checked_lines in (('table', lines), ('random', random_lines(args.random_lines, seed=int(header_type)))):
+        expected = list(baseline_parsed_lines(checked_lines, header_type, table_type))
+        checks[f'{header_type.name}_{table_type.name}_{name}'] = (
+          list(iter_parsed_lines(checked_lines, header_type, table_type)) == expected
+        )
+
+  print(json.dumps(checks))
+
+  if not all(checks.values()):
+    raise SystemExit('The line classifier parsed the lines differently than the separate searches!')
+
+
+if __name__ == "__main__":
+  main()
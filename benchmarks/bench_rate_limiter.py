@@ -0,0 +1,174 @@
+#! /usr/bin/env python3.8
+
+"""Lookups against a local stand-in for a flaky server, through the adaptive rate limiter or the old fixed sleeps.
+
+The server answers with 503 when more requests than its capacity arrive at once and at random with the given rate,
+so no network access is needed.
+
+Usage: python3 -m benchmarks.bench_rate_limiter [--lookups 60] [--output results.json]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Generator, List
+
+from requests import get as get_request
+
+from grao_tables_processing.common.rate_limiter import AdaptiveRateLimiter, call_with_retries
+
+
+class FlakyServer():
+  def __init__(self, capacity: int, failure_rate: float, latency: float):
+    self.capacity = capacity
+    self.failure_rate = failure_rate
+    self.latency = latency
+    self.lock = threading.Lock()
+    self.active = 0
+    self.counts = {'requests': 0, 'rejected': 0, 'failed': 0}
+    self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+    self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+  def handler(self) -> Any:
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        self.send_response(server.answer())
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+      def log_message(self, *args: Any):
+        pass
+
+    return Handler
+
+  def answer(self) -> int:
+    with self.lock:
+      self.active += 1
+      self.counts['requests'] += 1
+      overloaded = self.active > self.capacity
+
+    # An overloaded server answers slowly and fails, a healthy one fails at random
+    time.sleep(self.latency * (3 if overloaded else 1))
+    failed = not overloaded and random.random() < self.failure_rate
+
+    # Answered from several threads at once, the counts are updated under the lock
+    with self.lock:
+      self.active -= 1
+      self.counts['rejected'] += overloaded
+      self.counts['failed'] += failed
+
+    return 503 if overloaded or failed else 200
+
+  def url(self, index: int) -> str:
+    return f'http://127.0.0.1:{self.httpd.server_address[1]}/lookup?name={index}'
+
+  def __enter__(self) -> 'FlakyServer':
+    self.thread.start()
+    return self
+
+  def __exit__(self, *args: Any):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+
+def lookup(url: str):
+  if get_request(url, timeout=30).status_code != 200:
+    raise ValueError
+
+
+def fixed_sleep_times(random_seed: float) -> Generator[float, None, None]:
+  # The schedule the lookups used to follow, sleeping before the first attempt as well
+  return (st + (st + 1) * random_seed for st in range(round(random_seed), 60, round(5 + 10 * random_seed)))
+
+
+def fixed_sleep_lookup(url: str, time_scale: float) -> bool:
+  for sleep_time in fixed_sleep_times(random.random()):
+    time.sleep(sleep_time * time_scale)
+    try:
+      lookup(url)
+      return True
+    except ValueError:
+      continue
+
+  return False
+
+
+def adaptive_lookup(url: str, limiter: AdaptiveRateLimiter) -> bool:
+  try:
+    call_with_retries(limiter, partial(lookup, url), exceptions=(ValueError,))
+    return True
+  except ValueError:
+    return False
+
+
+def run_strategy(
+  name: str,
+  server: FlakyServer,
+  lookups: int,
+  threads: int,
+  function: Callable[[str], bool]
+) -> Dict[str, Any]:
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=threads) as executor:
+    results: List[bool] = list(executor.map(function, [server.url(index) for index in range(lookups)]))
+
+  return {
+    'strategy': name,
+    'wall_seconds': time.perf_counter() - start,
+    'lookups': lookups,
+    'failed_lookups': results.count(False),
+    'server': dict(server.counts),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares the adaptive rate limiter with the fixed sleeps on a flaky server")
+  parser.add_argument("--lookups",
+                      type=int, default=60,
+                      help="Number of lookups made with every strategy.")
+  parser.add_argument("--capacity",
+                      type=int, default=4,
+                      help="Number of concurrent requests the server answers without rejecting them.")
+  parser.add_argument("--failure_rate",
+                      type=float, default=0.05,
+                      help="Share of the requests the server fails at random.")
+  parser.add_argument("--latency",
+                      type=float, default=0.02,
+                      help="Seconds the server takes to answer a request.")
+  parser.add_argument("--sleep_scale",
+                      type=float, default=1.0,
+                      help="Factor applied to the fixed sleeps, which take seconds each at their full length.")
+  parser.add_argument("--output",
+                      type=str, default=None,
+                      help="Path to a JSON file where the results will be written.")
+  args = parser.parse_args()
+
+  results = []
+
+  with FlakyServer(args.capacity, args.failure_rate, args.latency) as server:
+    fixed_sleep = partial(fixed_sleep_lookup, time_scale=args.sleep_scale)
+    results.append(run_strategy('fixed_sleep', server, args.lookups, 2, fixed_sleep))
+
+  limiter = AdaptiveRateLimiter(slow_seconds=10 * args.latency)
+  with FlakyServer(args.capacity, args.failure_rate, args.latency) as server:
+    adaptive = partial(adaptive_lookup, limiter=limiter)
+    results.append(run_strategy('adaptive', server, args.lookups, limiter.max_concurrency, adaptive))
+    results[-1]['limiter'] = limiter.statistics()._asdict()
+
+  for result in results:
+    print(json.dumps(result))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()
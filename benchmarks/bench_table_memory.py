@@ -0,0 +1,103 @@
+#! /usr/bin/env python3.8
+
+"""Memory held by the per-period and combined tables at every stage of the processing pipeline.
+
+The tables are rendered from the processed tables in grao_data and matched with the EKATTE codes in pickled_data,
+so no network access is needed.
+
+Usage: python3 -m benchmarks.bench_table_memory [--output results.json]
+"""
+import argparse
+import json
+import os
+import pickle
+
+from glob import glob
+from typing import Any, Dict, List, Tuple
+
+from grao_tables_processing.common.custom_types import DataTuple, HeaderEnum, TableTypeEnum
+from grao_tables_processing.table_parsing import create_table_parser
+from grao_tables_processing.table_processing.table_processing import process_data_tuple, update_data_frame
+from grao_tables_processing.table_processing.table_processing import ekatte_key_frame, assemble_combined_matrix, NAME_COLUMNS
+from grao_tables_processing.table_processing.table_schema import compact_data_frames, memory_usage
+from grao_tables_processing.common.pickle_wrapper import PickleWrapper
+
+from benchmarks.synthetic_tables import synthetic_table
+
+
+def period_tables(grao_data_path: str) -> List[Tuple[DataTuple, Any]]:
+  data_source = []
+
+  for csv_path in sorted(glob(f'{grao_data_path}/grao_data_*.csv')):
+    date = os.path.basename(csv_path)[len('grao_data_'):-len('.csv')].replace('_', '-')
+    year = int(date[-4:])
+
+    table_type = TableTypeEnum.Quarterly if '-' in date else TableTypeEnum.Yearly
+    header_type = HeaderEnum.New if table_type == TableTypeEnum.Quarterly else HeaderEnum(year > 2005)
+    response = synthetic_table(header_type, table_type, csv_path=csv_path).data
+
+    data_source.append((DataTuple(date, header_type, table_type), response))
+
+  return data_source
+
+
+def stage_report(stage: str, data_frame_list: List[DataTuple]) -> Dict[str, Any]:
+  return {
+    'stage': stage,
+    'memory_bytes': memory_usage([dt.data for dt in data_frame_list]),
+    'pickled_bytes': len(pickle.dumps(data_frame_list, protocol=pickle.HIGHEST_PROTOCOL)),
+  }
+
+
+def from_worker(data_tuple: DataTuple) -> DataTuple:
+  # Like the results of the parallel jobs, every table arrives pickled and shares no objects with the others
+  return pickle.loads(pickle.dumps(data_tuple, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def run_pipeline(data_source: List[Any], ekatte_keys: Any, compact: bool) -> List[Dict[str, Any]]:
+  def schema(data_frame_list: List[DataTuple]) -> List[DataTuple]:
+    return compact_data_frames(data_frame_list) if compact else data_frame_list
+
+  table_parser: Any = create_table_parser()
+  parsed = schema([from_worker(process_data_tuple((table_parser, dt, response, None))[0]) for dt, response in data_source])
+  disambiguated = schema([from_worker(update_data_frame((dt, ekatte_keys))) for dt in parsed])
+  combined_frame = assemble_combined_matrix([dt.data.drop(labels=NAME_COLUMNS, axis=1) for dt in disambiguated])
+  combined = [DataTuple(combined_frame, HeaderEnum(0), TableTypeEnum(0))]
+
+  return [stage_report('parsed', parsed), stage_report('disambiguated', disambiguated), stage_report('combined', combined)]
+
+
+def main():
+  current_dir = os.path.dirname(os.path.abspath(__file__))
+
+  parser = argparse.ArgumentParser(description="Measures the memory held by the tables at every processing stage")
+  parser.add_argument("--grao_data_path",
+                      type=str, default=f'{current_dir}/../grao_data',
+                      help="Folder with the processed tables the synthetic ones are rendered from.")
+  parser.add_argument("--pickled_data_path",
+                      type=str, default=f'{current_dir}/../pickled_data',
+                      help="Folder with the pickled EKATTE codes of the settlements.")
+  parser.add_argument("--output",
+                      type=str, default=None,
+                      help="Path to a JSON file where the results will be stored.")
+  args = parser.parse_args()
+
+  data_source = period_tables(args.grao_data_path)
+
+  PickleWrapper.configure(args.pickled_data_path)
+  ekatte_keys = ekatte_key_frame(PickleWrapper.load_data('triple_to_ekatte') or {})
+
+  results = []
+  for compact in (False, True):
+    for result in run_pipeline(data_source, ekatte_keys, compact):
+      results.append(dict(result, compact=compact))
+      print(f'{"compact" if compact else "plain":>7} {result["stage"]:>13}: '
+            f'{result["memory_bytes"] / 2 ** 20:8.1f} MiB in memory {result["pickled_bytes"] / 2 ** 20:8.1f} MiB pickled')
+
+  if args.output:
+    with open(args.output, 'w', encoding='utf-8') as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,149 @@
+#! /usr/bin/env python3.8
+
+"""Throughput and peak memory of every stage of table_parsing.table_parser on synthetic tables.
+
+Usage: python3 -m benchmarks.bench_table_parser [--scales 1 10 100] [--output results.json] [--baseline results.json]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from grao_tables_processing.common.custom_types import DataTuple, HeaderEnum, TableTypeEnum
+from grao_tables_processing.table_parsing import create_table_parser
+from grao_tables_processing.table_parsing.table_parsing import raw_table_to_lines, iter_parsed_lines
+from grao_tables_processing.table_parsing.table_parsing import iter_municipality_blocks, municipality_blocks_to_data_frame
+
+from benchmarks.synthetic_tables import DEFAULT_CSV_PATH, synthetic_table
+
+
+Stage = Tuple[str, Callable[[Any], Any]]
+
+
+def table_stages(header_type: HeaderEnum, table_type: TableTypeEnum) -> List[Stage]:
+  # Every stage is materialized, so it is measured on its own and not while the next one consumes it
+  return [
+    ('lines', lambda data_tuple: list(raw_table_to_lines(data_tuple).data)),
+    ('parsed_lines', lambda lines: list(iter_parsed_lines(lines, header_type, table_type))),
+    ('full_info', lambda parsed_lines: list(iter_municipality_blocks(parsed_lines))),
+    ('data_frame', lambda blocks: municipality_blocks_to_data_frame(DataTuple(blocks, header_type, table_type)).data),
+  ]
+
+
+def measure(function: Callable[[Any], Any], value: Any, repeat: int) -> Tuple[Any, float, int]:
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = function(value)
+    best = min(best, time.perf_counter() - start)
+
+  tracemalloc.start()
+  function(value)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return result, best, peak
+
+
+def benchmark_table(header_type: HeaderEnum, table_type: TableTypeEnum, scale: float, repeat: int, csv_path: str):
+  data_tuple = synthetic_table(header_type, table_type, scale, csv_path)
+  line_count = len(data_tuple.data.content.splitlines())
+  results = []
+
+  value: Any = data_tuple
+  stages = table_stages(header_type, table_type) + [('table_parser', None)]
+  for stage, function in stages:
+    if function is None:
+      # The whole pipeline, streaming from the raw table to the DataFrame
+      function, value = create_table_parser(), data_tuple
+
+    value, seconds, peak = measure(function, value, repeat)
+    results.append({
+      'header_type': header_type.name,
+      'table_type': table_type.name,
+      'scale': scale,
+      'stage': stage,
+      'lines': line_count,
+      'seconds': seconds,
+      'lines_per_second': line_count / seconds,
+      'peak_memory_bytes': peak,
+    })
+
+  return results
+
+
+def result_key(result: Dict[str, Any]) -> Tuple[str, str, float, str]:
+  return (result['header_type'], result['table_type'], result['scale'], result['stage'])
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]):
+  previous = {result_key(result): result for result in (baseline or {}).get('results', [])}
+
+  for result in results:
+    line = (f'{result["header_type"]:>4} {result["table_type"]:>9} x{result["scale"]:<6g} {result["stage"]:>13}: '
+            f'{result["lines_per_second"]:12,.0f} lines/s {result["peak_memory_bytes"] / 2 ** 20:9.1f} MiB')
+
+    if (old := previous.get(result_key(result))) is not None:
+      line += (f'  time x{result["seconds"] / old["seconds"]:.2f}'
+               f'  memory x{result["peak_memory_bytes"] / max(old["peak_memory_bytes"], 1):.2f}')
+
+    print(line)
+
+
+def current_commit() -> Optional[str]:
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Measures throughput and peak memory of every table parsing stage")
+  parser.add_argument("--csv_path",
+                      type=str, default=DEFAULT_CSV_PATH,
+                      help="Processed table used as a source of realistic names and numbers.")
+  parser.add_argument("--scales",
+                      type=float, nargs='+', default=[1, 10],
+                      help="Sizes of the synthetic tables relative to a real one, up to 100.")
+  parser.add_argument("--repeat",
+                      type=int, default=3,
+                      help="Number of timed runs of every stage, the fastest one is reported.")
+  parser.add_argument("--output",
+                      type=str, default=None,
+                      help="Path to a JSON file where the results will be stored.")
+  parser.add_argument("--baseline",
+                      type=str, default=None,
+                      help="Path to the JSON results of an earlier run to compare against.")
+  args = parser.parse_args()
+
+  results = [
+    result
+    for scale in args.scales
+    for header_type in HeaderEnum
+    for table_type in TableTypeEnum
+    for result in benchmark_table(header_type, table_type, scale, args.repeat, args.csv_path)
+  ]
+
+  baseline = None
+  if args.baseline:
+    with open(args.baseline, encoding='utf-8') as f:
+      baseline = json.load(f)
+
+  print_results(results, baseline)
+
+  if args.output:
+    with open(args.output, 'w', encoding='utf-8') as f:
+      json.dump({
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'results': results,
+      }, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,90 @@
+"""Synthetic GRAO tables in all four formats, rendered from a processed table."""
+import csv
+import os
+
+from math import ceil
+from typing import Iterator, List
+
+from grao_tables_processing.common.custom_types import DataTuple, HeaderEnum, TableTypeEnum
+
+
+DEFAULT_CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'grao_data', 'grao_data_2019.csv')
+
+
+class SyntheticResponse():
+  """Stands in for the requests.Response of a downloaded table."""
+
+  def __init__(self, content: bytes, encoding: str = 'windows-1251'):
+    self.content = content
+    self.encoding = encoding
+    self.status_code = 200
+
+  @property
+  def text(self) -> str:
+    return self.content.decode(self.encoding)
+
+  def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+    for start in range(0, len(self.content), chunk_size):
+      yield self.content[start:start + chunk_size]
+
+
+def header_lines(region: str, municipality: str, header_type: HeaderEnum) -> List[str]:
+  if header_type == HeaderEnum.New:
+    return ['', f' област {region} община {municipality}', '-' * 60]
+
+  return ['', f' ОБЛАСТ:{region:<30}', f' ОБЩИНА:{municipality:<30}', '-' * 60]
+
+
+def settlement_line(settlement: str, permanent: str, current: str, table_type: TableTypeEnum) -> str:
+  counts = [permanent, permanent, current]
+  if table_type == TableTypeEnum.Yearly:
+    counts = [permanent, permanent, permanent, permanent, current, current]
+
+  return f'|{settlement.replace(". ", "."):<30}|' + ''.join(f'{count:>9} |' for count in counts)
+
+
+def municipality_cut(rows: List[List[str]], limit: int) -> List[List[str]]:
+  # The last municipality starting before the limit is left out, unless it is the first one
+  starts = [index for index in range(1, len(rows)) if rows[index][1:3] != rows[index - 1][1:3]] + [len(rows)]
+
+  return rows[:max([start for start in starts if start <= limit], default=starts[0])]
+
+
+def table_lines(
+  csv_path: str,
+  header_type: HeaderEnum,
+  table_type: TableTypeEnum,
+  scale: float = 1
+) -> List[str]:
+  with open(csv_path, encoding='utf-8') as f:
+    rows = list(csv.reader(f))[1:]
+
+  # Larger tables repeat the real one, all of them are cut at a municipality boundary
+  rows = municipality_cut(rows * ceil(scale), round(len(rows) * scale))
+
+  lines = ['ТАБЛИЦА НА НАСЕЛЕНИЕТО ПО ПОСТОЯНЕН И НАСТОЯЩ АДРЕС', '', '']
+  last_municipality = None
+  for _, region, municipality, settlement, permanent, current in rows:
+    if (region, municipality) != last_municipality:
+      lines += header_lines(region, municipality, header_type)
+      last_municipality = (region, municipality)
+
+    lines.append(settlement_line(settlement, permanent, current, table_type))
+
+  # As in the published tables the parser drops the block after the last header
+  lines += header_lines('ЯМБОЛ', 'ЯМБОЛ', header_type)
+  lines.append(settlement_line('ГР. ЯМБОЛ', '1', '1', table_type))
+
+  return lines
+
+
+def synthetic_table(
+  header_type: HeaderEnum,
+  table_type: TableTypeEnum,
+  scale: float = 1,
+  csv_path: str = DEFAULT_CSV_PATH
+) -> DataTuple:
+  lines = table_lines(csv_path, header_type, table_type, scale)
+  content = '\r\n'.join(['<pre>'] + lines + ['</pre>']).encode('windows-1251')
+
+  return DataTuple(SyntheticResponse(content), header_type, table_type)
@@ -4,20 +4,39 @@
 import argparse
 import os
 
-from typing import Callable, Generic, List, Optional
+from functools import partial
+
+from typing import Callable, Collection, Generic, List, Optional
 from dataclasses import dataclass
 
-from grao_tables_processing.common.custom_types import T, U
+from grao_tables_processing.common.custom_types import DataTuple, ExecutionBackendEnum, T, U
 from grao_tables_processing import Configuration
-from grao_tables_processing import PickleWrapper
-
-from grao_tables_processing import settlement_disambiguation
-from grao_tables_processing import table_parser
-from grao_tables_processing import create_table_processor
+from grao_tables_processing import ArtifactStore
+from grao_tables_processing import HTTPCache
+from grao_tables_processing import StageCheckpoints
+from grao_tables_processing import download_all
+from grao_tables_processing import CSV_COMPRESSIONS, compression_available
+from grao_tables_processing import set_execution_backend_override
+from grao_tables_processing import AdaptiveRateLimiter
+from grao_tables_processing import enable_profiling, write_profile_report, format_profile_summary
+
+from grao_tables_processing import load_ekatte_register
+from grao_tables_processing import create_table_parser
+from grao_tables_processing import check_line_tokenizers
+from grao_tables_processing import create_table_processor, TABLE_PROCESSING_STAGES, ACCUMULATED_ARTIFACTS
+from grao_tables_processing import ProcessedTablesManifest, default_manifest_path
 from grao_tables_processing import create_visualizations
 from grao_tables_processing import update_matched_data, update_all_settlements
 
 
+EXECUTION_BACKENDS = {
+  'serial': ExecutionBackendEnum.Serial,
+  'threads': ExecutionBackendEnum.Threads,
+  'processes': ExecutionBackendEnum.Processes,
+  'shared_memory': ExecutionBackendEnum.SharedMemory,
+}
+
+
 """## Input validation """
 
 
@@ -71,12 +90,139 @@ def signal_for_missing_file(path: str) -> bool:
   return result or False
 
 
+def signal_for_invalid_rate(rate: float) -> bool:
+  result = input_validation_callback(
+    f'ERROR: The download rate must be positive, got {rate}!!!',
+    return_vale=False
+  )
+
+  return result or False
+
+
+def signal_for_missing_compression(compression: str) -> bool:
+  result = input_validation_callback(
+    f'ERROR: The package needed for {compression} compression is missing!!!',
+    return_vale=False
+  )
+
+  return result or False
+
+
 def validate_input(input_list: List[ValidationItem[T]]) -> bool:
   results = [validation_item.execute_action() for validation_item in input_list if not validation_item.execute_check()]
 
   return all(results)
 
 
+def create_http_cache(args: argparse.Namespace) -> Optional[HTTPCache]:
+  if args.no_http_cache:
+    return None
+
+  return HTTPCache(
+    args.http_cache_path,
+    offline=args.offline,
+    max_size=(None if args.http_cache_max_size is None else int(args.http_cache_max_size * 1024 * 1024)),
+    max_age=(None if args.http_cache_max_age is None else args.http_cache_max_age * 24 * 60 * 60)
+  )
+
+
+def create_download_rate_limiter(args: argparse.Namespace) -> AdaptiveRateLimiter:
+  # A rate above the default maximum is kept, it is only raised further while the server answers well
+  return AdaptiveRateLimiter(
+    rate=args.download_rate,
+    max_rate=max(args.download_rate, 20.0),
+    min_rate=min(args.download_rate, 0.1),
+    concurrency=min(2, args.download_jobs_per_host),
+    max_concurrency=args.download_jobs_per_host
+  )
+
+
+def configure_downloads(configuration: Configuration, args: argparse.Namespace, http_cache: Optional[HTTPCache]):
+  configuration['parse_jobs'] = args.parse_jobs
+  set_execution_backend_override(EXECUTION_BACKENDS.get(args.execution_backend))
+
+  if args.download_jobs > 0:
+    configuration['table_downloader'] = partial(
+      download_all,
+      http_cache=http_cache,
+      max_connections=args.download_jobs,
+      per_host_connections=args.download_jobs_per_host,
+      timeout=args.download_timeout,
+      rate_limiter=(None if args.download_rate is None else create_download_rate_limiter(args))
+    )
+
+
+def create_ekatte_register(args: argparse.Namespace):
+  if args.ekatte_register_path is None:
+    return None
+
+  register = load_ekatte_register(args.ekatte_register_path)
+  print(f'Loaded {len(register)} settlement names from the EKATTE register at {args.ekatte_register_path}')
+
+  return register
+
+
+def create_processed_tables_manifest(args: argparse.Namespace) -> Optional[ProcessedTablesManifest]:
+  if args.no_incremental:
+    return None
+
+  path = args.processed_tables_manifest_path or default_manifest_path(args.processed_tables_path)
+
+  if args.reprocess_all:
+    # Every table is parsed again and the manifest is rewritten from scratch
+    return ProcessedTablesManifest(path)
+
+  return ProcessedTablesManifest.load(path)
+
+
+def evict_stale_artifacts(store: ArtifactStore, args: argparse.Namespace, protected: Collection[str] = ()):
+  if args.pickled_data_max_age is None:
+    return
+
+  evicted = store.evict(args.pickled_data_max_age * 24 * 60 * 60, protected)
+  if evicted:
+    print(f'Evicted {len(evicted)} pickled objects older than {args.pickled_data_max_age} days from {store.directory}')
+
+
+def create_artifact_store(args: argparse.Namespace) -> ArtifactStore:
+  store = ArtifactStore(args.pickled_data_path, args.compress_pickled_data)
+  evict_stale_artifacts(store, args, ACCUMULATED_ARTIFACTS)
+
+  return store
+
+
+def create_stage_checkpoints(args: argparse.Namespace) -> Optional[StageCheckpoints]:
+  if args.no_checkpoints:
+    return None
+
+  checkpoints = StageCheckpoints(
+    os.path.join(args.pickled_data_path, 'checkpoints'),
+    from_stage=args.from_stage,
+    until_stage=args.until_stage,
+    compress=args.compress_pickled_data
+  )
+  evict_stale_artifacts(checkpoints.artifacts, args)
+
+  return checkpoints
+
+
+def process_tables(configuration: Configuration, data_source: List[DataTuple], args: argparse.Namespace):
+  profile = args.profile or args.profile_stage is not None or args.profile_memory
+
+  if profile:
+    # Before any worker process is started, so they inherit it
+    enable_profiling(args.profile_path, args.profile_stage, args.profile_memory)
+
+  processing_pipeline = create_table_processor(configuration)
+
+  processing_pipeline(data_source)
+
+  if profile:
+    report = write_profile_report(args.profile_path)
+    print(format_profile_summary(report))
+    print(f'Profile report written to {os.path.join(args.profile_path, "report.json")}')
+
+
 def main():
 
   current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -91,7 +237,39 @@ def main():
       --combined_tables_path <path to folder>
       --visualizations_path <path to folder>
       --pickled_data_path <path to folder>
+      --compress_pickled_data
+      --pickled_data_max_age <age in days>
       --credentials_path <path to file>
+      --ekatte_register_path <path to file>
+      --nsi_lookup_jobs <number of requests>
+      --retry_unmatched_lookups
+      --http_cache_path <path to folder>
+      --http_cache_max_size <size in MB>
+      --http_cache_max_age <age in days>
+      --offline
+      --download_jobs <number of parallel downloads>
+      --download_jobs_per_host <number of parallel downloads>
+      --download_timeout <seconds>
+      --download_rate <downloads per second>
+      --parse_jobs <number of processes>
+      --parse_chunk_jobs <number of processes>
+      --parse_chunk_lines <number of lines>
+      --execution_backend <serial|threads|processes|shared_memory>
+      --processed_tables_manifest_path <path to file>
+      --reprocess_all
+      --no_incremental
+      --binary_tables
+      --compress_tables <gzip|zstd>
+      --write_jobs <number of threads>
+      --from_stage <stage name>
+      --until_stage <stage name>
+      --no_checkpoints
+      --low_memory
+      --profile
+      --profile_path <path to folder>
+      --profile_stage <stage name>
+      --profile_memory
+      --check_line_tokenizer
       --produce_graphics
       --update_wiki_data
   """
@@ -118,9 +296,127 @@ def main():
   parser.add_argument("--pickled_data_path",
                       type=str, default=f'{current_dir}/pickled_data',
                       help="Path to the folder where pickled objects will be stored.")
+  parser.add_argument("--compress_pickled_data",
+                      default=False, action="store_true",
+                      help="If set the pickled objects will be compressed with gzip instead of stored with their arrays "
+                           "memory mappable.")
+  parser.add_argument("--pickled_data_max_age",
+                      type=float, default=None,
+                      help="Maximum age in days of the pickled intermediate objects and checkpoints before they are "
+                           "evicted, the evicted ones are computed again. The EKATTE codes and the NSI lookups "
+                           "accumulated over the runs are kept.")
   parser.add_argument("--credentials_path",
                       type=str, default=f'{current_dir}/credentials/wd_credentials.csv',
                       help="Path to the file containing credentials.")
+  parser.add_argument("--ekatte_register_path",
+                      type=str, default=None,
+                      help="Path to a CSV export of the EKATTE register with the columns ekatte, region, municipality, "
+                           "settlement, valid_from and valid_to, from which the settlements are resolved offline. "
+                           "Only the settlements missing from it are looked up on NSI's website.")
+  parser.add_argument("--nsi_lookup_jobs",
+                      type=int, default=8,
+                      help="Maximum number of settlement lookups in flight on NSI's website, fewer are sent while it "
+                           "fails or answers slowly.")
+  parser.add_argument("--retry_unmatched_lookups",
+                      action='store_true',
+                      help="Looks up again on NSI's website the stored names that match none of the settlements "
+                           "sharing them. Without it the stored lookups are used as they are.")
+  parser.add_argument("--http_cache_path",
+                      type=str, default=f'{current_dir}/http_cache',
+                      help="Path to the folder where downloaded tables are cached between runs.")
+  parser.add_argument("--http_cache_max_size",
+                      type=float, default=None,
+                      help="Maximum size of the download cache in MB, older entries are evicted first.")
+  parser.add_argument("--http_cache_max_age",
+                      type=float, default=None,
+                      help="Maximum age in days of the cached downloads before they are evicted.")
+  parser.add_argument("--no_http_cache",
+                      default=False, action="store_true",
+                      help="If set the tables will always be downloaded and the download cache will not be used.")
+  parser.add_argument("--offline",
+                      default=False, action="store_true",
+                      help="If set the tables will only be read from the download cache without network access.")
+  parser.add_argument("--download_jobs",
+                      type=int, default=8,
+                      help="Number of tables downloaded concurrently over a shared connection pool. "
+                           "If 0 every parsing process downloads its own table.")
+  parser.add_argument("--download_jobs_per_host",
+                      type=int, default=4,
+                      help="Maximum number of concurrent downloads from a single host.")
+  parser.add_argument("--download_timeout",
+                      type=float, default=60,
+                      help="Timeout in seconds for connecting to and reading from the server.")
+  parser.add_argument("--download_rate",
+                      type=float, default=None,
+                      help="Number of downloads started per second at first, raised while the server answers quickly "
+                           "and lowered when it fails or slows down. Unlimited if not set.")
+  parser.add_argument("--parse_jobs",
+                      type=int, default=-1,
+                      help="Number of processes parsing the downloaded tables, -1 uses all CPUs.")
+  parser.add_argument("--parse_chunk_jobs",
+                      type=int, default=1,
+                      help="Number of processes parsing parts of a single table split at municipality boundaries. "
+                           "Useful together with --parse_jobs 1 when few tables are parsed on many cores.")
+  parser.add_argument("--parse_chunk_lines",
+                      type=int, default=1000,
+                      help="Minimum number of lines in a part of a table parsed by a single process.")
+  parser.add_argument("--execution_backend",
+                      type=str, default=None, choices=list(EXECUTION_BACKENDS),
+                      help="Backend used by every parallel step instead of the one chosen for it, "
+                           "serial is useful for debugging and shared_memory for large tables on many cores.")
+  parser.add_argument("--processed_tables_manifest_path",
+                      type=str, default=None,
+                      help="Path to the JSON file recording which version of every table was processed. "
+                           "Defaults to a file next to the processed tables folder.")
+  parser.add_argument("--reprocess_all",
+                      default=False, action="store_true",
+                      help="If set all tables will be parsed again even if they did not change since the last run.")
+  parser.add_argument("--no_incremental",
+                      default=False, action="store_true",
+                      help="If set all tables will be parsed again and no manifest will be written.")
+  parser.add_argument("--binary_tables",
+                      default=False, action="store_true",
+                      help="If set the processed and combined tables will also be stored as a memory mapped NumPy matrix "
+                           "with a JSON index next to every CSV, which is preferred over the CSV when loading them.")
+  parser.add_argument("--compress_tables",
+                      type=str, default=None, choices=CSV_COMPRESSIONS,
+                      help="Compression of the stored CSV tables, zstd requires the zstandard package.")
+  parser.add_argument("--write_jobs",
+                      type=int, default=4,
+                      help="Number of threads writing the processed tables, -1 uses one per CPU.")
+  parser.add_argument("--from_stage",
+                      type=str, default=None, choices=TABLE_PROCESSING_STAGES,
+                      help="Stage from which the processing is run again, earlier stages are resumed from their "
+                           "checkpoints when the inputs did not change.")
+  parser.add_argument("--until_stage",
+                      type=str, default=None, choices=TABLE_PROCESSING_STAGES,
+                      help="Last stage of the processing that is run.")
+  parser.add_argument("--no_checkpoints",
+                      default=False, action="store_true",
+                      help="If set the outputs of the processing stages will not be checkpointed and resumed.")
+  parser.add_argument("--low_memory",
+                      default=False, action="store_true",
+                      help="If set the tables will be parsed, matched, stored and combined one at a time, so only one "
+                           "of them and the combined table are held in memory. The stages are not checkpointed.")
+  parser.add_argument("--profile",
+                      default=False, action="store_true",
+                      help="If set the wall time, CPU time, memory and row counts of every stage of the table parser, "
+                           "the settlement disambiguation and the table processing will be recorded and reported.")
+  parser.add_argument("--profile_path",
+                      type=str, default=f'{current_dir}/profile',
+                      help="Path to the folder where the profiling records and the JSON report will be stored.")
+  parser.add_argument("--profile_stage",
+                      type=str, default=None,
+                      help="Name of a single stage, like parse or table_parser.raw_table_to_lines, for which a cProfile "
+                           "file is dumped on every run of it. Implies --profile.")
+  parser.add_argument("--profile_memory",
+                      default=False, action="store_true",
+                      help="If set the peak memory of every stage is traced with tracemalloc, which slows it down. "
+                           "Implies --profile.")
+  parser.add_argument("--check_line_tokenizer",
+                      default=False, action="store_true",
+                      help="If set the script will only compare the streaming line tokenizer with the BeautifulSoup one "
+                           "on the configured tables and exit.")
   parser.add_argument("--produce_graphics",
                       default=False, action="store_true",
                       help="If set the script will produce graphics from the processed tables.")
@@ -151,14 +447,24 @@ def main():
                    os.path.exists),
     ValidationItem(args.credentials_path,
                    signal_for_missing_file,
-                   os.path.exists)
+                   os.path.exists),
+    ValidationItem(args.ekatte_register_path,
+                   signal_for_missing_file,
+                   (lambda path: path is None or os.path.exists(path))),
+    ValidationItem(args.compress_tables,
+                   signal_for_missing_compression,
+                   compression_available),
+    ValidationItem(args.download_rate,
+                   signal_for_invalid_rate,
+                   (lambda rate: rate is None or rate > 0)),
+    ValidationItem(args.http_cache_path,
+                   make_dir,
+                   (lambda path: args.no_http_cache or os.path.exists(path)))
   ])
 
   if not validation_result:
     exit(1)
 
-  PickleWrapper.configure(args.pickled_data_path)
-
   configuration = Configuration(
     args.data_configuration_path,
     args.processed_tables_path,
@@ -169,13 +475,29 @@ def main():
     args.credentials_path
   )
 
-  configuration['settlement_disambiguation'] = settlement_disambiguation
-  configuration['table_parser'] = table_parser
+  http_cache = create_http_cache(args)
+
+  configuration['artifact_store'] = create_artifact_store(args)
+  configuration['nsi_lookup_jobs'] = args.nsi_lookup_jobs
+  configuration['retry_unmatched_lookups'] = args.retry_unmatched_lookups
+  configuration['ekatte_register_path'] = args.ekatte_register_path
+  configuration['ekatte_register'] = create_ekatte_register(args)
+  configuration['table_parser'] = create_table_parser(http_cache, args.parse_chunk_jobs, args.parse_chunk_lines)
+  configuration['http_cache'] = http_cache
+  configuration['processed_tables_manifest'] = create_processed_tables_manifest(args)
+  configuration['binary_tables'] = args.binary_tables
+  configuration['csv_compression'] = args.compress_tables
+  configuration['write_jobs'] = args.write_jobs
+  configuration['stage_checkpoints'] = create_stage_checkpoints(args)
+  configuration['low_memory'] = args.low_memory
+  configure_downloads(configuration, args, http_cache)
 
-  processing_pipeline = create_table_processor(configuration)
   data_source = configuration.process_data_configuration()
 
-  processing_pipeline(data_source)
+  if args.check_line_tokenizer:
+    exit(0 if check_line_tokenizers(data_source, http_cache) else 1)
+
+  process_tables(configuration, data_source, args)
 
   if args.produce_graphics:
     create_visualizations(configuration)
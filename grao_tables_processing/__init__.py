@@ -1,5 +1,13 @@
 import grao_tables_processing.common.configuration as cnf
+import grao_tables_processing.common.http_cache as hc
+import grao_tables_processing.common.async_downloader as ad
 import grao_tables_processing.common.pickle_wrapper as pw
+import grao_tables_processing.common.artifact_store as ars
+import grao_tables_processing.common.table_files as tf
+import grao_tables_processing.common.stage_checkpoints as sc
+import grao_tables_processing.common.profiling as prf
+import grao_tables_processing.common.helper_functions as hf
+import grao_tables_processing.common.rate_limiter as rl
 
 import grao_tables_processing.settlement_disambiguation as sd
 import grao_tables_processing.table_parsing as tpr
@@ -10,10 +18,28 @@ import grao_tables_processing.wikidata_interaction as wi
 
 Configuration = cnf.Configuration
 PickleWrapper = pw.PickleWrapper
+ArtifactStore = ars.ArtifactStore
+CSV_COMPRESSIONS = tf.CSV_COMPRESSIONS
+compression_available = tf.compression_available
+HTTPCache = hc.HTTPCache
+StageCheckpoints = sc.StageCheckpoints
+download_all = ad.download_all
+set_execution_backend_override = hf.set_execution_backend_override
+AdaptiveRateLimiter = rl.AdaptiveRateLimiter
+shared_rate_limiter = rl.shared_rate_limiter
+enable_profiling = prf.enable_profiling
+write_profile_report = prf.write_profile_report
+format_profile_summary = prf.format_profile_summary
 
-settlement_disambiguation = sd.settlement_disambiguation
+load_ekatte_register = sd.load_ekatte_register
 table_parser = tpr.table_parser
+create_table_parser = tpr.create_table_parser
+check_line_tokenizers = tpr.check_line_tokenizers
 create_table_processor = tp.create_table_processor
+TABLE_PROCESSING_STAGES = tp.TABLE_PROCESSING_STAGES
+ACCUMULATED_ARTIFACTS = tp.ACCUMULATED_ARTIFACTS
+ProcessedTablesManifest = tp.ProcessedTablesManifest
+default_manifest_path = tp.default_manifest_path
 create_visualizations = v.create_visualizations
 update_matched_data = wi.update_matched_data
 update_all_settlements = wi.update_all_settlements
@@ -0,0 +1,171 @@
+import gzip
+import json
+import mmap
+import pickle
+import struct
+import time
+
+from io import BytesIO
+from os import listdir, remove
+from os.path import exists, getmtime, getsize, join
+from typing import Any, BinaryIO, Collection, Dict, List, Optional
+
+from grao_tables_processing.common.helper_functions import write_atomically
+
+
+# Arrays at least this large are written after the pickle stream and memory mapped when loaded
+OUT_OF_BAND_MIN_BYTES = 64 * 1024
+MAPPED_MAGIC = b'GRAOART1'
+GZIP_MAGIC = b'\x1f\x8b'
+ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+  return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def mapped_pickle(data: Any) -> bytes:
+  """Pickles the data with the large arrays laid out after the stream, so they can be mapped instead of copied."""
+  buffers: List[pickle.PickleBuffer] = []
+
+  def in_band(buffer: pickle.PickleBuffer) -> bool:
+    if buffer.raw().nbytes < OUT_OF_BAND_MIN_BYTES:
+      return True
+
+    buffers.append(buffer)
+    return False
+
+  stream = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL, buffer_callback=in_band)
+
+  if not buffers:
+    # A plain pickle, readable without the store
+    return stream
+
+  header_size = len(MAPPED_MAGIC) + struct.calcsize('<QQ') * (len(buffers) + 1)
+  content = BytesIO()
+  content.seek(_aligned(header_size + len(stream)))
+  layout = []
+
+  for buffer in buffers:
+    layout.append((content.tell(), buffer.raw().nbytes))
+    content.write(buffer.raw())
+    content.seek(_aligned(content.tell()))
+
+  content.seek(0)
+  content.write(MAPPED_MAGIC + struct.pack('<QQ', len(stream), len(buffers)))
+  content.write(b''.join(struct.pack('<QQ', offset, size) for offset, size in layout))
+  content.write(stream)
+
+  return content.getvalue()
+
+
+def load_mapped_pickle(f: BinaryIO) -> Any:
+  # Copy on write pages, so the arrays are writable without touching the file
+  mapped = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+  offset = len(MAPPED_MAGIC)
+  stream_size, buffer_count = struct.unpack_from('<QQ', mapped, offset)
+  layout = [struct.unpack_from('<QQ', mapped, offset + 16 * (index + 1)) for index in range(buffer_count)]
+  stream_start = offset + 16 * (buffer_count + 1)
+
+  return pickle.loads(mapped[stream_start:stream_start + stream_size],
+                      buffers=[mapped[start:start + size] for start, size in layout])
+
+
+class ArtifactStore():
+  """Named artifacts pickled into a directory, each replaced atomically and described by a JSON file next to it."""
+
+  def __init__(self, directory: str, compress: bool = False):
+    self.directory = directory
+    self.compress = compress
+
+  def data_path(self, name: str) -> str:
+    return join(self.directory, f'{name}.pkl')
+
+  def metadata_path(self, name: str) -> str:
+    return join(self.directory, f'{name}.json')
+
+  def contains(self, name: str) -> bool:
+    return exists(self.data_path(name))
+
+  def names(self) -> List[str]:
+    if not exists(self.directory):
+      return []
+
+    return sorted(file_name[:-len('.pkl')] for file_name in listdir(self.directory)
+                  if file_name.endswith('.pkl') and not file_name.startswith('.'))
+
+  def store(self, name: str, data: Any, source_hash: Optional[str] = None):
+    if self.compress:
+      content = gzip.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=6, mtime=0)
+    else:
+      content = mapped_pickle(data)
+
+    write_atomically(self.data_path(name), content)
+
+    metadata = {
+      'created_at': time.time(),
+      'source_hash': source_hash,
+      'size': len(content),
+      'compressed': self.compress,
+      'protocol': pickle.HIGHEST_PROTOCOL,
+    }
+    write_atomically(self.metadata_path(name), json.dumps(metadata).encode('utf-8'))
+
+  def load(self, name: str) -> Optional[Any]:
+    path = self.data_path(name)
+
+    if not exists(path):
+      return None
+
+    with open(path, 'rb') as f:
+      magic = f.read(len(MAPPED_MAGIC))
+      f.seek(0)
+
+      if magic == MAPPED_MAGIC:
+        return load_mapped_pickle(f)
+
+      if magic.startswith(GZIP_MAGIC):
+        with gzip.open(f) as decompressed:
+          return pickle.load(decompressed)
+
+      return pickle.load(f)
+
+  def metadata(self, name: str) -> Optional[Dict[str, Any]]:
+    path = self.metadata_path(name)
+
+    if not exists(path) or not self.contains(name):
+      return None
+
+    with open(path, encoding='utf-8') as f:
+      metadata = json.load(f)
+
+    # Left from an earlier version when the process stopped between writing the artifact and its metadata
+    return metadata if metadata.get('size') == getsize(self.data_path(name)) else None
+
+  def remove(self, name: str):
+    for path in (self.data_path(name), self.metadata_path(name)):
+      if exists(path):
+        remove(path)
+
+  def evict(self, max_age: float, protected: Collection[str] = ()) -> List[str]:
+    """Removes the artifacts and the leftovers of interrupted writes older than max_age seconds.
+
+    The protected artifacts are kept regardless of their age.
+    """
+    now = time.time()
+    evicted = [name for name in self.names() if name not in protected and now - self._created_at(name) > max_age]
+
+    for name in evicted:
+      self.remove(name)
+
+    for file_name in listdir(self.directory) if exists(self.directory) else []:
+      path = join(self.directory, file_name)
+      if file_name.startswith('.tmp-') and now - getmtime(path) > max_age:
+        remove(path)
+
+    return evicted
+
+  def _created_at(self, name: str) -> float:
+    metadata = self.metadata(name)
+
+    return metadata['created_at'] if metadata is not None else getmtime(self.data_path(name))
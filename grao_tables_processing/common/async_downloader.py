@@ -0,0 +1,71 @@
+import asyncio
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+
+from grao_tables_processing.common.custom_types import FailedDownload, OfflineCacheMissError, TableDownloadError
+from grao_tables_processing.common.helper_functions import fetch_raw_data
+from grao_tables_processing.common.rate_limiter import AdaptiveRateLimiter, call_with_retries
+
+
+def create_session(max_connections: int) -> Session:
+  # A single keep-alive pool shared by all downloads
+  adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+  session = Session()
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+
+  return session
+
+
+def fetch_table(url: str, http_cache: Optional[Any], session: Session, timeout: Optional[float]) -> Any:
+  response = fetch_raw_data(url, cache=http_cache, session=session, timeout=timeout)
+
+  # Raised inside the limited call, so the limiter counts the throttled and failed downloads
+  if response.status_code != 200:
+    raise TableDownloadError(f'status {response.status_code}')
+
+  return response
+
+
+async def _download_all(
+  urls: List[str],
+  http_cache: Optional[Any],
+  max_connections: int,
+  per_host_connections: int,
+  timeout: Optional[float],
+  rate_limiter: Optional[AdaptiveRateLimiter]
+) -> List[Any]:
+  loop = asyncio.get_running_loop()
+  host_limits: Dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(per_host_connections))
+
+  with create_session(max_connections) as session, ThreadPoolExecutor(max_workers=max_connections) as executor:
+    async def download(url: str) -> Any:
+      async with host_limits[urlparse(url).netloc]:
+        fetch = partial(fetch_table, url, http_cache, session, timeout)
+        if rate_limiter is not None:
+          fetch = partial(call_with_retries, rate_limiter, fetch, retries=0)
+        try:
+          return await loop.run_in_executor(executor, fetch)
+        except (TableDownloadError, RequestException, OfflineCacheMissError) as error:
+          return FailedDownload(url, str(error))
+
+    # A failed table does not stop the others, it is skipped when the tables are parsed
+    return await asyncio.gather(*(download(url) for url in urls))
+
+
+def download_all(
+  urls: List[str],
+  http_cache: Optional[Any] = None,
+  max_connections: int = 8,
+  per_host_connections: int = 4,
+  timeout: Optional[float] = 60,
+  rate_limiter: Optional[AdaptiveRateLimiter] = None
+) -> List[Any]:
+  return asyncio.run(_download_all(urls, http_cache, max_connections, per_host_connections, timeout, rate_limiter))
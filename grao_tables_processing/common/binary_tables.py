@@ -0,0 +1,92 @@
+import json
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from io import BytesIO
+from os import remove
+from os.path import exists, splitext
+from typing import Optional, Tuple
+
+from grao_tables_processing.common.table_files import existing_csv_path, write_if_changed
+
+
+def binary_table_paths(csv_path: str) -> Tuple[str, str]:
+  base, _ = splitext(csv_path)
+
+  return (f'{base}.npy', f'{base}.json')
+
+
+def has_binary_table(csv_path: str) -> bool:
+  # The index is written last, so a table without it is incomplete
+  return all(exists(path) for path in binary_table_paths(csv_path))
+
+
+def store_binary_table(df: pd.DataFrame, csv_path: str) -> bool:
+  """The integer columns go to a .npy matrix, the index and the text columns to a JSON file next to it."""
+  npy_path, index_path = binary_table_paths(csv_path)
+  value_columns = [column for column in df.columns if pd.api.types.is_integer_dtype(df[column])]
+  label_columns = [column for column in df.columns if column not in value_columns]
+
+  buffer = BytesIO()
+  np.save(buffer, np.ascontiguousarray(df[value_columns].to_numpy(dtype=np.int32)))
+  changed = write_if_changed(npy_path, buffer.getvalue())
+
+  index = {
+    'index_name': df.index.name,
+    'index': df.index.astype(str).tolist(),
+    'columns': df.columns.tolist(),
+    'value_columns': value_columns,
+    'labels': {column: df[column].astype(str).tolist() for column in label_columns},
+  }
+  changed = write_if_changed(index_path, json.dumps(index, ensure_ascii=False).encode('utf-8')) or changed
+
+  return changed
+
+
+def remove_binary_table(csv_path: str):
+  # A binary table left from an earlier run would be preferred over the newer CSV
+  for path in reversed(binary_table_paths(csv_path)):
+    if exists(path):
+      remove(path)
+
+
+def load_binary_table(csv_path: str) -> Optional[pd.DataFrame]:
+  if not has_binary_table(csv_path):
+    return None
+
+  npy_path, index_path = binary_table_paths(csv_path)
+  with open(index_path, encoding='utf-8') as f:
+    index = json.load(f)
+
+  # The matrix is memory mapped and the frame is built on top of it without copying
+  values = np.load(npy_path, mmap_mode='r')
+  df = pd.DataFrame(values, index=pd.Index(index['index'], name=index['index_name']), columns=index['value_columns'])
+
+  # Inserted at their places, selecting the columns in order would copy the mapped values
+  for position, column in enumerate(index['columns']):
+    if column in index['labels']:
+      df.insert(position, column, index['labels'][column])
+
+  return df
+
+
+def indexed_by(df: pd.DataFrame, index_name: str) -> pd.DataFrame:
+  if df.index.name == index_name:
+    return df
+
+  # Indexed by the column as it is read from the CSV, where the index is text
+  df = df.reset_index().set_index(index_name)
+  df.index = df.index.astype(str)
+
+  return df
+
+
+def read_table(csv_path: str, index_name: str) -> pd.DataFrame:
+  df = load_binary_table(csv_path)
+
+  if df is not None:
+    df = indexed_by(df, index_name)
+  else:
+    df = pd.read_csv(existing_csv_path(csv_path) or csv_path, index_col=index_name, dtype={index_name: str})
+
+  return df
@@ -1,6 +1,6 @@
 from enum import IntEnum
 from datetime import datetime as dt_class
-from typing import Any, Dict, Tuple, TypeVar, NamedTuple
+from typing import Any, Callable, List, Optional, Tuple, TypeVar, NamedTuple
 
 
 class HeaderEnum(IntEnum):
@@ -13,6 +13,21 @@ class TableTypeEnum(IntEnum):
   Yearly = 1
 
 
+class LineTypeEnum(IntEnum):
+  Noise = 0
+  RegionHeader = 1
+  MunicipalityHeader = 2
+  Settlement = 3
+
+
+class ExecutionBackendEnum(IntEnum):
+  Serial = 0
+  Threads = 1
+  Processes = 2
+  # Processes receiving the NumPy arrays of their inputs memory mapped from shared memory instead of pickled
+  SharedMemory = 3
+
+
 class DataTuple(NamedTuple):
   data: Any
   header_type: HeaderEnum
@@ -30,6 +45,14 @@ class SettlementNamesForPeriod(NamedTuple):
   end: dt_class
 
 
+class CandidateName(NamedTuple):
+  region: str
+  municipality: str
+  start: dt_class
+  end: dt_class
+  code: str
+
+
 class MunicipalityIdentifier(NamedTuple):
   region: str
   municipality: str
@@ -41,17 +64,43 @@ class SettlementInfo(NamedTuple):
   current_residents: int
 
 
-class FullSettlementInfo(NamedTuple):
-  region: str
-  municipality: str
-  settlement: str
-  permanent_residents: int
-  current_residents: int
+MunicipalityBlock = Tuple[MunicipalityIdentifier, List[SettlementInfo]]
+
 
+class ParsedChunk(NamedTuple):
+  leading_settlements: List[SettlementInfo]
+  blocks: List[MunicipalityBlock]
+  open_block: Optional[MunicipalityBlock]
 
-class ParsedLines(NamedTuple):
-  municipality_ids: Dict[int, MunicipalityIdentifier]
-  settlements_info: Dict[int, SettlementInfo]
+
+class FailedDownload(NamedTuple):
+  url: str
+  reason: str
+
+
+class DownloadedTables(NamedTuple):
+  data_source: List[DataTuple]
+  responses: List[Optional[Any]]
+
+
+class Stage(NamedTuple):
+  name: str
+  function: Callable[[Any], Any]
+  checkpointed: bool = True
+  # Replaces the key chained from the earlier stages with one computed from the output, None if it is not known
+  fingerprint: Optional[Callable[[Any], Optional[str]]] = None
+  # Fingerprints what the stage reads besides its input, like files stored by earlier runs, as it leaves them
+  inputs_fingerprint: Optional[Callable[[], str]] = None
+
+
+class RateLimiterStatistics(NamedTuple):
+  requests: int
+  failures: int
+  slow_requests: int
+  retries: int
+  waited_seconds: float
+  rate: float
+  concurrency: float
 
 
 T = TypeVar('T')
@@ -60,3 +109,11 @@ U = TypeVar('U')
 
 class UnexpectedNoneError(Exception):
   pass
+
+
+class OfflineCacheMissError(Exception):
+  pass
+
+
+class TableDownloadError(Exception):
+  pass
@@ -1,101 +1,116 @@
-from typing import Any, Callable, Optional, List, Generator
-from joblib import Parallel, delayed  # type: ignore
+from typing import Any, Callable, Dict, Optional, List, Generator, Tuple
+from os import chmod, environ, makedirs, replace
+from os.path import dirname, exists
+from tempfile import NamedTemporaryFile
+from joblib import Parallel, delayed, effective_n_jobs  # type: ignore
+from joblib.externals.loky import get_reusable_executor  # type: ignore
 from requests import get as get_request
 from requests.utils import default_headers
 
-from grao_tables_processing.common.custom_types import T, U
+from grao_tables_processing.common.custom_types import ExecutionBackendEnum, T, U
+from grao_tables_processing.common.name_normalization import fix_names  # noqa: F401
+
+
+# Temporary files are private, the written ones are readable by everyone like the rest of the outputs
+FILE_MODE = 0o644
+
+# Set in the environment, so nested calls in the worker processes follow it as well
+EXECUTION_BACKEND_VARIABLE = 'GRAO_EXECUTION_BACKEND'
+
+JOBLIB_BACKEND_OPTIONS: Dict[ExecutionBackendEnum, Dict[str, Any]] = {
+  ExecutionBackendEnum.Threads: {'prefer': 'threads'},
+  ExecutionBackendEnum.Processes: {},
+  # Every array above 1KB is dumped once to a shared memory backed file and memory mapped by the workers
+  ExecutionBackendEnum.SharedMemory: {'backend': 'loky', 'max_nbytes': '1K', 'mmap_mode': 'r'},
+}
+
+
+def set_execution_backend_override(backend: Optional[ExecutionBackendEnum]):
+  if backend is None:
+    environ.pop(EXECUTION_BACKEND_VARIABLE, None)
+  else:
+    environ[EXECUTION_BACKEND_VARIABLE] = backend.name
+
+
+def execution_backend(backend: ExecutionBackendEnum) -> ExecutionBackendEnum:
+  override = environ.get(EXECUTION_BACKEND_VARIABLE)
+
+  return ExecutionBackendEnum[override] if override else backend
 
 
 def execute_in_parallel(
   function: Callable[[T], U],
   data_source: Generator[T, None, None],
-  num_jobs: int = -1
+  num_jobs: int = -1,
+  backend: ExecutionBackendEnum = ExecutionBackendEnum.Processes,
+  initializer: Optional[Callable[..., None]] = None,
+  initargs: Tuple[Any, ...] = ()
 ) -> Optional[List[U]]:
+  backend = execution_backend(backend)
+  in_process = backend in (ExecutionBackendEnum.Serial, ExecutionBackendEnum.Threads) or effective_n_jobs(num_jobs) == 1
+
+  if initializer is not None and not in_process:
+    if JOBLIB_BACKEND_OPTIONS[backend] != JOBLIB_BACKEND_OPTIONS[ExecutionBackendEnum.Processes]:
+      # The reusable executor pickles the inputs as they are, it cannot memory map them as joblib does
+      raise ValueError(f'Worker initializers cannot be used with the {backend.name} execution backend!')
+
+    # Joblib has no worker initializers, the reusable executor it is built on does
+    executor = get_reusable_executor(max_workers=effective_n_jobs(num_jobs), initializer=initializer, initargs=initargs)
+    return list(executor.map(function, data_source))
+
+  if initializer is not None:
+    initializer(*initargs)
+
+  if backend == ExecutionBackendEnum.Serial or effective_n_jobs(num_jobs) == 1:
+    return [function(item) for item in data_source]
+
   result: Optional[List[U]] = []
 
-  with Parallel(n_jobs=num_jobs) as parallel:
+  with Parallel(n_jobs=num_jobs, **JOBLIB_BACKEND_OPTIONS[backend]) as parallel:
     result = parallel(map(delayed(function), data_source))
 
   return result
 
 
-def fetch_raw_data(url: str, encoding: str = 'windows-1251') -> Any:
+def write_atomically(path: str, data: bytes):
+  directory = dirname(path) or '.'
+
+  if not exists(directory):
+    makedirs(directory, exist_ok=True)
+
+  # Readers either see the old file or the complete new one, never a partial write
+  with NamedTemporaryFile(dir=directory, prefix='.tmp-', delete=False) as f:
+    f.write(data)
+    temp_path = f.name
+
+  chmod(temp_path, FILE_MODE)
+  replace(temp_path, path)
+
+
+def request_headers() -> Any:
   headers = default_headers()
   headers.update({
       'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:52.0) Gecko/20100101 Firefox/52.0'
   })
 
-  req = get_request(url, headers)
-  req.encoding = encoding
+  return headers
 
-  return req
 
+def fetch_raw_data(
+  url: str,
+  encoding: str = 'windows-1251',
+  cache: Optional[Any] = None,
+  stream: bool = False,
+  session: Optional[Any] = None,
+  timeout: Optional[float] = None
+) -> Any:
+  headers = request_headers()
+
+  if cache is not None:
+    return cache.fetch(url, headers, encoding, session=session, timeout=timeout)
 
-def fix_names(name: str) -> str:
-    new_name = name
-    prob_pos = name.find('Ь')
-
-    # Some years in the names of settlements 'Ь' was used instead of 'Ъ'
-    if prob_pos != -1:
-      o_pos = name.find('О', prob_pos)
-      if o_pos != prob_pos + 1:
-        new_name = name.replace('Ь', 'Ъ')
-
-    # Some years in the names of settlements were spelled wrong
-    # correct names were taken from https://www.nsi.bg/nrnm/index.php?f=6&ezik=bul
-    names = {
-        'БОБОВДОЛ': 'БОБОВ ДОЛ',
-        'ВЪЛЧИДОЛ': 'ВЪЛЧИ ДОЛ',
-        'КАПИТАН ПЕТКО ВОЙВО': 'КАПИТАН ПЕТКО ВОЙВОДА',
-        'ДОБРИЧКА': 'ДОБРИЧ-СЕЛСКА',
-        'ДОБРИЧ СЕЛСКА': 'ДОБРИЧ-СЕЛСКА',
-        'БЕРАИНЦИ': 'БЕРАЙНЦИ',
-        'ФЕЛТФЕБЕЛ ДЕНКОВО': 'ФЕЛДФЕБЕЛ ДЕНКОВО',
-        'УРУЧОВЦИ': 'УРУЧЕВЦИ',
-        'ПОЛИКРАЙЩЕ': 'ПОЛИКРАИЩЕ',
-        'КАМЕШИЦА': 'КАМЕЩИЦА',
-        'БОГДАНОВДОЛ': 'БОГДАНОВ ДОЛ',
-        'СИНЬО БЬРДО': 'СИНЬО БЪРДО',
-        'ЗЕЛЕН ДОЛ': 'ЗЕЛЕНДОЛ',
-        'МАРИКОСТЕНОВО': 'МАРИКОСТИНОВО',
-        'САНСТЕФАНО': 'САН-СТЕФАНО',
-        'САН СТЕФАНО': 'САН-СТЕФАНО',
-        'ПЕТРОВДОЛ': 'ПЕТРОВ ДОЛ',
-        'ЧАПАЕВО': 'ЦАРСКИ ИЗВОР',
-        'ЕЛОВДОЛ': 'ЕЛОВ ДОЛ',
-        'В. ТЪРНОВО': 'ВЕЛИКО ТЪРНОВО',
-        'В.ТЪРНОВО': 'ВЕЛИКО ТЪРНОВО',
-        'ГЕНЕРАЛ-ТОШОВО': 'ГЕНЕРАЛ ТОШЕВО',
-        'ГЕНЕРАЛ ТОШОВО': 'ГЕНЕРАЛ ТОШЕВО',
-        'ГЕНЕРАЛ-ТОШЕВО': 'ГЕНЕРАЛ ТОШЕВО',
-        'БЕДЖДЕНЕ': 'БЕДЖЕНЕ',
-        'ТАЙМИШЕ': 'ТАЙМИЩЕ',
-        'СТОЯН ЗАИМОВО': 'СТОЯН-ЗАИМОВО',
-        'ДАСКАЛ АТАНАСОВО': 'ДАСКАЛ-АТАНАСОВО',
-        'СЛАВЕИНО': 'СЛАВЕЙНО',
-        'КРАЛЕВДОЛ': 'КРАЛЕВ ДОЛ',
-        'ФЕЛДФЕБЕЛ ДЯНКОВО': 'ФЕЛДФЕБЕЛ ДЕНКОВО',
-        'ДЛЪХЧЕВО САБЛЯР': 'ДЛЪХЧЕВО-САБЛЯР',
-        'ГОЛЕМ ВЪРБОВНИК': 'ГОЛЯМ ВЪРБОВНИК',
-        'ПОЛКОВНИК ЖЕЛЕЗОВО': 'ПОЛКОВНИК ЖЕЛЯЗОВО',
-        'ДОБРИЧ ГРАД': 'ДОБРИЧ',
-        'ЦАР ПЕТРОВО': 'ЦАР-ПЕТРОВО',
-        'ВЪЛЧАНДОЛ': 'ВЪЛЧАН ДОЛ',
-        'ПАНАГЮРСКИ КОЛОНИ': 'ПАНАГЮРСКИ КОЛОНИИ',
-        'ГОРСКИ ГОРЕН ТРЪМБЕ': 'ГОРСКИ ГОРЕН ТРЪМБЕШ',
-        'ГОРСКИ ДОЛЕН ТРЪМБЕ': 'ГОРСКИ ДОЛЕН ТРЪМБЕШ',
-        'ГЕНЕРАЛ-КАНТАРДЖИЕВ': 'ГЕНЕРАЛ КАНТАРДЖИЕВО',
-        'ГЕНЕРАЛ КАНТАРДЖИЕВ': 'ГЕНЕРАЛ КАНТАРДЖИЕВО',
-        'АЛЕКСАНДЪР СТАМБОЛИ': 'АЛЕКСАНДЬР СТАМБОЛИЙСКИ',
-        'ПОЛКОВНИК-ЛАМБРИНОВ': 'ПОЛКОВНИК ЛАМБРИНОВО',
-        'ПОЛКОВНИК ЛАМБРИНОВ': 'ПОЛКОВНИК ЛАМБРИНОВО',
-        'ПОЛКОВНИК-СЕРАФИМОВ': 'ПОЛКОВНИК СЕРАФИМОВО',
-        'ПОЛКОВНИК СЕРАФИМОВ': 'ПОЛКОВНИК СЕРАФИМОВО'
-    }
-
-    if new_name.find('-') != -1:
-      new_name = new_name.replace('-', ' ')
-
-    new_name = names.get(new_name, new_name)
-
-    return new_name
+  getter = session.get if session is not None else get_request
+  req = getter(url, headers=headers, stream=stream, timeout=timeout)
+  req.encoding = encoding
+
+  return req
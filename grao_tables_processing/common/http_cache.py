@@ -0,0 +1,240 @@
+import json
+import time
+
+from hashlib import sha256
+from os import listdir, remove, stat, utime
+from os.path import exists, join
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from requests import Response, Session
+from requests import get as get_request
+from requests.structures import CaseInsensitiveDict
+
+from grao_tables_processing.common.custom_types import OfflineCacheMissError
+from grao_tables_processing.common.helper_functions import write_atomically
+
+
+# Objects written this recently are kept by an eviction pass, their entries could be stored after it read the index
+RECENT_OBJECT_SECONDS = 60.0
+
+
+class HTTPCache():
+  """Bodies are stored by content hash, validators (ETag/Last-Modified) in an index keyed by URL hash."""
+
+  def __init__(
+    self,
+    directory: str,
+    offline: bool = False,
+    max_size: Optional[int] = None,
+    max_age: Optional[float] = None
+  ):
+    self.directory = directory
+    self.offline = offline
+    self.max_size = max_size
+    self.max_age = max_age
+
+  @property
+  def objects_directory(self) -> str:
+    return join(self.directory, 'objects')
+
+  @property
+  def index_directory(self) -> str:
+    return join(self.directory, 'index')
+
+  def fetch(
+    self,
+    url: str,
+    headers: Dict[str, str],
+    encoding: str,
+    session: Optional[Session] = None,
+    timeout: Optional[float] = None
+  ) -> Response:
+    entry = self._load_entry(url)
+    body = self._load_body(entry)
+
+    if self.offline:
+      if entry is None or body is None:
+        raise OfflineCacheMissError(f'No cached response for {url}')
+
+      return HTTPCache._cached_response(url, body, entry, encoding)
+
+    request_headers = dict(headers)
+    if entry is not None and body is not None:
+      request_headers.update(HTTPCache._conditional_headers(entry))
+
+    getter = session.get if session is not None else get_request
+    response = getter(url, headers=request_headers, timeout=timeout)
+
+    if response.status_code == 304 and entry is not None and body is not None:
+      self._store_entry(url, dict(entry, validated_at=time.time()))
+      return HTTPCache._cached_response(url, body, entry, encoding)
+
+    response.encoding = encoding
+    if response.status_code == 200:
+      self.store(url, response)
+      self.evict()
+
+    return response
+
+  def store(self, url: str, response: Response):
+    body = response.content
+    content_hash = sha256(body).hexdigest()
+    object_path = join(self.objects_directory, content_hash)
+
+    # The entry goes first, so an eviction pass either sees it or started before the object was written
+    now = time.time()
+    self._store_entry(url, {
+      'url': url,
+      'content_hash': content_hash,
+      'size': len(body),
+      'etag': response.headers.get('ETag'),
+      'last_modified': response.headers.get('Last-Modified'),
+      'fetched_at': now,
+      'validated_at': now,
+    })
+
+    if exists(object_path):
+      # A body shared with another entry counts as written now as well
+      utime(object_path)
+    else:
+      write_atomically(object_path, body)
+
+  def content_hash(self, url: str) -> Optional[str]:
+    entry = self._load_entry(url)
+    return None if entry is None else entry['content_hash']
+
+  def evict(self) -> int:
+    # Taken before the index is read, the file timestamps can lag behind the clock
+    recent = time.time() - RECENT_OBJECT_SECONDS
+    entries = self._load_all_entries()
+    kept = self._evict_oversized(self._evict_stale(entries))
+
+    self._remove_unreferenced_objects({entry['content_hash'] for _, entry in kept}, recent)
+
+    return len(entries) - len(kept)
+
+  def _evict_stale(self, entries: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+    if self.max_age is None:
+      return entries
+
+    oldest_allowed = time.time() - self.max_age
+    kept = []
+    for path, entry in entries:
+      if entry['validated_at'] < oldest_allowed:
+        HTTPCache._remove_if_exists(path)
+      else:
+        kept.append((path, entry))
+
+    return kept
+
+  def _evict_oversized(self, entries: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+    if self.max_size is None:
+      return entries
+
+    # The least recently validated entries are dropped first
+    kept = sorted(entries, key=lambda path_entry: path_entry[1]['validated_at'])
+    total_size = sum(entry['size'] for _, entry in kept)
+    while kept and total_size > self.max_size:
+      path, entry = kept.pop(0)
+      total_size -= entry['size']
+      HTTPCache._remove_if_exists(path)
+
+    return kept
+
+  def _remove_unreferenced_objects(self, referenced: Set[str], recent: float):
+    if not exists(self.objects_directory):
+      return
+
+    for content_hash in listdir(self.objects_directory):
+      # Temporary files belong to writes that are still in progress
+      if content_hash in referenced or content_hash.startswith('.'):
+        continue
+
+      path = join(self.objects_directory, content_hash)
+      if HTTPCache._modified_before(path, recent):
+        HTTPCache._remove_if_exists(path)
+
+  def _entry_path(self, url: str) -> str:
+    return join(self.index_directory, f'{sha256(url.encode("utf-8")).hexdigest()}.json')
+
+  def _load_entry(self, url: str) -> Optional[Dict[str, Any]]:
+    try:
+      with open(self._entry_path(url), encoding='utf-8') as f:
+        return json.load(f)
+    except FileNotFoundError:
+      # Never stored or evicted, possibly by a concurrent download
+      return None
+
+  def _load_all_entries(self) -> List[Tuple[str, Dict[str, Any]]]:
+    if not exists(self.index_directory):
+      return []
+
+    entries = []
+    for file_name in listdir(self.index_directory):
+      if not file_name.endswith('.json'):
+        continue
+
+      path = join(self.index_directory, file_name)
+      try:
+        with open(path, encoding='utf-8') as f:
+          entries.append((path, json.load(f)))
+      except FileNotFoundError:
+        # Evicted by a concurrent download
+        continue
+
+    return entries
+
+  def _store_entry(self, url: str, entry: Dict[str, Any]):
+    write_atomically(self._entry_path(url), json.dumps(entry).encode('utf-8'))
+
+  def _load_body(self, entry: Optional[Dict[str, Any]]) -> Optional[bytes]:
+    if entry is None:
+      return None
+
+    try:
+      with open(join(self.objects_directory, entry['content_hash']), 'rb') as f:
+        body = f.read()
+    except FileNotFoundError:
+      return None
+
+    return body if len(body) == entry['size'] else None
+
+  @staticmethod
+  def _modified_before(path: str, time_limit: float) -> bool:
+    try:
+      return stat(path).st_mtime < time_limit
+    except FileNotFoundError:
+      return False
+
+  @staticmethod
+  def _remove_if_exists(path: str):
+    try:
+      remove(path)
+    except FileNotFoundError:
+      pass
+
+  @staticmethod
+  def _conditional_headers(entry: Dict[str, Any]) -> Dict[str, str]:
+    headers = {}
+
+    if entry.get('etag'):
+      headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+      headers['If-Modified-Since'] = entry['last_modified']
+
+    return headers
+
+  @staticmethod
+  def _cached_response(url: str, body: bytes, entry: Dict[str, Any], encoding: str) -> Response:
+    response = Response()
+    response.url = url
+    response.status_code = 200
+    response.reason = 'OK'
+    response.encoding = encoding
+    response.headers = CaseInsensitiveDict({
+      key: value for key, value in (('ETag', entry.get('etag')), ('Last-Modified', entry.get('last_modified'))) if value
+    })
+    response._content = body
+    response._content_consumed = True
+
+    return response
@@ -0,0 +1,46 @@
+import json
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from functools import lru_cache
+from os.path import abspath, dirname, join
+from typing import Callable, Dict
+
+
+DEFAULT_NAME_ALIASES_PATH = join(dirname(dirname(abspath(__file__))), 'data', 'name_aliases.json')
+
+
+def load_name_aliases(path: str) -> Dict[str, str]:
+  with open(path, encoding='utf-8') as f:
+    return dict(json.load(f))
+
+
+# Some years in the names of settlements were spelled wrong
+# correct names were taken from https://www.nsi.bg/nrnm/index.php?f=6&ezik=bul
+NAME_ALIASES: Dict[str, str] = load_name_aliases(DEFAULT_NAME_ALIASES_PATH)
+
+
+@lru_cache(maxsize=32768)
+def fix_names(name: str) -> str:
+  new_name = name
+  prob_pos = name.find('Ь')
+
+  # Some years in the names of settlements 'Ь' was used instead of 'Ъ'
+  if prob_pos != -1:
+    o_pos = name.find('О', prob_pos)
+    if o_pos != prob_pos + 1:
+      new_name = name.replace('Ь', 'Ъ')
+
+  if new_name.find('-') != -1:
+    new_name = new_name.replace('-', ' ')
+
+  return NAME_ALIASES.get(new_name, new_name)
+
+
+def normalized_names(names: pd.Series, name_part: Callable[[str], str]) -> np.ndarray:
+  # Every distinct name is normalized only once, categorical columns are factorized from their codes
+  codes, uniques = pd.factorize(names)
+  # Missing names get the code -1, which picks the NaN after the names
+  normalized = np.array([fix_names(name_part(name).strip()) for name in uniques] + [np.nan], dtype=object)
+
+  return normalized[codes]
@@ -1,34 +1,23 @@
 from typing import Any, Optional
-from pickle import dump, load
-from os.path import exists
-from os import makedirs
+
+from grao_tables_processing.common.artifact_store import ArtifactStore
 
 
 class PickleWrapper():
+  # A store shared by the scripts, the pipelines use the 'artifact_store' of their configuration
 
   directory = ''
+  store = ArtifactStore(directory)
 
   @staticmethod
-  def configure(directory: str):
+  def configure(directory: str, compress: bool = False):
     PickleWrapper.directory = directory
+    PickleWrapper.store = ArtifactStore(directory, compress)
 
   @staticmethod
   def pickle_data(data: Any, name: str):
-    directory = PickleWrapper.directory
-
-    if not exists(directory):
-      makedirs(directory)
-
-    with open(f'{directory}/{name}.pkl', 'wb') as f:
-      dump(data, f)
+    PickleWrapper.store.store(name, data)
 
   @staticmethod
   def load_data(name: str) -> Optional[Any]:
-    directory = PickleWrapper.directory
-    path = f'{directory}/{name}.pkl'
-
-    if not exists(path):
-      return None
-
-    with open(path, 'rb') as f:
-      return load(f)
+    return PickleWrapper.store.load(name)
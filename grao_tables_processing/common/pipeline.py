@@ -1,16 +1,30 @@
-from typing import Generic, Sequence, Callable
-from functools import reduce
+from typing import Any, Generic, Iterable, Iterator, Optional, Sequence, Callable
 
 from grao_tables_processing.common.custom_types import T
+from grao_tables_processing.common.profiling import run_stage, stage_name
 
 
 class Pipeline(Generic[T]):
-  def __init__(self, functions: Sequence[Callable[[T], T]]):
+  def __init__(
+    self,
+    functions: Sequence[Callable[[T], T]],
+    name: str = 'pipeline',
+    stage_names: Optional[Sequence[str]] = None
+  ):
     self.functions_sequence = functions
+    self.name = name
+    self.stage_names = stage_names or [stage_name(function) for function in functions]
 
   def __call__(self, value: T) -> T:
-    return reduce(Pipeline._apply, self.functions_sequence, value)
+    # Every stage goes through the profiling hooks, which only measure it when --profile is set
+    for name, function in zip(self.stage_names, self.functions_sequence):
+      value = run_stage(self.name, name, function, value)
 
-  @staticmethod
-  def _apply(val: T, func: Callable[[T], T]) -> T:
-    return func(val)
+    return value
+
+
+class StreamingPipeline(Pipeline[Iterator[Any]]):
+  # Every stage consumes an iterator and returns one, so items flow through the
+  # stages one at a time and nothing is materialized in between
+  def __call__(self, value: Iterable[Any]) -> Iterator[Any]:
+    return super().__call__(iter(value))
@@ -0,0 +1,235 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+from collections import defaultdict
+from glob import glob
+from os.path import join
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd  # type: ignore
+
+from grao_tables_processing.common.custom_types import DataTuple, DownloadedTables
+
+try:
+  import resource
+except ImportError:  # pragma: no cover
+  resource = None  # type: ignore
+
+
+# Set in the environment, so the worker processes started by joblib profile their stages as well
+PROFILE_DIRECTORY_VARIABLE = 'GRAO_PROFILE_DIRECTORY'
+PROFILE_STAGE_VARIABLE = 'GRAO_PROFILE_STAGE'
+PROFILE_MEMORY_VARIABLE = 'GRAO_PROFILE_MEMORY'
+
+
+def enable_profiling(directory: str, cprofile_stage: Optional[str] = None, trace_memory: bool = False):
+  os.makedirs(directory, exist_ok=True)
+
+  for old_file in glob(join(directory, 'stages-*.jsonl')):
+    os.remove(old_file)
+
+  os.environ[PROFILE_DIRECTORY_VARIABLE] = directory
+  os.environ[PROFILE_STAGE_VARIABLE] = cprofile_stage or ''
+  os.environ[PROFILE_MEMORY_VARIABLE] = '1' if trace_memory else ''
+
+
+def stage_name(function: Callable[..., Any]) -> str:
+  # Partial functions are named after the function they wrap
+  return str(getattr(function, '__name__', None) or getattr(getattr(function, 'func', None), '__name__', 'stage'))
+
+
+def max_rss() -> Optional[int]:
+  # The high-water mark of the process, in kilobytes on Linux
+  return None if resource is None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def row_count(value: Any) -> Optional[int]:
+  if isinstance(value, pd.DataFrame):
+    return len(value)
+
+  if isinstance(value, DataTuple):
+    return row_count(value.data)
+
+  if isinstance(value, DownloadedTables):
+    return len(value.data_source)
+
+  if isinstance(value, list):
+    # Lists of tables count their rows, any other list its items
+    tables = [item for item in value if isinstance(item, (DataTuple, pd.DataFrame))]
+    counts = [count for table in tables if (count := row_count(table)) is not None]
+    return sum(counts) if value and len(counts) == len(value) else len(value)
+
+  return None
+
+
+def run_stage(pipeline: str, stage: str, function: Callable[[Any], Any], value: Any) -> Any:
+  directory = os.environ.get(PROFILE_DIRECTORY_VARIABLE)
+
+  if not directory:
+    return function(value)
+
+  return _profiled_stage(directory, pipeline, stage, function, value)
+
+
+class _StageRecorder():
+  """The time, memory and rows of a stage, which for a lazy output keep adding up while it is consumed."""
+
+  def __init__(self, directory: str, pipeline: str, stage: str, input_rows: Optional[int]):
+    full_name = f'{pipeline}.{stage}'
+    self.directory = directory
+    self.record: Dict[str, Any] = {'pipeline': pipeline, 'stage': stage, 'pid': os.getpid(), 'wall_seconds': 0.0,
+                                   'cpu_seconds': 0.0, 'input_rows': input_rows, 'tracemalloc_peak_bytes': None}
+    self.profile_path = join(directory, f'{full_name}.{os.getpid()}.{time.time_ns()}.prof')
+    self.profiler = cProfile.Profile() if os.environ.get(PROFILE_STAGE_VARIABLE) in (stage, full_name) else None
+    self.trace_memory = bool(os.environ.get(PROFILE_MEMORY_VARIABLE))
+    self.tracing = False
+    self.started = (0.0, 0.0)
+
+  def resume(self):
+    # Memory is traced only while the stage runs, so neither the consumers of a lazy output nor the rest of the run
+    # after it is abandoned pay for it. Nested stages run inside a traced outer one, which reports the peak
+    self.tracing = self.trace_memory and not tracemalloc.is_tracing()
+    if self.tracing:
+      tracemalloc.start()
+
+    if self.profiler is not None:
+      self.profiler.enable()
+    self.started = (time.perf_counter(), time.process_time())
+
+  def pause(self):
+    self.record['wall_seconds'] += time.perf_counter() - self.started[0]
+    self.record['cpu_seconds'] += time.process_time() - self.started[1]
+    if self.profiler is not None:
+      self.profiler.disable()
+
+    if self.tracing:
+      peak = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+      self.tracing = False
+      self.record['tracemalloc_peak_bytes'] = max(self.record['tracemalloc_peak_bytes'] or 0, peak)
+
+  def finish(self, output_rows: Optional[int]):
+    if self.profiler is not None:
+      self.profiler.dump_stats(self.profile_path)
+
+    self.record['max_rss_bytes'] = max_rss()
+    self.record['output_rows'] = output_rows
+    _append_record(self.directory, self.record)
+
+
+def _profiled_stage(directory: str, pipeline: str, stage: str, function: Callable[[Any], Any], value: Any) -> Any:
+  recorder = _StageRecorder(directory, pipeline, stage, row_count(value))
+
+  recorder.resume()
+  try:
+    result = function(value)
+  except BaseException:
+    # A failing stage is recorded as well, without output rows
+    recorder.pause()
+    recorder.finish(None)
+    raise
+  recorder.pause()
+
+  if isinstance(result, DataTuple) and isinstance(result.data, Iterator):
+    return DataTuple(_recorded_items(result.data, recorder), result.header_type, result.table_type)
+
+  if isinstance(result, Iterator):
+    return _recorded_items(result, recorder)
+
+  recorder.finish(row_count(result))
+  return result
+
+
+def _recorded_items(items: Iterator[Any], recorder: _StageRecorder) -> Iterator[Any]:
+  # Lazy outputs keep streaming, the time spent producing every item is added to the stage as it is consumed.
+  # The record is written when they are exhausted, fail, or are closed after being abandoned
+  rows = 0
+
+  try:
+    while True:
+      recorder.resume()
+      try:
+        item = next(items)
+      except StopIteration:
+        return
+      finally:
+        recorder.pause()
+
+      rows += (row_count(item) or 0) if isinstance(item, (DataTuple, pd.DataFrame)) else 1
+      yield item
+  finally:
+    recorder.finish(rows)
+
+
+def _append_record(directory: str, record: Dict[str, Any]):
+  with open(join(directory, f'stages-{os.getpid()}.jsonl'), 'a', encoding='utf-8') as f:
+    f.write(json.dumps(record) + '\n')
+
+
+def _load_records(directory: str) -> List[Dict[str, Any]]:
+  records = []
+  for path in sorted(glob(join(directory, 'stages-*.jsonl'))):
+    with open(path, encoding='utf-8') as f:
+      records += [json.loads(line) for line in f if line.strip()]
+
+  return records
+
+
+def _optional_max(values: List[Optional[int]]) -> Optional[int]:
+  present = [value for value in values if value is not None]
+  return max(present) if present else None
+
+
+def _optional_sum(values: List[Optional[int]]) -> Optional[int]:
+  present = [value for value in values if value is not None]
+  return sum(present) if present else None
+
+
+def profile_report(directory: str) -> Dict[str, Any]:
+  grouped: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+  for record in _load_records(directory):
+    grouped[f'{record["pipeline"]}.{record["stage"]}'].append(record)
+
+  stages = [{
+    'stage': name,
+    'calls': len(records),
+    'processes': len({record['pid'] for record in records}),
+    'wall_seconds': sum(record['wall_seconds'] for record in records),
+    'cpu_seconds': sum(record['cpu_seconds'] for record in records),
+    'tracemalloc_peak_bytes': _optional_max([record['tracemalloc_peak_bytes'] for record in records]),
+    'max_rss_bytes': _optional_max([record['max_rss_bytes'] for record in records]),
+    'input_rows': _optional_sum([record['input_rows'] for record in records]),
+    'output_rows': _optional_sum([record['output_rows'] for record in records]),
+  } for name, records in grouped.items()]
+
+  return {'stages': sorted(stages, key=lambda stage: stage['wall_seconds'], reverse=True)}
+
+
+def write_profile_report(directory: str) -> Dict[str, Any]:
+  report = profile_report(directory)
+
+  with open(join(directory, 'report.json'), 'w', encoding='utf-8') as f:
+    json.dump(report, f, indent=2)
+
+  return report
+
+
+def format_profile_summary(report: Dict[str, Any]) -> str:
+  def megabytes(value: Optional[int]) -> str:
+    return '-' if value is None else f'{value / 2 ** 20:.1f}'
+
+  lines = [
+    f'{"stage":<55} {"calls":>5} {"wall s":>9} {"cpu s":>9} {"peak MiB":>9} {"rss MiB":>9} {"rows in":>9} {"rows out":>9}'
+  ]
+  for stage in report['stages']:
+    lines.append(
+      f'{stage["stage"]:<55} {stage["calls"]:>5} {stage["wall_seconds"]:>9.2f} {stage["cpu_seconds"]:>9.2f} '
+      f'{megabytes(stage["tracemalloc_peak_bytes"]):>9} {megabytes(stage["max_rss_bytes"]):>9} '
+      f'{stage["input_rows"] if stage["input_rows"] is not None else "-":>9} '
+      f'{stage["output_rows"] if stage["output_rows"] is not None else "-":>9}'
+    )
+
+  return '\n'.join(lines)
@@ -0,0 +1,193 @@
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Type
+
+from grao_tables_processing.common.custom_types import RateLimiterStatistics, U
+
+
+# The answers of a server pushing back, counted as failures even though they arrive
+THROTTLING_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+def throttled_response(response: Any) -> bool:
+  return getattr(response, 'status_code', None) in THROTTLING_STATUS_CODES
+
+
+class LimitedRequest():
+  """A request made through the limiter, flagged as failed when its answer tells the server is pushing back."""
+
+  def __init__(self):
+    self.failed = False
+
+
+class AdaptiveRateLimiter():
+  """A token bucket for the rate of the requests to a server and an AIMD limit on the concurrent ones.
+
+  Both are raised step by step while the server answers quickly and cut when a request fails or is slow.
+  """
+
+  def __init__(
+    self,
+    rate: float = 2.0,
+    max_rate: float = 20.0,
+    min_rate: float = 0.1,
+    burst: float = 2.0,
+    concurrency: int = 2,
+    max_concurrency: int = 8,
+    slow_seconds: float = 10.0,
+    rate_increase: float = 0.5,
+    decrease_factor: float = 0.5
+  ):
+    if not 0 < min_rate <= rate <= max_rate:
+      raise ValueError(f'The rate {rate} must be positive and between {min_rate} and {max_rate}!')
+
+    if not 1 <= concurrency <= max_concurrency:
+      raise ValueError(f'The concurrency {concurrency} must be between 1 and {max_concurrency}!')
+
+    self.rate = rate
+    self.max_rate = max_rate
+    self.min_rate = min_rate
+    self.burst = burst
+    self.max_concurrency = max_concurrency
+    self.slow_seconds = slow_seconds
+    self.rate_increase = rate_increase
+    self.decrease_factor = decrease_factor
+
+    self._limit = float(concurrency)
+    self._active = 0
+    self._tokens = burst
+    self._updated = time.monotonic()
+    self._decreased_at = float('-inf')
+    self._counts = {'requests': 0, 'failures': 0, 'slow_requests': 0, 'retries': 0}
+    self._waited = 0.0
+    self._condition = threading.Condition()
+
+  def __getstate__(self) -> Dict[str, Any]:
+    # Worker processes get a limiter of their own
+    state = dict(self.__dict__)
+    del state['_condition']
+    return state
+
+  def __setstate__(self, state: Dict[str, Any]):
+    self.__dict__.update(state)
+    self._condition = threading.Condition()
+
+  def acquire(self) -> float:
+    with self._condition:
+      now = time.monotonic()
+      self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+      self._updated = now
+      # A missing token is borrowed, so the requests waiting for one are spaced out instead of woken together
+      self._tokens -= 1
+      delay = max(0.0, -self._tokens / self.rate)
+      self._waited += delay
+
+    # Waiting for the token does not hold a slot, the limit counts only the requests in flight
+    if delay > 0:
+      time.sleep(delay)
+
+    with self._condition:
+      self._condition.wait_for(lambda: self._active < int(self._limit))
+      self._active += 1
+
+    return delay
+
+  def release(self, started: float, failed: bool = False):
+    slow = time.monotonic() - started > self.slow_seconds
+
+    with self._condition:
+      self._active -= 1
+      self._counts['requests'] += 1
+      self._counts['failures'] += failed
+      self._counts['slow_requests'] += slow and not failed
+
+      if not (failed or slow):
+        self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+        self.rate = min(self.max_rate, self.rate + self.rate_increase)
+      elif started > self._decreased_at:
+        # The requests started before the last cut ran into the same congestion and do not cut again
+        self._limit = max(1.0, self._limit * self.decrease_factor)
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self._decreased_at = time.monotonic()
+
+      self._condition.notify_all()
+
+  @contextmanager
+  def request(self) -> Iterator[LimitedRequest]:
+    self.acquire()
+    started = time.monotonic()
+    request = LimitedRequest()
+
+    try:
+      yield request
+    except BaseException:
+      self.release(started, failed=True)
+      raise
+
+    self.release(started, failed=request.failed)
+
+  def record_retry(self):
+    with self._condition:
+      self._counts['retries'] += 1
+
+  def statistics(self) -> RateLimiterStatistics:
+    with self._condition:
+      return RateLimiterStatistics(waited_seconds=self._waited, rate=self.rate, concurrency=self._limit, **self._counts)
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 30.0) -> float:
+  # Full jitter, so the retries of the requests failing together are spread out
+  return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def call_with_retries(
+  limiter: AdaptiveRateLimiter,
+  function: Callable[[], U],
+  retries: int = 5,
+  exceptions: Tuple[Type[BaseException], ...] = (Exception,),
+  failed: Optional[Callable[[U], bool]] = throttled_response
+) -> U:
+  """Calls the function through the limiter, waiting only before the retries of the failed calls.
+
+  A call fails when it raises one of the exceptions or when failed flags its result, e.g. a 429 or 503 response.
+  The result of the last call is returned even if it is flagged.
+  """
+  attempt = 0
+
+  while True:
+    try:
+      with limiter.request() as request:
+        result = function()
+        request.failed = failed is not None and failed(result)
+
+      if not request.failed or attempt >= retries:
+        return result
+    except exceptions:
+      if attempt >= retries:
+        raise
+
+    limiter.record_retry()
+    time.sleep(backoff_delay(attempt))
+    attempt += 1
+
+
+_shared_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def shared_rate_limiter(host: str, **options: Any) -> AdaptiveRateLimiter:
+  """The limiter of the requests to a host, created with the options the first time it is asked for."""
+  with _shared_limiters_lock:
+    if host not in _shared_limiters:
+      _shared_limiters[host] = AdaptiveRateLimiter(**options)
+
+    return _shared_limiters[host]
+
+
+def format_statistics(host: str, statistics: RateLimiterStatistics) -> str:
+  return (f'{host}: {statistics.requests} requests, {statistics.failures} failed, {statistics.slow_requests} slow, '
+          f'{statistics.retries} retried, {statistics.waited_seconds:.1f}s waited for the rate limit, '
+          f'final rate {statistics.rate:.2f}/s and concurrency {statistics.concurrency:.1f}')
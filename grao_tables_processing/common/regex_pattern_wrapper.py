@@ -1,4 +1,55 @@
+from regex import compile  # type: ignore
+from typing import Any, Dict, Tuple
+
 from grao_tables_processing.common.singleton import Singleton
+from grao_tables_processing.common.custom_types import HeaderEnum, TableTypeEnum, LineTypeEnum
+
+
+class LineClassifier():
+  # Headers take priority over settlement rows, as with the separate searches used before.
+  # The leftmost match of the combined pattern already respects that unless the header starts
+  # after the settlement row, which the header marker rules out for nearly all lines.
+
+  def __init__(self, combined: Any, header_line_type: LineTypeEnum, header: Any, settlement: Any, header_marker: Any):
+    self.combined = combined
+    self.header_line_type = header_line_type
+    self.header = header
+    self.settlement = settlement
+    self.header_marker = header_marker
+    header_offset = combined.groupindex['header']
+    settlement_offset = combined.groupindex['settlement']
+    self.header_groups = slice(header_offset, header_offset + header.groups)
+    self.settlement_groups = slice(settlement_offset, settlement_offset + settlement.groups)
+
+  def classify(self, line: str) -> Tuple[LineTypeEnum, Tuple[str, ...], Tuple[str, ...]]:
+    match = self.combined.search(line)
+
+    if match is None:
+      return (LineTypeEnum.Noise, (), ())
+
+    groups = match.groups()
+    settlement = groups[self.settlement_groups]
+
+    is_region_header = self.header_line_type == LineTypeEnum.RegionHeader
+
+    if settlement[0] is None:
+      # A region header of the old format does not stop the search for a settlement row on the same line
+      if is_region_header and (settlement_match := self.settlement.search(line, match.start())):
+        settlement = settlement_match.groups()
+
+      return (self.header_line_type, groups[self.header_groups], self._only_for_region_header(settlement))
+
+    after_start = match.start() + 1
+    if self.header_marker.search(line, after_start) and (header := self.header.search(line, after_start)):
+      return (self.header_line_type, header.groups(), self._only_for_region_header(settlement))
+
+    return (LineTypeEnum.Settlement, (), settlement)
+
+  def _only_for_region_header(self, settlement: Tuple[str, ...]) -> Tuple[str, ...]:
+    if self.header_line_type == LineTypeEnum.RegionHeader and settlement[0] is not None:
+      return settlement
+
+    return ()
 
 
 class RegexPatternWrapper(metaclass=Singleton):
@@ -12,6 +63,7 @@ class RegexPatternWrapper(metaclass=Singleton):
     self.year_group = '(\d{4})'
     self.date_group = '(\d{2}-\d{4})'
     self.full_date_group = '(\d{2}-\d{2}-\d{4})'
+    self.html_tag = '<[^>]*>'
 
     name_part = f'[\s|-]*{cap_letter}*'
     name_part_old = f'[\.|\s|-]{cap_letter}*'
@@ -26,3 +78,38 @@ class RegexPatternWrapper(metaclass=Singleton):
     self.region_name_new = f'{word} ({name}) {word} ({name})'
     self.settlement_info_quarterly = f'({type_abbr}{name})\s*{number_group * 3}'
     self.settlement_info_yearly = f'({type_abbr}{name})\s*{number_group * 6}'
+
+    self.compiled = {name: compile(pattern) for name, pattern in vars(self).items() if isinstance(pattern, str)}
+    self.line_classifiers = self._build_line_classifiers(low_letter)
+
+  def _build_line_classifiers(self, low_letter: str) -> Dict[Tuple[HeaderEnum, TableTypeEnum, bool], LineClassifier]:
+    classifiers = {}
+
+    for table_type, settlement_info in ((TableTypeEnum.Quarterly, 'settlement_info_quarterly'),
+                                        (TableTypeEnum.Yearly, 'settlement_info_yearly')):
+      header_patterns = (
+        (HeaderEnum.New, False, LineTypeEnum.MunicipalityHeader, 'region_name_new', low_letter),
+        (HeaderEnum.New, True, LineTypeEnum.MunicipalityHeader, 'region_name_new', low_letter),
+        (HeaderEnum.Old, False, LineTypeEnum.RegionHeader, 'old_reg', 'ОБЛАСТ:'),
+        (HeaderEnum.Old, True, LineTypeEnum.MunicipalityHeader, 'old_mun', 'ОБЩИНА:'),
+      )
+
+      for header_type, in_header_block, header_line_type, header, header_marker in header_patterns:
+        classifiers[(header_type, table_type, in_header_block)] = LineClassifier(
+          compile(f'(?P<header>{getattr(self, header)})|(?P<settlement>{getattr(self, settlement_info)})'),
+          header_line_type,
+          self.compiled[header],
+          self.compiled[settlement_info],
+          compile(header_marker)
+        )
+
+    return classifiers
+
+  def classify_line(
+    self,
+    line: str,
+    header_type: HeaderEnum,
+    table_type: TableTypeEnum,
+    in_header_block: bool = False
+  ) -> Tuple[LineTypeEnum, Tuple[str, ...], Tuple[str, ...]]:
+    return self.line_classifiers[(header_type, table_type, in_header_block)].classify(line)
@@ -0,0 +1,147 @@
+import pickle
+
+from hashlib import sha256
+from os import walk
+from os.path import abspath, dirname, join
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from grao_tables_processing.common.artifact_store import ArtifactStore
+from grao_tables_processing.common.custom_types import Stage
+from grao_tables_processing.common.profiling import run_stage
+
+
+PACKAGE_DIRECTORY = dirname(dirname(abspath(__file__)))
+
+
+def package_code_version(directory: str = PACKAGE_DIRECTORY) -> str:
+  # Any change to the code or the bundled data invalidates the checkpoints
+  digest = sha256()
+
+  for root, directories, files in sorted(walk(directory)):
+    directories.sort()
+    for file_name in sorted(files):
+      if file_name.endswith(('.py', '.json')):
+        digest.update(file_name.encode('utf-8'))
+        with open(join(root, file_name), 'rb') as f:
+          digest.update(f.read())
+
+  return digest.hexdigest()
+
+
+def fingerprint(value: Any) -> str:
+  return sha256(pickle.dumps(value, protocol=4)).hexdigest()
+
+
+class StageCheckpoints():
+  """Pickled stage outputs, keyed by a hash of the stage inputs and of the code version.
+
+  The files a stage reads besides its input are fingerprinted after it ran, a checkpoint is resumed while they match.
+  """
+
+  def __init__(
+    self,
+    directory: str,
+    from_stage: Optional[str] = None,
+    until_stage: Optional[str] = None,
+    code_version: Optional[str] = None,
+    compress: bool = False
+  ):
+    self.directory = directory
+    self.from_stage = from_stage
+    self.until_stage = until_stage
+    self.code_version = code_version or package_code_version()
+    self.artifacts = ArtifactStore(directory, compress)
+
+  def stage_key(self, previous_key: str, stage: Stage) -> str:
+    return sha256(f'{previous_key}:{stage.name}:{self.code_version}'.encode('utf-8')).hexdigest()
+
+  def load(self, stage: Stage, key: str) -> Tuple[bool, Any]:
+    name = self._name(stage, key)
+    metadata = self.artifacts.metadata(name)
+
+    # The files the stage reads have to be as it left them, it could have rewritten them itself
+    if metadata is None or metadata['source_hash'] != self.output_key(stage, key):
+      return (False, None)
+
+    return (True, self.artifacts.load(name))
+
+  def store(self, stage: Stage, key: str, value: Any):
+    name = self._name(stage, key)
+    self.artifacts.store(name, value, source_hash=self.output_key(stage, key))
+
+    # Only the latest checkpoint of every stage is kept
+    for other_name in self.artifacts.names():
+      if other_name.startswith(f'{stage.name}-') and other_name != name:
+        self.artifacts.remove(other_name)
+
+  def output_key(self, stage: Stage, key: str) -> str:
+    # The output of a stage follows from its key and the files it read as it left them
+    inputs = stage.inputs_fingerprint() if stage.inputs_fingerprint is not None else ''
+
+    return sha256(f'{key}:{inputs}'.encode('utf-8')).hexdigest()
+
+  def _name(self, stage: Stage, key: str) -> str:
+    return f'{stage.name}-{key}'
+
+
+class CheckpointedPipeline():
+  def __init__(
+    self,
+    stages: Sequence[Stage],
+    checkpoints: StageCheckpoints,
+    input_fingerprint: Callable[[Any], str],
+    name: str = 'pipeline'
+  ):
+    self.name = name
+    self.stages = stages
+    self.checkpoints = checkpoints
+    self.input_fingerprint = input_fingerprint
+
+  def __call__(self, value: Any) -> Any:
+    key: Optional[str] = self.input_fingerprint(value)
+
+    for index, stage in enumerate(self.selected_stages()):
+      key = None if key is None else self.checkpoints.stage_key(key, stage)
+      value = self._run_stage(stage, key, value, forced=self._is_forced(index))
+
+      if stage.fingerprint is not None:
+        key = stage.fingerprint(value)
+      elif key is not None and stage.inputs_fingerprint is not None:
+        key = self.checkpoints.output_key(stage, key)
+      elif key is None:
+        # The stages after one with an unknown input are keyed by its output
+        key = self.input_fingerprint(value)
+
+    return value
+
+  def selected_stages(self) -> List[Stage]:
+    names = [stage.name for stage in self.stages]
+    until = names.index(self.checkpoints.until_stage) + 1 if self.checkpoints.until_stage else len(names)
+
+    return list(self.stages[:until])
+
+  def _is_forced(self, index: int) -> bool:
+    # Stages from --from_stage on are run again even if their checkpoint is present
+    names = [stage.name for stage in self.stages]
+    return self.checkpoints.from_stage is not None and index >= names.index(self.checkpoints.from_stage)
+
+  def _run_stage(self, stage: Stage, key: Optional[str], value: Any, forced: bool) -> Any:
+    if key is None:
+      # A checkpoint stored under a key the next run cannot compute would never be resumed
+      if stage.checkpointed:
+        print(f'Not checkpointing {stage.name}, its input is not known until it runs')
+
+      return run_stage(self.name, stage.name, stage.function, value)
+
+    if stage.checkpointed and not forced:
+      found, stored_value = self.checkpoints.load(stage, key)
+      if found:
+        print(f'Resuming {stage.name} from its checkpoint')
+        return stored_value
+
+    value = run_stage(self.name, stage.name, stage.function, value)
+
+    if stage.checkpointed:
+      self.checkpoints.store(stage, key, value)
+
+    return value
@@ -0,0 +1,92 @@
+import gzip
+import pandas as pd  # type: ignore
+
+from hashlib import sha256
+from os import remove
+from os.path import exists, getsize
+from typing import List, Optional
+
+from grao_tables_processing.common.helper_functions import write_atomically
+
+try:
+  import zstandard  # type: ignore
+except ImportError:
+  zstandard = None
+
+
+# Suffixes of the compressed copies of a CSV, pandas reads them by their suffix as well
+CSV_COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+CSV_COMPRESSIONS = list(CSV_COMPRESSION_SUFFIXES)
+
+
+def csv_file_path(csv_path: str, compression: Optional[str] = None) -> str:
+  return csv_path if compression is None else csv_path + CSV_COMPRESSION_SUFFIXES[compression]
+
+
+def csv_file_paths(csv_path: str) -> List[str]:
+  return [csv_path] + [csv_path + suffix for suffix in CSV_COMPRESSION_SUFFIXES.values()]
+
+
+def existing_csv_path(csv_path: str) -> Optional[str]:
+  return next((path for path in csv_file_paths(csv_path) if exists(path)), None)
+
+
+def is_csv_file(file_name: str) -> bool:
+  return file_name.endswith(tuple(csv_file_paths('.csv')))
+
+
+def uncompressed_csv_path(path: str) -> str:
+  for suffix in CSV_COMPRESSION_SUFFIXES.values():
+    if path.endswith('.csv' + suffix):
+      return path[:-len(suffix)]
+
+  return path
+
+
+def compression_available(compression: Optional[str]) -> bool:
+  return compression != 'zstd' or zstandard is not None
+
+
+def compressed(content: bytes, compression: Optional[str]) -> bytes:
+  if compression is None:
+    return content
+
+  if compression == 'gzip':
+    # Without a timestamp in the header an unchanged table compresses to the same bytes
+    return gzip.compress(content, compresslevel=6, mtime=0)
+
+  if not compression_available(compression):
+    raise ValueError('Compressing the tables with zstd requires the zstandard package!')
+
+  return zstandard.ZstdCompressor().compress(content)
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+  digest = sha256()
+
+  with open(path, 'rb') as f:
+    while chunk := f.read(chunk_size):
+      digest.update(chunk)
+
+  return digest.hexdigest()
+
+
+def write_if_changed(path: str, content: bytes) -> bool:
+  # Unchanged files keep their modification time for the tools reading them incrementally
+  if exists(path) and getsize(path) == len(content) and file_digest(path) == sha256(content).hexdigest():
+    return False
+
+  write_atomically(path, content)
+  return True
+
+
+def store_csv_table(df: pd.DataFrame, csv_path: str, compression: Optional[str] = None) -> bool:
+  path = csv_file_path(csv_path, compression)
+  changed = write_if_changed(path, compressed(df.to_csv().encode('utf-8'), compression))
+
+  # A copy in another compression left from an earlier run could be read instead of this one
+  for other_path in csv_file_paths(csv_path):
+    if other_path != path and exists(other_path):
+      remove(other_path)
+
+  return changed
@@ -1,14 +1,7 @@
-from typing import Callable, Optional
+import grao_tables_processing.settlement_disambiguation.ekatte_register as er
+import grao_tables_processing.settlement_disambiguation.async_lookup as al
 
-from grao_tables_processing.common.pipeline import Pipeline
-from grao_tables_processing.common.custom_types import SettlementDataTuple
 
-import grao_tables_processing.settlement_disambiguation.settlement_disambiguation as sd
-
-settlement_disambiguation: Callable[[SettlementDataTuple], Optional[SettlementDataTuple]] = Pipeline(
-  functions=(
-    sd.fetch_raw_settlement_data,
-    sd.parse_raw_settlement_data,
-    sd.mach_key_with_code
-  )
-)
+EkatteRegister = er.EkatteRegister
+load_ekatte_register = er.load_ekatte_register
+lookup_settlements = al.lookup_settlements
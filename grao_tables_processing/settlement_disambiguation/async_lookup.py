@@ -0,0 +1,83 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from requests import RequestException
+
+from grao_tables_processing.common.async_downloader import create_session
+from grao_tables_processing.common.custom_types import SettlementDataTuple
+from grao_tables_processing.common.profiling import run_stage
+from grao_tables_processing.common.rate_limiter import AdaptiveRateLimiter, call_with_retries
+from grao_tables_processing.settlement_disambiguation.settlement_disambiguation import fetch_raw_settlement_data
+from grao_tables_processing.settlement_disambiguation.settlement_disambiguation import parse_raw_settlement_data
+
+
+LookupResult = Tuple[SettlementDataTuple, Optional[Dict[str, Any]]]
+
+
+def fetch_with_retries(
+  settlement: SettlementDataTuple,
+  limiter: AdaptiveRateLimiter,
+  session: Any,
+  timeout: Optional[float]
+) -> SettlementDataTuple:
+  fetch = partial(fetch_raw_settlement_data, session=session, timeout=timeout)
+
+  return call_with_retries(limiter, partial(run_stage, 'settlement_lookup', 'fetch_raw_settlement_data', fetch, settlement),
+                           exceptions=(ValueError, RequestException))
+
+
+def parse_lookup(response: SettlementDataTuple) -> Optional[Dict[str, Any]]:
+  try:
+    return run_stage('settlement_lookup', 'parse_raw_settlement_data', parse_raw_settlement_data, response).data
+  except (ValueError, IndexError):
+    # A page laid out differently than expected fails only its own settlement
+    print(f'Failed parsing the lookup of {response.key}')
+    return None
+
+
+async def _lookup_settlements(
+  settlements: List[SettlementDataTuple],
+  on_result: Callable[[SettlementDataTuple, Optional[Dict[str, Any]]], None],
+  limiter: AdaptiveRateLimiter,
+  max_in_flight: int,
+  parse_jobs: int,
+  timeout: Optional[float]
+):
+  loop = asyncio.get_running_loop()
+  in_flight = asyncio.Semaphore(max_in_flight)
+
+  with create_session(max_in_flight) as session, \
+       ThreadPoolExecutor(max_workers=max_in_flight) as fetch_executor, \
+       ThreadPoolExecutor(max_workers=parse_jobs) as parse_executor:
+
+    async def lookup(settlement: SettlementDataTuple) -> LookupResult:
+      async with in_flight:
+        try:
+          response = await loop.run_in_executor(fetch_executor, fetch_with_retries, settlement, limiter, session, timeout)
+        except (ValueError, RequestException):
+          print(f'Failed looking up {settlement}')
+          return (settlement, None)
+
+      # Parsed apart from the fetches, so a slow page does not hold back the requests
+      return (settlement, await loop.run_in_executor(parse_executor, parse_lookup, response))
+
+    for result in asyncio.as_completed([lookup(settlement) for settlement in settlements]):
+      on_result(*(await result))
+
+
+def lookup_settlements(
+  settlements: List[SettlementDataTuple],
+  on_result: Callable[[SettlementDataTuple, Optional[Dict[str, Any]]], None],
+  limiter: AdaptiveRateLimiter,
+  max_in_flight: int = 8,
+  parse_jobs: int = 2,
+  timeout: Optional[float] = 60
+):
+  """Looks the settlements up on NSI's website with up to max_in_flight requests at once over a pooled connection.
+
+  on_result gets every settlement with its parsed names, or None if the lookup failed, as soon as they arrive.
+  """
+  asyncio.run(_lookup_settlements(settlements, on_result, limiter, max_in_flight, parse_jobs, timeout))
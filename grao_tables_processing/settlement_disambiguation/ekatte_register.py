@@ -0,0 +1,58 @@
+import csv
+
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from grao_tables_processing.common.custom_types import SettlementDataTuple, SettlementNamesForPeriod
+from grao_tables_processing.settlement_disambiguation.settlement_disambiguation import CandidateIndex
+
+
+# Columns of the register export, one row for every name a settlement had and the period it was valid in
+REGISTER_COLUMNS = ['ekatte', 'region', 'municipality', 'settlement', 'valid_from', 'valid_to']
+REGISTER_DATE_FORMAT = '%d.%m.%Y'
+OLDEST_RECORD_DATE = datetime.strptime('31.12.1899', REGISTER_DATE_FORMAT)
+
+
+def register_date(text: str, default: datetime) -> datetime:
+  text = text.strip()
+
+  return datetime.strptime(text, REGISTER_DATE_FORMAT) if text else default
+
+
+class EkatteRegister(CandidateIndex):
+  """The historical names of all settlements, for resolving them without NSI."""
+
+  def __init__(self, records: Iterable[Tuple[str, SettlementNamesForPeriod]]):
+    super().__init__()
+    self.extend(records)
+
+  def __len__(self) -> int:
+    return sum(len(candidates) for candidates in self.index.values())
+
+  def resolve(self, settlement: SettlementDataTuple, date: Optional[datetime] = None) -> SettlementDataTuple:
+    # Matched in the same way as the names found on NSI's website
+    resolved = self.match(settlement, date)
+
+    if resolved.data is None and date is not None:
+      # The tables can keep using a name for a while after it changed
+      resolved = self.match(settlement)
+
+    return resolved
+
+
+def load_ekatte_register(path: str) -> EkatteRegister:
+  def records(reader: csv.DictReader) -> Iterable[Tuple[str, SettlementNamesForPeriod]]:
+    for row in reader:
+      end = register_date(row['valid_to'], datetime.max)
+
+      if end > OLDEST_RECORD_DATE:
+        name = (row['region'].strip(), row['municipality'].strip(), row['settlement'].strip())
+        yield (row['ekatte'].strip(), SettlementNamesForPeriod(name, register_date(row['valid_from'], datetime.min), end))
+
+  with open(path, encoding='utf-8', newline='') as f:
+    reader = csv.DictReader(f)
+
+    if missing := [column for column in REGISTER_COLUMNS if column not in (reader.fieldnames or [])]:
+      raise ValueError(f'The EKATTE register at {path} is missing the columns {", ".join(missing)}!')
+
+    return EkatteRegister(records(reader))
@@ -1,22 +1,37 @@
+import json
+
 from collections import defaultdict
+from os.path import abspath, dirname, join
 from urllib.parse import quote
 from datetime import datetime
 from bs4 import BeautifulSoup  # type: ignore
-from typing import Dict, Tuple, List
+from typing import Any, Dict, Iterable, Tuple, List, Optional, Set
 
-from grao_tables_processing.common.custom_types import SettlementDataTuple, SettlementNamesForPeriod
+from grao_tables_processing.common.custom_types import CandidateName, SettlementDataTuple, SettlementNamesForPeriod
 from grao_tables_processing.common.helper_functions import fetch_raw_data
 
 
-def fetch_raw_settlement_data(settlement: SettlementDataTuple) -> SettlementDataTuple:
-  name = settlement.data
+DEFAULT_REGION_ALIASES_PATH = join(dirname(dirname(abspath(__file__))), 'data', 'region_aliases.json')
+
 
+def settlement_query_name(name: str) -> str:
   # HACK!!! used to circumvent stripping of non-letter chars from the name
   if name.find('-') != -1:
     name = name.split('-')[1]
 
+  return name
+
+
+def fetch_raw_settlement_data(
+  settlement: SettlementDataTuple,
+  session: Optional[Any] = None,
+  timeout: Optional[float] = None
+) -> SettlementDataTuple:
+  name = settlement_query_name(settlement.data)
+
   encoded_name = quote(name.encode('windows-1251'))
-  data = fetch_raw_data(f'https://www.nsi.bg/nrnm/index.php?ezik=bul&f=6&name={encoded_name}&code=&kind=-1')
+  data = fetch_raw_data(f'https://www.nsi.bg/nrnm/index.php?ezik=bul&f=6&name={encoded_name}&code=&kind=-1',
+                        session=session, timeout=timeout)
   req = data
 
   if req.status_code != 200:
@@ -60,63 +75,71 @@ def parse_raw_settlement_data(settlement: SettlementDataTuple) -> SettlementData
             )
         )
 
-  return SettlementDataTuple(settlement.key, data)
+  return SettlementDataTuple(settlement.key, dict(data))
+
+
+def load_region_aliases(path: str) -> Dict[str, List[str]]:
+  with open(path, encoding='utf-8') as f:
+    return {region.lower(): [alias.lower() for alias in aliases] for region, aliases in json.load(f).items()}
+
+
+# HACK!!! used as a workaround for broken data, the settlements of these regions are listed under other names on NSI's website
+REGION_ALIASES: Dict[str, List[str]] = load_region_aliases(DEFAULT_REGION_ALIASES_PATH)
+
+
+def settlement_index_name(name: str) -> str:
+  # The names on NSI's website keep their "с." and "гр." prefixes
+  return name.split('.')[-1].strip().lower()
+
+
+def candidate_matches(candidate: CandidateName, regions: List[str], municipality: str, date: Optional[datetime]) -> bool:
+  return all([
+    any(candidate.region.find(region) != -1 for region in regions),
+    candidate.municipality.find(municipality) != -1,
+    date is None or candidate.start <= date <= candidate.end
+  ])
+
+
+class CandidateIndex():
+  """The names a settlement could have had, normalized once and indexed by the settlement's name."""
+
+  def __init__(self, names_by_code: Optional[Dict[str, List[SettlementNamesForPeriod]]] = None):
+    self.index: Dict[str, List[CandidateName]] = defaultdict(list)
+    # The keys matching several codes, reported once by the callers instead of for every match
+    self.ambiguous: Set[Tuple[str, str, str]] = set()
+
+    self.extend((code, names) for code, names_list in (names_by_code or {}).items() for names in names_list)
+
+  def extend(self, records: Iterable[Tuple[str, SettlementNamesForPeriod]]):
+    # Sorted once all names are in, so building the index does not re-sort a bucket for every name
+    for code, names in records:
+      candidates = self.index[settlement_index_name(names.name[2])]
+      candidates.append(CandidateName(names.name[0].lower(), names.name[1].lower(), names.start, names.end, code))
+
+    for candidates in self.index.values():
+      # The most recent names come first
+      candidates.sort(key=lambda candidate: (candidate.end, candidate.code), reverse=True)
+
+  def matches(self, key: Tuple[str, str, str], date: Optional[datetime] = None) -> List[CandidateName]:
+    region, municipality, settlement = (part.lower() for part in key)
+    regions = [region] + REGION_ALIASES.get(region, [])
+
+    return [candidate for candidate in self.index.get(settlement, [])
+            if candidate_matches(candidate, regions, municipality, date)]
+
+  def match(self, settlement: SettlementDataTuple, date: Optional[datetime] = None) -> SettlementDataTuple:
+    matches = self.matches(settlement.key, date)
+
+    if not matches:
+      return SettlementDataTuple(settlement.key)
+
+    # if there are multiple matching names take the most recent one
+    if any(candidate.code != matches[0].code for candidate in matches):
+      self.ambiguous.add(settlement.key)
+
+    return SettlementDataTuple(settlement.key, matches[0].code)
 
 
 def mach_key_with_code(settlement: SettlementDataTuple) -> SettlementDataTuple:
-  ker_region = settlement.key[0].lower()
-  ker_municipality = settlement.key[1].lower()
-  ker_settlement = settlement.key[2].lower()
-
-  data_dict = settlement.data
-  result = SettlementDataTuple(settlement.key)
-  result_list = []
-
-  for code, names_list in data_dict.items():
-    for name_data in names_list:
-      region_name = name_data.name[0].lower()
-      municipality_name = name_data.name[1].lower()
-      settlement_name = name_data.name[2].lower()
-
-      straight_case = region_name.find(ker_region) != -1
-
-      # HACK!!! used as a workaround for broken data
-      hack_sf = all([
-        ker_region == 'софийска',
-        region_name.find('софия') != -1
-      ])
-
-      hack_sm = all([
-        ker_region == 'смолян',
-        region_name.find('пловдивска') != -1
-      ])
-
-      hack_pa = all([
-        ker_region == 'пазарджик',
-        region_name.find('пазарджишки') != -1
-      ])
-
-      region_match = any([
-        straight_case,
-        hack_sf,
-        hack_sm,
-        hack_pa
-      ])
-
-      municipality_and_settlement_match = all([
-        municipality_name.find(ker_municipality) != -1,
-        settlement_name.split('.')[-1].strip() == ker_settlement
-      ])
-
-      if all([
-              region_match,
-              municipality_and_settlement_match
-         ]):
-        result_list.append((name_data.end, SettlementDataTuple(settlement.key, code)))
-
-  # if there are multiple matching names take the most recent one
-  result_list = sorted(result_list)
-  if len(result_list) > 0:
-    result = result_list[-1][1]
-
-  return result
+  # Indexes the names for a single settlement, those sharing a lookup should share its CandidateIndex
+  return CandidateIndex(settlement.data).match(settlement)
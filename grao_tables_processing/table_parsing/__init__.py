@@ -1,16 +1,34 @@
+from functools import partial
 from typing import Callable, Optional
 
 from grao_tables_processing.common.custom_types import DataTuple
+from grao_tables_processing.common.http_cache import HTTPCache
 from grao_tables_processing.common.pipeline import Pipeline
 
 import grao_tables_processing.table_parsing.table_parsing as tp
 
-table_parser: Callable[[DataTuple], Optional[DataTuple]] = Pipeline(
-  functions=(
-    tp.fetch_raw_table,
-    tp.raw_table_to_lines,
-    tp.parse_lines,
-    tp.parsed_lines_to_full_info_list,
-    tp.full_info_list_to_data_frame
+
+def create_table_parser(
+  http_cache: Optional[HTTPCache] = None,
+  chunk_jobs: int = 1,
+  chunk_lines: int = 1000
+) -> Callable[[DataTuple], Optional[DataTuple]]:
+  if chunk_jobs == 1:
+    settlement_records = tp.stream_settlement_records
+  else:
+    settlement_records = partial(tp.parallel_settlement_records, num_jobs=chunk_jobs, chunk_lines=chunk_lines)
+
+  return Pipeline(
+    functions=(
+      partial(tp.fetch_raw_table, http_cache=http_cache),
+      tp.raw_table_to_lines,
+      settlement_records,
+      tp.municipality_blocks_to_data_frame
+    ),
+    name='table_parser'
   )
-)
+
+
+table_parser: Callable[[DataTuple], Optional[DataTuple]] = create_table_parser()
+check_line_tokenizers = tp.check_line_tokenizers
+PARSER_VERSION = tp.PARSER_VERSION
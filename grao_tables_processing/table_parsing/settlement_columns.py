@@ -0,0 +1,60 @@
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from array import array
+from sys import intern
+from typing import Dict, List, Sequence
+
+from grao_tables_processing.common.custom_types import MunicipalityIdentifier, SettlementInfo
+from grao_tables_processing.common.name_normalization import fix_names
+
+
+class SettlementColumns():
+  """Typed column buffers the parser appends to, one municipality block at a time."""
+
+  def __init__(self):
+    self.region_codes = array('i')
+    self.municipality_codes = array('i')
+    self.settlements: List[str] = []
+    self.permanent_residents = array('i')
+    self.current_residents = array('i')
+    self.regions: Dict[str, int] = {}
+    self.municipalities: Dict[str, int] = {}
+
+  def __len__(self) -> int:
+    return len(self.settlements)
+
+  def append_block(self, municipality_id: MunicipalityIdentifier, settlements_info: Sequence[SettlementInfo]):
+    region_code = SettlementColumns._category_code(self.regions, fix_names(municipality_id.region))
+    municipality_code = SettlementColumns._category_code(self.municipalities, fix_names(municipality_id.municipality))
+    block_size = len(settlements_info)
+
+    self.region_codes.extend((region_code,) * block_size)
+    self.municipality_codes.extend((municipality_code,) * block_size)
+
+    for settlement_info in settlements_info:
+      self.settlements.append(intern(fix_names(settlement_info.name)))
+      self.permanent_residents.append(settlement_info.permanent_residents)
+      self.current_residents.append(settlement_info.current_residents)
+
+  def to_data_frame(self) -> pd.DataFrame:
+    index = pd.MultiIndex.from_arrays(
+      [
+        pd.Categorical.from_codes(np.frombuffer(self.region_codes, dtype=np.int32), list(self.regions)),
+        pd.Categorical.from_codes(np.frombuffer(self.municipality_codes, dtype=np.int32), list(self.municipalities)),
+        self.settlements,
+      ],
+      names=['region', 'municipality', 'settlement']
+    )
+
+    return pd.DataFrame(
+      {
+        'permanent_residents': np.frombuffer(self.permanent_residents, dtype=np.int32),
+        'current_residents': np.frombuffer(self.current_residents, dtype=np.int32),
+      },
+      index=index
+    )
+
+  @staticmethod
+  def _category_code(categories: Dict[str, int], name: str) -> int:
+    return categories.setdefault(intern(name), len(categories))
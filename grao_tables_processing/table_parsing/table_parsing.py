@@ -1,22 +1,87 @@
-from regex import search  # type: ignore
+from codecs import getincrementaldecoder
+from hashlib import sha256
+from html import unescape
+from itertools import zip_longest
+from regex import split  # type: ignore
 from bs4 import BeautifulSoup  # type: ignore
-from pandas import DataFrame  # type: ignore
-from typing import Optional, Tuple, Match
-
-from grao_tables_processing.common.custom_types import SettlementInfo, MunicipalityIdentifier, FullSettlementInfo, ParsedLines
-from grao_tables_processing.common.custom_types import DataTuple, TableTypeEnum, HeaderEnum
-from grao_tables_processing.common.helper_functions import fix_names, fetch_raw_data
+from functools import partial
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Union
+
+from grao_tables_processing.common.custom_types import SettlementInfo, MunicipalityIdentifier
+from grao_tables_processing.common.custom_types import DataTuple, TableTypeEnum, HeaderEnum, LineTypeEnum
+from grao_tables_processing.common.custom_types import MunicipalityBlock, ParsedChunk, UnexpectedNoneError
+from grao_tables_processing.common.custom_types import ExecutionBackendEnum, TableDownloadError
+from grao_tables_processing.common.helper_functions import execute_in_parallel, fetch_raw_data
+from grao_tables_processing.common.name_normalization import fix_names
 from grao_tables_processing.common.regex_pattern_wrapper import RegexPatternWrapper
+from grao_tables_processing.common.http_cache import HTTPCache
+from grao_tables_processing.common.pipeline import StreamingPipeline
+from grao_tables_processing.table_parsing.settlement_columns import SettlementColumns
+
 
+# Bumped whenever a change to the parsing alters its output, so stored tables get parsed again
+PARSER_VERSION = 2
 
-def fetch_raw_table(data_tuple: DataTuple) -> DataTuple:
+
+def fetch_raw_table(data_tuple: DataTuple, http_cache: Optional[HTTPCache] = None) -> DataTuple:
   url = data_tuple.data
-  req = fetch_raw_data(url)
+
+  if not isinstance(url, str):
+    # The table was already downloaded
+    return data_tuple
+
+  # Without the cache the body is streamed, so the lines are parsed while the table is still downloading
+  req = fetch_raw_data(url, cache=http_cache, stream=True)
+
+  if req.status_code != 200:
+    # An error page would be parsed as an empty table
+    raise TableDownloadError(f'Downloading {url} failed with status {req.status_code}!')
 
   return DataTuple(req, data_tuple.header_type, data_tuple.table_type)
 
 
+class HashingResponse():
+  """Hashes the body of a response while it is read, so a streamed table is hashed without being held in memory."""
+
+  def __init__(self, response: Any):
+    self.response = response
+    self.encoding = response.encoding
+    self.digest = sha256()
+
+  def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+    for chunk in self.response.iter_content(chunk_size):
+      self.digest.update(chunk)
+      yield chunk
+
+  def hexdigest(self) -> str:
+    return self.digest.hexdigest()
+
+
+def iter_raw_table_lines(req: Any, chunk_size: int = 64 * 1024) -> Iterator[str]:
+  decoder = getincrementaldecoder(req.encoding or 'windows-1251')(errors='replace')
+  html_tag = RegexPatternWrapper().compiled['html_tag']
+  pending = ''
+
+  # The text of the lines, with the tags removed and the entities unescaped as BeautifulSoup did
+  for chunk in req.iter_content(chunk_size):
+    pending += decoder.decode(chunk)
+    *lines, pending = pending.split('\n')
+
+    for line in lines:
+      yield unescape(html_tag.sub('', line.rstrip('\r')))
+
+  pending += decoder.decode(b'', final=True)
+  if pending:
+    yield unescape(html_tag.sub('', pending.rstrip('\r')))
+
+
 def raw_table_to_lines(data_tuple: DataTuple) -> DataTuple:
+  lines = iter_raw_table_lines(data_tuple.data)
+
+  return DataTuple(lines, data_tuple.header_type, data_tuple.table_type)
+
+
+def raw_table_to_lines_with_soup(data_tuple: DataTuple) -> DataTuple:
   req = data_tuple.data
   soup_str: str = str(BeautifulSoup(req.text, 'lxml').prettify(encoding=None))
   separator = str('\r\n')
@@ -25,108 +90,215 @@ def raw_table_to_lines(data_tuple: DataTuple) -> DataTuple:
   return DataTuple(split, data_tuple.header_type, data_tuple.table_type)
 
 
-def parse_data_line(line: str, table_type: TableTypeEnum) -> Optional[SettlementInfo]:
-  settlement_info_re = ''
-  permanent_population_position = 2
-  current_population_position = -1
+def _comparable_lines(lines: Iterable[str], is_soup: bool = False) -> List[str]:
+  # Depending on the lxml version line endings may be normalized, and prettify() wraps the table in lines holding only
+  # the tags and their indentation. Only these are normalized, the entities and whitespace of the lines are compared
+  result = [part for line in lines for part in split(r'\r\n|\r|\n', line)]
+
+  if is_soup:
+    # prettify() escapes the text it outputs again, its lines are turned into the text the fast tokenizer yields
+    html_tag = RegexPatternWrapper().compiled['html_tag']
+    result = [unescape(html_tag.sub('', line)) for line in result]
+
+  content = [line_num for line_num, line in enumerate(result) if line.strip()]
+
+  return result[content[0]:content[-1] + 1] if content else []
+
+
+def mismatch_kind(soup_line: Optional[str], fast_line: Optional[str]) -> str:
+  if soup_line is None or fast_line is None:
+    return 'missing line'
+
+  if unescape(soup_line) == unescape(fast_line):
+    return 'entities'
+
+  return 'whitespace' if soup_line.split() == fast_line.split() else 'content'
+
+
+def compare_line_tokenizers(data_tuple: DataTuple) -> List[Tuple[int, Optional[str], Optional[str]]]:
+  soup_lines = _comparable_lines(raw_table_to_lines_with_soup(data_tuple).data, is_soup=True)
+  fast_lines = _comparable_lines(raw_table_to_lines(data_tuple).data)
+
+  return [
+    (line_num, soup_line, fast_line)
+    for line_num, (soup_line, fast_line) in enumerate(zip_longest(soup_lines, fast_lines))
+    if soup_line != fast_line
+  ]
+
 
-  if table_type == TableTypeEnum.Quarterly:
-    settlement_info_re = RegexPatternWrapper().settlement_info_quarterly
-    current_population_position = 3
-  elif table_type == TableTypeEnum.Yearly:
-    settlement_info_re = RegexPatternWrapper().settlement_info_yearly
-    current_population_position = 6
+def settlement_info_from_groups(groups: Tuple[str, ...], table_type: TableTypeEnum) -> SettlementInfo:
+  # Positions of the population counts among the groups of the settlement info pattern
+  permanent_population_position = 1
+  current_population_position = 2 if table_type == TableTypeEnum.Quarterly else 5
 
-  settlement_info = None
-  if settlement_info_group := search(settlement_info_re, line):
-    name: str = settlement_info_group.group(1)
-    permanent: int = int(settlement_info_group.group(permanent_population_position))
-    current: int = int(settlement_info_group.group(current_population_position))
+  name: str = groups[0]
+  permanent: int = int(groups[permanent_population_position])
+  current: int = int(groups[current_population_position])
 
-    name_parts = name.split('.')
-    name = '. '.join([name_parts[0], fix_names(name_parts[1])])
-    settlement_info = SettlementInfo(name.strip(), permanent, current)
+  name_parts = name.split('.')
+  name = '. '.join([name_parts[0], fix_names(name_parts[1])])
 
-  return settlement_info
+  return SettlementInfo(name.strip(), permanent, current)
 
 
-def parse_header_line(
-  line: str,
+def iter_parsed_lines(
+  lines: Iterable[str],
   header_type: HeaderEnum,
-  old_header_state: Optional[Match]
-) -> Tuple[Optional[MunicipalityIdentifier], Optional[Match]]:
-  region: str = ''
-  municipality: str = ''
-  region_name = None
-
-  if header_type == HeaderEnum.New and (region_gr := search(RegexPatternWrapper().region_name_new, line)):
-    region = region_gr.group(1)
-    municipality = region_gr.group(2)
-    region_name = MunicipalityIdentifier(region.strip(), municipality.strip())
-
-  elif header_type == HeaderEnum.Old:
-    if old_header_state is None:
-      old_header_state = search(RegexPatternWrapper().old_reg, line)
-      region_name = None
-    elif mun_gr := search(RegexPatternWrapper().old_mun, line):
-      region = old_header_state.group(1)
-      municipality = mun_gr.group(1)
-      region_name = MunicipalityIdentifier(fix_names(region.strip()), fix_names(municipality.strip()))
+  table_type: TableTypeEnum
+) -> Iterator[Tuple[int, Union[MunicipalityIdentifier, SettlementInfo]]]:
+  # Old headers span two lines, the region is kept until the municipality line is checked
+  old_region: Optional[str] = None
+  classify_line = RegexPatternWrapper().classify_line
+
+  for line_num, line in enumerate(lines):
+    line_type, header, settlement = classify_line(line, header_type, table_type, old_region is not None)
+
+    if line_type == LineTypeEnum.MunicipalityHeader:
+      yield (line_num, municipality_id_from_groups(header, old_region))
+      continue
+
+    old_region = header[0] if line_type == LineTypeEnum.RegionHeader else None
+
+    if settlement:
+      yield (line_num, settlement_info_from_groups(settlement, table_type))
+
+
+def municipality_id_from_groups(header: Tuple[str, ...], old_region: Optional[str]) -> MunicipalityIdentifier:
+  if old_region is None:
+    region, municipality = header
+    return MunicipalityIdentifier(region.strip(), municipality.strip())
+
+  return MunicipalityIdentifier(fix_names(old_region.strip()), fix_names(header[0].strip()))
+
+
+def iter_municipality_blocks(
+  parsed_lines: Iterable[Tuple[int, Union[MunicipalityIdentifier, SettlementInfo]]]
+) -> Iterator[Tuple[MunicipalityIdentifier, List[SettlementInfo]]]:
+  # The settlements of a municipality are emitted once the next municipality header is seen,
+  # so the block after the last one is dropped
+  municipality_id: Optional[MunicipalityIdentifier] = None
+  pending: List[SettlementInfo] = []
+
+  for _, parsed_line in parsed_lines:
+    if isinstance(parsed_line, MunicipalityIdentifier):
+      if municipality_id is not None:
+        yield (municipality_id, pending)
+
+      municipality_id = parsed_line
+      pending = []
+    elif municipality_id is not None:
+      pending.append(parsed_line)
+
+
+def stream_settlement_records(data_tuple: DataTuple) -> DataTuple:
+  record_parser = StreamingPipeline(functions=(
+    partial(iter_parsed_lines, header_type=data_tuple.header_type, table_type=data_tuple.table_type),
+    iter_municipality_blocks,
+  ), name='settlement_records')
+
+  return DataTuple(record_parser(data_tuple.data), data_tuple.header_type, data_tuple.table_type)
+
+
+def is_safe_split(lines: List[str], index: int, header_type: HeaderEnum, table_type: TableTypeEnum) -> bool:
+  classify_line = RegexPatternWrapper().classify_line
+  block_start = LineTypeEnum.RegionHeader if header_type == HeaderEnum.Old else LineTypeEnum.MunicipalityHeader
+
+  # The header state is empty at a block start unless the previous line could have opened an old region header
+  return all([
+    classify_line(lines[index], header_type, table_type)[0] == block_start,
+    classify_line(lines[index - 1], header_type, table_type)[0] != LineTypeEnum.RegionHeader
+  ])
+
+
+def split_into_chunks(
+  lines: List[str],
+  header_type: HeaderEnum,
+  table_type: TableTypeEnum,
+  chunk_lines: int
+) -> List[List[str]]:
+  chunk_lines = max(chunk_lines, 1)
+  starts = [0]
+  index = chunk_lines
+
+  while index < len(lines):
+    if is_safe_split(lines, index, header_type, table_type):
+      starts.append(index)
+      index += chunk_lines
     else:
-      old_header_state = None
+      index += 1
 
-  return (region_name, old_header_state)
+  return [lines[start:end] for start, end in zip(starts, starts[1:] + [len(lines)])]
 
 
-def parse_lines(data_tuple: DataTuple) -> DataTuple:
-  municipality_ids = {}
-  settlements_info = {}
-  old_header_state = None
+def parse_line_chunk(input_data: Tuple[List[str], HeaderEnum, TableTypeEnum]) -> ParsedChunk:
+  lines, header_type, table_type = input_data
+  leading_settlements: List[SettlementInfo] = []
+  blocks: List[MunicipalityBlock] = []
+  open_block: Optional[MunicipalityBlock] = None
+
+  for _, parsed_line in iter_parsed_lines(lines, header_type, table_type):
+    if isinstance(parsed_line, MunicipalityIdentifier):
+      if open_block is not None:
+        blocks.append(open_block)
+      open_block = (parsed_line, [])
+    elif open_block is None:
+      leading_settlements.append(parsed_line)
+    else:
+      open_block[1].append(parsed_line)
 
-  for line_num, line in enumerate(data_tuple.data):
-    municipality_id, old_header_state = parse_header_line(line, data_tuple.header_type, old_header_state)
-    if municipality_id:
-      municipality_ids[line_num] = municipality_id
+  return ParsedChunk(leading_settlements, blocks, open_block)
+
+
+def stitch_parsed_chunks(parsed_chunks: Iterable[ParsedChunk]) -> Iterator[MunicipalityBlock]:
+  # The settlements before the first header of a chunk belong to the block left open by the previous one
+  open_block: Optional[MunicipalityBlock] = None
+
+  for chunk in parsed_chunks:
+    if open_block is not None:
+      open_block[1].extend(chunk.leading_settlements)
+
+    if chunk.open_block is None:
       continue
 
-    settlement_info = parse_data_line(line, data_tuple.table_type)
-    if settlement_info:
-      settlements_info[line_num] = settlement_info
+    if open_block is not None:
+      yield open_block
+
+    yield from chunk.blocks
+    open_block = chunk.open_block
+
+
+def parallel_settlement_records(data_tuple: DataTuple, num_jobs: int = -1, chunk_lines: int = 1000) -> DataTuple:
+  header_type, table_type = data_tuple.header_type, data_tuple.table_type
+  chunks = split_into_chunks(list(data_tuple.data), header_type, table_type, chunk_lines)
 
-  return DataTuple(ParsedLines(municipality_ids, settlements_info), data_tuple.header_type, data_tuple.table_type)
+  chunk_source = ((chunk, header_type, table_type) for chunk in chunks)
+  parsed_chunks = execute_in_parallel(parse_line_chunk, chunk_source, num_jobs, ExecutionBackendEnum.Processes)
 
+  if parsed_chunks is None:
+    raise UnexpectedNoneError('Failed parsing table chunks!')
 
-def parsed_lines_to_full_info_list(data_tuple: DataTuple) -> DataTuple:
+  return DataTuple(stitch_parsed_chunks(parsed_chunks), header_type, table_type)
 
-  regions = data_tuple.data.municipality_ids
-  settlements_info = data_tuple.data.settlements_info
 
-  reg_keys = list(regions.keys())
-  settlement_keys = list(settlements_info.keys())
+def municipality_blocks_to_data_frame(data_tuple: DataTuple) -> DataTuple:
+  columns = SettlementColumns()
 
-  reg_keys_pairs = zip(reg_keys[:-1], reg_keys[1:])
+  for municipality_id, settlements_info in data_tuple.data:
+    columns.append_block(municipality_id, settlements_info)
 
-  sk_index = 0
-  full_name_settlement_infos = []
+  return DataTuple(columns.to_data_frame(), data_tuple.header_type, data_tuple.table_type)
 
-  for current_mun, next_mun in reg_keys_pairs:
-    while current_mun < settlement_keys[sk_index] < next_mun:
-      reg = regions[current_mun]
-      set_info = settlements_info[settlement_keys[sk_index]]
-      full_info = FullSettlementInfo(fix_names(reg.region),
-                                     fix_names(reg.municipality),
-                                     fix_names(set_info.name),
-                                     set_info.permanent_residents,
-                                     set_info.current_residents)
-      full_name_settlement_infos.append(full_info)
 
-      sk_index += 1
+def check_line_tokenizers(data_source: List[DataTuple], http_cache: Optional[HTTPCache] = None) -> bool:
+  all_match = True
 
-  return DataTuple(full_name_settlement_infos, data_tuple.header_type, data_tuple.table_type)
+  for data_tuple in data_source:
+    mismatches = compare_line_tokenizers(fetch_raw_table(data_tuple, http_cache))
+    print(f'{data_tuple.data}: {len(mismatches)} mismatching lines')
 
+    for line_num, soup_line, fast_line in mismatches[:5]:
+      print(f'  line {line_num} ({mismatch_kind(soup_line, fast_line)}): {soup_line!r} != {fast_line!r}')
 
-def full_info_list_to_data_frame(data_tuple: DataTuple) -> DataTuple:
-  df = DataFrame(data_tuple.data)
-  df.set_index(['region', 'municipality', 'settlement'], drop=True, inplace=True)
+    all_match = all_match and not mismatches
 
-  return DataTuple(df, data_tuple.header_type, data_tuple.table_type)
+  return all_match
@@ -1,19 +1,54 @@
 from typing import Callable, List
 
 import grao_tables_processing.table_processing.table_processing as tp
+import grao_tables_processing.table_processing.processed_tables_manifest as ptm
+import grao_tables_processing.table_processing.low_memory_processing as lmp
 
-from grao_tables_processing.common.custom_types import DataTuple
+from grao_tables_processing.common.custom_types import DataTuple, Stage
 from grao_tables_processing.common.configuration import Configuration
 from grao_tables_processing.common.pipeline import Pipeline
+from grao_tables_processing.common.stage_checkpoints import CheckpointedPipeline, fingerprint
+
+
+TABLE_PROCESSING_STAGES = ['download', 'parse', 'disambiguate', 'store', 'combine', 'store_combined']
+
+
+def table_processing_stages(config: Configuration) -> List[Stage]:
+  return [
+    Stage('download', (lambda data: tp.download_data(data, config)),
+          checkpointed=False, fingerprint=tp.downloaded_tables_fingerprint),
+    Stage('parse', (lambda downloaded: tp.process_data(downloaded.data_source, config, downloaded.responses))),
+    Stage('disambiguate', (lambda data: tp.disambiguate_data(data, config)),
+          inputs_fingerprint=(lambda: tp.disambiguation_inputs_fingerprint(config))),
+    Stage('store', (lambda data: tp.store_data_list(data, config)), checkpointed=False),
+    Stage('combine', (lambda data: tp.combine_data(data, config))),
+    Stage('store_combined', (lambda data: tp.store_combined_data(data, config)), checkpointed=False),
+  ]
 
 
 def create_table_processor(config: Configuration) -> Callable[[List[DataTuple]], List[DataTuple]]:
-  processing_pipeline = Pipeline(functions=(
-    (lambda data: tp.process_data(data, config)),
-    (lambda data: tp.disambiguate_data(data, config)),
-    (lambda data: tp.store_data_list(data, config)),
-    (lambda data: tp.combine_data(data, config)),
-    (lambda data: tp.store_combined_data(data, config)),
-  ))
+  if config['low_memory']:
+    # A single stage, so no list of tables is held between stages or checkpointed
+    return Pipeline(
+      functions=((lambda data: lmp.process_tables_low_memory(data, config)),),
+      name='table_processing',
+      stage_names=['low_memory']
+    )
+
+  stages = table_processing_stages(config)
+
+  if config['stage_checkpoints'] is not None:
+    return CheckpointedPipeline(stages, config['stage_checkpoints'], fingerprint, name='table_processing')
+
+  processing_pipeline = Pipeline(
+    functions=tuple(stage.function for stage in stages),
+    name='table_processing',
+    stage_names=[stage.name for stage in stages]
+  )
 
   return processing_pipeline
+
+
+ACCUMULATED_ARTIFACTS = tp.ACCUMULATED_ARTIFACTS
+ProcessedTablesManifest = ptm.ProcessedTablesManifest
+default_manifest_path = ptm.default_manifest_path
@@ -0,0 +1,160 @@
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from os import remove
+from os.path import exists
+from tempfile import NamedTemporaryFile
+from typing import List, Optional, Tuple
+
+import grao_tables_processing.table_processing.table_processing as tp
+
+from grao_tables_processing.common.configuration import Configuration
+from grao_tables_processing.common.custom_types import DataTuple, HeaderEnum, TableTypeEnum, UnexpectedNoneError
+
+
+class CombinedMatrixFile():
+  """The combined table filled one period at a time in a memory mapped file, with a row for every known EKATTE code."""
+
+  def __init__(self, directory: str, codes: pd.Index, periods: int):
+    self.directory = directory
+    self.codes = pd.Index(np.sort(pd.unique(codes.to_numpy())), name='ekatte')
+    self.periods = periods
+    self.present = np.zeros(len(self.codes), dtype=bool)
+    self.columns: List[str] = []
+    self.path: Optional[str] = None
+    self.matrix: Optional[np.ndarray] = None
+
+  def fold(self, period: int, df: pd.DataFrame):
+    if self.matrix is None:
+      self.matrix = self._allocate(len(self.codes), df.shape[1])
+
+    if not (missing := df.index.difference(self.codes)).empty:
+      # Stored tables could have been matched with codes since dropped from the pickled ones
+      self.matrix = self._grown(self.matrix, missing)
+
+    rows = self.codes.get_indexer(df.index)
+    self.matrix[rows, period, :] = df.to_numpy()
+    self.present[rows] = True
+    self.columns += list(df.columns)
+
+  def data_frame(self) -> pd.DataFrame:
+    if self.matrix is None:
+      raise UnexpectedNoneError('Failed to combine DataFarmes')
+
+    # Only the settlements present in some period get a row, as in the combined table built in memory
+    values = np.array(self.matrix[self.present]).reshape(int(self.present.sum()), -1)
+
+    return pd.DataFrame(values, index=self.codes[self.present], columns=self.columns)
+
+  def close(self):
+    self.matrix = None
+
+    if self.path is not None and exists(self.path):
+      remove(self.path)
+
+  def _allocate(self, rows: int, columns_per_period: int) -> np.ndarray:
+    old_path = self.path
+
+    with NamedTemporaryFile(dir=self.directory, prefix='.tmp-', suffix='.npy', delete=False) as f:
+      self.path = f.name
+
+    if old_path is not None:
+      # The mapping of the old file stays valid until it is dropped
+      remove(old_path)
+
+    # Settlements missing from a period keep the 0 of the fresh file
+    return np.lib.format.open_memmap(self.path, mode='w+', dtype=np.int32, shape=(rows, self.periods, columns_per_period))
+
+  def _grown(self, old_matrix: np.ndarray, missing: pd.Index) -> np.ndarray:
+    old_codes, old_present = self.codes, self.present
+    self.codes = pd.Index(np.sort(np.concatenate([old_codes.to_numpy(), missing.to_numpy()])), name='ekatte')
+
+    rows = self.codes.get_indexer(old_codes)
+    self.present = np.zeros(len(self.codes), dtype=bool)
+    self.present[rows] = old_present
+
+    matrix = self._allocate(len(self.codes), old_matrix.shape[2])
+    matrix[rows] = old_matrix
+
+    return matrix
+
+
+def parse_tables_one_by_one(
+  data_source: List[DataTuple],
+  config: Configuration
+) -> Tuple[List[Tuple[DataTuple, Optional[str]]], List[pd.DataFrame]]:
+  """Parses the new or changed tables one at a time and sets them aside, keeping only the names of their settlements.
+
+  Returns the tables with the output stored by an earlier run for those that failed downloading and were not parsed
+  by one, tables parsed by an earlier run from the same body are not parsed again.
+  """
+  tables: List[Tuple[DataTuple, Optional[str]]] = []
+  settlements: List[pd.DataFrame] = []
+  missing = []
+
+  for dt in data_source:
+    response = tp.download_tables([dt], config)[0]
+    parsed = tp.stored_parsed_table(dt, tp.source_hash(response), config)
+
+    if parsed is None:
+      parsed, parsed_digest = tp.process_data_tuple((config['table_parser'], dt, response, config['http_cache']))
+
+      if not tp.is_failed(parsed):
+        tp.store_parsed_tables([(dt, parsed, parsed_digest)], config)
+      elif (parsed := tp.previous_parsed_table(dt, config)) is None:
+        if (output_file := tp.previous_output(dt, config)) is not None:
+          tables.append((dt, output_file))
+        else:
+          missing.append(dt.data)
+        continue
+
+    # Only the first occurrence of every settlement is kept, as when they are collected from all tables at once
+    settlements = [tp.unique_settlements(settlements + [tp.settlement_names(parsed.data)])]
+    tables.append((dt, None))
+
+  tp.record_missing_tables(missing, config)
+
+  return tables, settlements
+
+
+def disambiguated_table(
+  dt: DataTuple,
+  output_file: Optional[str],
+  ekatte_keys: pd.DataFrame,
+  config: Configuration
+) -> DataTuple:
+  if output_file is not None:
+    return tp.load_processed_table(output_file, dt)
+
+  parsed = tp.artifact_store(config).load(tp.parsed_table_name(dt))
+
+  if parsed is None:
+    raise UnexpectedNoneError(f'The parsed table for {dt.data} is missing!')
+
+  keyed = DataTuple(tp.with_settlement_keys(parsed.data), parsed.header_type, parsed.table_type)
+
+  return tp.update_data_frame((keyed, ekatte_keys))
+
+
+def process_tables_low_memory(data_source: List[DataTuple], config: Configuration) -> List[DataTuple]:
+  """Processes the tables one at a time, so only one of them and the combined table are held in memory at once.
+
+  The settlements of all tables are still disambiguated together, so the results are the same as in memory.
+  """
+  tables, settlements = parse_tables_one_by_one(data_source, config)
+  ekatte_keys = tp.disambiguate_settlements(tp.settlement_data_tuples(settlements), config)
+
+  combined_matrix = CombinedMatrixFile(config.combined_tables_path, pd.Index(ekatte_keys['ekatte']), len(tables))
+  try:
+    for period, (dt, output_file) in enumerate(tables):
+      table = disambiguated_table(dt, output_file, ekatte_keys, config).data
+      tp.store_table(table, tp.stored_table_path(table, config), config)
+      combined_matrix.fold(period, tp.value_frame(table))
+
+    combined = combined_matrix.data_frame()
+  finally:
+    combined_matrix.close()
+
+  tp.artifact_store(config).store('combined_tables', combined)
+
+  return tp.store_combined_data([DataTuple(combined, HeaderEnum(0), TableTypeEnum(0))], config)
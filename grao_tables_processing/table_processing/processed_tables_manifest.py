@@ -0,0 +1,60 @@
+import json
+
+from os.path import exists, normpath
+from typing import Any, Dict, Optional
+
+from grao_tables_processing.common.helper_functions import write_atomically
+from grao_tables_processing.common.table_files import existing_csv_path
+from grao_tables_processing.table_parsing.table_parsing import PARSER_VERSION
+
+
+def default_manifest_path(processed_tables_path: str) -> str:
+  # Kept next to the directory, which should only contain the processed tables
+  return f'{normpath(processed_tables_path)}_manifest.json'
+
+
+class ProcessedTablesManifest():
+  """Records the source hash, parser version and output file of every processed table, keyed by URL."""
+
+  def __init__(self, path: str, entries: Optional[Dict[str, Dict[str, Any]]] = None):
+    self.path = path
+    self.entries = entries if entries is not None else {}
+
+  @staticmethod
+  def load(path: str) -> 'ProcessedTablesManifest':
+    if not exists(path):
+      return ProcessedTablesManifest(path)
+
+    with open(path, encoding='utf-8') as f:
+      return ProcessedTablesManifest(path, json.load(f))
+
+  def save(self):
+    write_atomically(self.path, json.dumps(self.entries, indent=2, sort_keys=True).encode('utf-8'))
+
+  def is_up_to_date(self, url: str, source_hash: Optional[str]) -> bool:
+    entry = self.entries.get(url)
+
+    if source_hash is None or entry is None:
+      return False
+
+    return entry['source_hash'] == source_hash and entry['parser_version'] == PARSER_VERSION
+
+  def stored_output(self, url: str) -> Optional[str]:
+    # Whatever version of the table it was processed from
+    entry = self.entries.get(url)
+
+    if entry is None or existing_csv_path(entry['output_file']) is None:
+      return None
+
+    return entry['output_file']
+
+  def record(self, url: str, source_hash: Optional[str], output_file: str):
+    if source_hash is None:
+      # The entry of an earlier run stays, without the body there is nothing to replace it with
+      return
+
+    self.entries[url] = {
+      'source_hash': source_hash,
+      'parser_version': PARSER_VERSION,
+      'output_file': output_file,
+    }
@@ -1,124 +1,354 @@
+import numpy as np  # type: ignore
 import pandas as pd  # type: ignore
-import random
-import time
 
 from regex import search  # type: ignore
+from collections import defaultdict
+from datetime import datetime
 from itertools import chain
-from typing import Tuple, Callable, List, Dict, Any, Optional, Generator
+from hashlib import sha256
+from os.path import exists
+from typing import Tuple, Callable, List, Dict, Any, Optional
+
+from requests import RequestException
 
 from grao_tables_processing.common.custom_types import DataTuple, SettlementDataTuple, HeaderEnum, TableTypeEnum
-from grao_tables_processing.common.custom_types import UnexpectedNoneError
-from grao_tables_processing.common.helper_functions import execute_in_parallel, fix_names
+from grao_tables_processing.common.custom_types import DownloadedTables, ExecutionBackendEnum, UnexpectedNoneError
+from grao_tables_processing.common.custom_types import FailedDownload, OfflineCacheMissError, TableDownloadError
+from grao_tables_processing.common.helper_functions import execute_in_parallel
+from grao_tables_processing.common.rate_limiter import format_statistics, shared_rate_limiter
+from grao_tables_processing.common.name_normalization import normalized_names
 from grao_tables_processing.common.regex_pattern_wrapper import RegexPatternWrapper
-from grao_tables_processing.common.pickle_wrapper import PickleWrapper
+from grao_tables_processing.common.artifact_store import ArtifactStore
 from grao_tables_processing.common.configuration import Configuration
-
-
-def process_data_tuple(input_data: Tuple[Callable[[DataTuple], DataTuple], DataTuple]) -> DataTuple:
-  parsing_pipeline, data_tuple = input_data
-
+from grao_tables_processing.common.http_cache import HTTPCache
+from grao_tables_processing.common.binary_tables import read_table, remove_binary_table, store_binary_table
+from grao_tables_processing.common.table_files import file_digest, store_csv_table
+from grao_tables_processing.table_processing.table_schema import compact_data_frames
+from grao_tables_processing.table_parsing.table_parsing import HashingResponse, fetch_raw_table
+from grao_tables_processing.settlement_disambiguation.ekatte_register import EkatteRegister
+from grao_tables_processing.settlement_disambiguation.settlement_disambiguation import CandidateIndex
+from grao_tables_processing.settlement_disambiguation.settlement_disambiguation import settlement_query_name
+from grao_tables_processing.settlement_disambiguation.async_lookup import lookup_settlements
+
+
+NAME_COLUMNS = ['region', 'municipality', 'settlement']
+KEY_COLUMNS = ['region_key', 'municipality_key', 'settlement_key']
+NSI_HOST = 'www.nsi.bg'
+LOOKUPS_STORED_EVERY = 100
+NSI_LOOKUP_JOBS = 8
+DOWNLOAD_ERRORS = (TableDownloadError, RequestException, OfflineCacheMissError)
+# Accumulated over the runs from NSI's website, unlike the intermediates they cannot be computed again
+ACCUMULATED_ARTIFACTS = ('triple_to_ekatte', 'ekatte_to_triple', 'nsi_lookups')
+
+
+def table_date_string(data_tuple: DataTuple) -> str:
   if data_tuple.table_type == TableTypeEnum.Quarterly:
     date_group = RegexPatternWrapper().date_group
   else:
     date_group = RegexPatternWrapper().year_group
 
-  date_string: str = search(date_group, data_tuple.data).group(1).replace('-', '_')
-  data_frame = parsing_pipeline(data_tuple).data
+  return search(date_group, data_tuple.data).group(1).replace('-', '_')
+
+
+def processed_table_path(data_tuple: DataTuple, config: Configuration) -> str:
+  return f'{config.processed_tables_path}/grao_data_{table_date_string(data_tuple)}.csv'
+
+
+def failed_table(data_tuple: DataTuple, reason: str) -> DataTuple:
+  # The other tables are still processed, this one is replaced with the one stored by an earlier run
+  print(f'Downloading {data_tuple.data} failed, falling back to the table stored by an earlier run: {reason}')
+
+  return DataTuple(None, data_tuple.header_type, data_tuple.table_type)
+
+
+def is_failed(data_tuple: DataTuple) -> bool:
+  return data_tuple.data is None
+
+
+ParsingJob = Tuple[Callable[[DataTuple], DataTuple], DataTuple, Optional[Any], Optional[HTTPCache]]
+
+
+def process_data_tuple(input_data: ParsingJob) -> Tuple[DataTuple, Optional[str]]:
+  """Parses a table, returned with the hash of the body it was parsed from, or None if the table failed."""
+  parsing_pipeline, source, response, http_cache = input_data
+
+  if isinstance(response, FailedDownload):
+    return failed_table(source, response.reason), None
+
+  date_string = table_date_string(source)
+
+  try:
+    # Tables not downloaded beforehand are streamed by the job itself
+    body = HashingResponse(response if response is not None else fetch_raw_table(source, http_cache).data)
+    data_frame = parsing_pipeline(DataTuple(body, source.header_type, source.table_type)).data
+  except DOWNLOAD_ERRORS as error:
+    return failed_table(source, str(error)), None
+
   data_frame = data_frame.rename(columns={'permanent_residents': f'permanent_{date_string}',
                                           'current_residents': f'current_{date_string}'})
 
+  return DataTuple(with_settlement_keys(data_frame), source.header_type, source.table_type), body.hexdigest()
+
+
+def with_settlement_keys(data_frame: pd.DataFrame) -> pd.DataFrame:
+  # The normalized (region, municipality, settlement) triple the EKATTE codes are looked up by,
+  # computed at parse time and carried along until the table is disambiguated
+  names = data_frame.index.to_frame(index=False)
+
+  return data_frame.assign(
+    region_key=normalized_names(names['region'], str),
+    municipality_key=normalized_names(names['municipality'], str),
+    settlement_key=normalized_names(names['settlement'], lambda name: name.split('.')[1])
+  )
+
+
+def load_processed_table(path: str, data_tuple: DataTuple) -> DataTuple:
+  data_frame = read_table(path, 'ekatte')
+
   return DataTuple(data_frame, data_tuple.header_type, data_tuple.table_type)
 
 
-def process_data(data_source: List[DataTuple], config: Configuration) -> List[DataTuple]:
+def is_disambiguated(data_tuple: DataTuple) -> bool:
+  # Parsed tables are indexed by name, the stored ones were already matched to their EKATTE codes
+  return data_tuple.data.index.name == 'ekatte'
+
+
+def download_tables(data_source: List[DataTuple], config: Configuration) -> List[Optional[Any]]:
+  table_downloader = config['table_downloader']
+
+  if table_downloader is None:
+    # Every parsing job downloads its own table
+    return [None for _ in data_source]
+
+  return table_downloader([dt.data for dt in data_source])
+
+
+def source_hash(response: Optional[Any]) -> Optional[str]:
+  if response is None or isinstance(response, FailedDownload):
+    return None
+
+  return sha256(response.content).hexdigest()
+
+
+def parsed_table_name(data_tuple: DataTuple) -> str:
+  return f'parsed_table_{table_date_string(data_tuple)}'
+
+
+def stored_parsed_table(data_tuple: DataTuple, digest: Optional[str], config: Configuration) -> Optional[DataTuple]:
+  """The table parsed by an earlier run from the same body, with its keys computed again from the current aliases."""
+  manifest = config['processed_tables_manifest']
+
+  if manifest is None or not manifest.is_up_to_date(data_tuple.data, digest):
+    return None
+
+  store = artifact_store(config)
+  metadata = store.metadata(parsed_table_name(data_tuple))
+
+  # Evicted or replaced since the manifest was written
+  if metadata is None or metadata['source_hash'] != digest:
+    return None
+
+  if (parsed := store.load(parsed_table_name(data_tuple))) is None:
+    return None
+
+  return DataTuple(with_settlement_keys(parsed.data), parsed.header_type, parsed.table_type)
+
+
+def previous_parsed_table(data_tuple: DataTuple, config: Configuration) -> Optional[DataTuple]:
+  metadata = artifact_store(config).metadata(parsed_table_name(data_tuple))
+
+  if metadata is None:
+    return None
+
+  return stored_parsed_table(data_tuple, metadata['source_hash'], config)
+
+
+def previous_output(data_tuple: DataTuple, config: Configuration) -> Optional[str]:
+  manifest = config['processed_tables_manifest']
+
+  return manifest.stored_output(data_tuple.data) if manifest is not None else None
+
+
+def previous_table(data_tuple: DataTuple, config: Configuration) -> Optional[DataTuple]:
+  """The table as an earlier run left it, used in place of one that failed downloading.
+
+  The parsed table is matched again like the reused ones, only the output is left as it was stored.
+  """
+  if (parsed := previous_parsed_table(data_tuple, config)) is not None:
+    return parsed
+
+  if (output_file := previous_output(data_tuple, config)) is not None:
+    return load_processed_table(output_file, data_tuple)
+
+  return None
+
+
+def record_missing_tables(urls: List[str], config: Configuration):
+  # The combined table is left as it is rather than stored without their periods
+  config['missing_tables'] = urls
+
+  for url in urls:
+    print(f'No earlier run stored {url}, the combined table will not be updated')
+
+
+def store_parsed_tables(parsed: List[Tuple[DataTuple, DataTuple, Optional[str]]], config: Configuration):
+  """Keeps the tables as they were parsed, before they are matched with the EKATTE codes.
+
+  The tables reused by the next runs are matched again, so they get the codes resolved after they were parsed.
+  The manifest is saved right away, the entries only point to the stored tables.
+  """
+  store = artifact_store(config)
+  manifest = config['processed_tables_manifest']
+
+  for source, parsed_dt, digest in parsed:
+    table = DataTuple(parsed_dt.data.drop(columns=KEY_COLUMNS), parsed_dt.header_type, parsed_dt.table_type)
+    store.store(parsed_table_name(source), table, source_hash=digest)
+
+    if manifest is not None:
+      manifest.record(source.data, digest, processed_table_path(source, config))
+
+  if manifest is not None and parsed:
+    manifest.save()
+
+
+def download_data(data_source: List[DataTuple], config: Configuration) -> DownloadedTables:
+  return DownloadedTables(data_source, download_tables(data_source, config))
+
+
+def downloaded_tables_fingerprint(downloaded: DownloadedTables) -> Optional[str]:
+  hashes = [source_hash(response) for response in downloaded.responses]
+
+  if any(digest is None for digest in hashes):
+    # Tables downloaded by the parsing jobs themselves or not downloaded at all could have changed,
+    # so the stages after the parsing are keyed by the parsed tables instead
+    return None
+
+  digest = sha256()
+  for dt, table_hash in zip(downloaded.data_source, hashes):
+    digest.update(f'{dt.data}:{dt.header_type}:{dt.table_type}:{table_hash}\n'.encode('utf-8'))
+
+  return digest.hexdigest()
+
+
+def disambiguation_inputs_fingerprint(config: Configuration) -> str:
+  """The EKATTE register and the codes matched in earlier runs, which the disambiguation reads besides the tables."""
+  store = artifact_store(config)
+  register_path = config['ekatte_register_path']
+  paths = [register_path] if register_path is not None else []
+  paths += [store.data_path(name) for name in ('triple_to_ekatte', 'ekatte_to_triple')]
+
+  return ':'.join(file_digest(path) if exists(path) else '-' for path in paths)
+
+
+def process_data(
+  data_source: List[DataTuple],
+  config: Configuration,
+  responses: Optional[List[Optional[Any]]] = None
+) -> List[DataTuple]:
   parsing_pipeline = config['table_parser']
-  wrapped_data_source = ((parsing_pipeline, dt) for dt in data_source)
+  if responses is None:
+    responses = download_tables(data_source, config)
+  hashes = [source_hash(response) for response in responses]
+  stored_tables = [stored_parsed_table(dt, digest, config) for dt, digest in zip(data_source, hashes)]
 
-  data_frame_list = execute_in_parallel(process_data_tuple, wrapped_data_source)
+  # Only new or changed tables are parsed, the rest are reused as the previous runs parsed them
+  changed = [(dt, response) for dt, response, table in zip(data_source, responses, stored_tables) if table is None]
+  wrapped_data_source = ((parsing_pipeline, dt, response, config['http_cache']) for dt, response in changed)
 
-  if data_frame_list is None:
+  parsed_data = execute_in_parallel(process_data_tuple, wrapped_data_source, config['parse_jobs'] or -1,
+                                    ExecutionBackendEnum.Processes)
+
+  if parsed_data is None:
     raise UnexpectedNoneError('Failed parsing tables!')
 
-  PickleWrapper.pickle_data(data_frame_list, 'data_frames_list')
+  # The hashes of the bodies the jobs downloaded themselves are only known once they are parsed
+  store_parsed_tables([(dt, parsed_dt, digest) for (dt, _), (parsed_dt, digest) in zip(changed, parsed_data)
+                       if not is_failed(parsed_dt)], config)
+
+  parsed_iterator = (parsed_dt for parsed_dt, _ in parsed_data)
+  tables = [next(parsed_iterator) if table is None else table for table in stored_tables]
+  # The tables that failed downloading are replaced with the ones stored by the earlier runs, if there are any
+  period_tables = [previous_table(source, config) if is_failed(dt) else dt for source, dt in zip(data_source, tables)]
+  record_missing_tables([source.data for source, dt in zip(data_source, period_tables) if dt is None], config)
+  data_frame_list = compact_data_frames([dt for dt in period_tables if dt is not None])
+
+  artifact_store(config).store('data_frames_list', data_frame_list)
 
   return data_frame_list
 
 
-def load_ekatte_dicts() -> Tuple[Dict[Any, Any], Dict[Any, Any]]:
-  processed_sdts = PickleWrapper.load_data('triple_to_ekatte')
+def artifact_store(config: Configuration) -> ArtifactStore:
+  # Every pipeline can be configured with a store of its own
+  return config['artifact_store'] or ArtifactStore(config.pickled_data_path)
+
+
+def load_ekatte_dicts(store: ArtifactStore) -> Tuple[Dict[Any, Any], Dict[Any, Any]]:
+  processed_sdts = store.load('triple_to_ekatte')
   if (processed_sdts is None) or (not isinstance(processed_sdts, dict)):
     processed_sdts = {}
 
-  reverse_dict = PickleWrapper.load_data('ekatte_to_triple')
+  reverse_dict = store.load('ekatte_to_triple')
   if (reverse_dict is None) or (not isinstance(reverse_dict, dict)):
     reverse_dict = {}
 
   return processed_sdts, reverse_dict
 
 
-def make_settlements_data_tuple_list(data_frame_list: List[DataTuple]) -> List[Tuple[SettlementDataTuple, str]]:
-  sdt_list = list(map(lambda tup: (SettlementDataTuple(tup[0], tup[0][2]), tup[1]),
-                      map(lambda name: ((fix_names(name[0].strip()),
-                                         fix_names(name[1].strip()),
-                                         fix_names(name[2].split('.')[1].strip())),
-                                        name),
-                          set(chain.from_iterable(
-                              map(lambda dt: dt.data.index.values.tolist(),
-                                  data_frame_list))))))
-  return sdt_list
+def table_date(data_frame: pd.DataFrame) -> datetime:
+  # The quarterly tables count the residents on the 15th of their month, the yearly ones at the end of the year
+  date_string = next(column for column in data_frame.columns if column.startswith('permanent_'))[len('permanent_'):]
+  parts = [int(part) for part in date_string.split('_')]
 
+  return datetime(parts[1], parts[0], 15) if len(parts) == 2 else datetime(parts[0], 12, 31)
 
-def sleep_time_generator(random_seed: float) -> Generator[float, None, None]:
-  return (st + (st + 1) * random_seed for st in range(round(random_seed), 60, round(5 + 10 * random_seed)))
 
+def settlement_names(data_frame: pd.DataFrame) -> pd.DataFrame:
+  names = data_frame.reset_index()[NAME_COLUMNS + KEY_COLUMNS].drop_duplicates(subset=NAME_COLUMNS)
 
-def try_disambiguation(
-  input_data: Tuple[Callable[[SettlementDataTuple], SettlementDataTuple], SettlementDataTuple]
-) -> Tuple[SettlementDataTuple, SettlementDataTuple]:
-  disambiguation_pipeline, sdt = input_data
+  return names.assign(date=table_date(data_frame))
 
-  for sleep_time in sleep_time_generator(random.random()):
-    time.sleep(sleep_time)
-    try:
-      result = disambiguation_pipeline(sdt)
-    except ValueError:
-      print(f'Failed disambiguating {sdt} with {sleep_time:.3f}s sleep')
-      continue
 
-    return (result, sdt)
+def make_settlements_data_tuple_list(data_frame_list: List[DataTuple]) -> List[Tuple[SettlementDataTuple, str, datetime]]:
+  return settlement_data_tuples([settlement_names(dt.data) for dt in data_frame_list])
 
-  return (SettlementDataTuple(sdt.key), sdt)
 
+def unique_settlements(settlement_frames: List[pd.DataFrame]) -> pd.DataFrame:
+  settlements = pd.concat(settlement_frames)
+  # Every name is resolved to the settlement that had it on the latest date it was found on
+  settlements['date'] = settlements.groupby(NAME_COLUMNS, observed=True, sort=False)['date'].transform('max')
+
+  return settlements.drop_duplicates(subset=NAME_COLUMNS)
 
-def check_sdt_availability(key: SettlementDataTuple, processed_sdts: Dict[Any, Any], reverse_dict: Dict[Any, Any]) -> bool:
-  return key.key in processed_sdts and processed_sdts[key.key] in reverse_dict
 
+def settlement_data_tuples(settlement_frames: List[pd.DataFrame]) -> List[Tuple[SettlementDataTuple, str, datetime]]:
+  if not settlement_frames:
+    return []
 
-def update_data_frame(input_data: Tuple[DataTuple, Dict[Any, Any]]) -> DataTuple:
-  dt, processed_sdts = input_data
-  df = dt.data
-  df.reset_index(inplace=True)
-  df['ekatte'] = df['settlement']
-  cols = df.columns
+  settlements = unique_settlements(settlement_frames)
 
-  def update_df(x: Tuple[str, str, str, int, int, str]) -> Tuple[str, str, str, int, int, Optional[str]]:
-    result = (x[0],
-              x[1],
-              x[2],
-              x[3],
-              x[4],
-              processed_sdts.get((fix_names(x[0].strip()),
-                                  fix_names(x[1].strip()),
-                                  fix_names(x[2].split('.')[1].strip())),
-                                 None))
+  return [(SettlementDataTuple(key, key[2]), name, date.to_pydatetime())
+          for name, key, date in zip(settlements[NAME_COLUMNS].itertuples(index=False, name=None),
+                                     settlements[KEY_COLUMNS].itertuples(index=False, name=None),
+                                     settlements['date'])]
 
-    return result
 
-  df = pd.DataFrame([update_df(x) for x in df.to_numpy()])
+def ekatte_key_frame(processed_sdts: Dict[Any, Any]) -> pd.DataFrame:
+  keys = pd.DataFrame(list(processed_sdts.keys()), columns=KEY_COLUMNS)
+  keys['ekatte'] = list(processed_sdts.values())
 
-  df.columns = cols
-  df.dropna(inplace=True)
-  df.set_index(['ekatte'], drop=True, inplace=True)
+  return keys.dropna()
+
+
+def check_sdt_availability(key: SettlementDataTuple, processed_sdts: Dict[Any, Any], reverse_dict: Dict[Any, Any]) -> bool:
+  return key.key in processed_sdts and processed_sdts[key.key] in reverse_dict
+
+
+def update_data_frame(input_data: Tuple[DataTuple, pd.DataFrame]) -> DataTuple:
+  dt, ekatte_keys = input_data
+
+  # The inner merge keeps the order of the table and drops the settlements without a code
+  df = dt.data.reset_index().merge(ekatte_keys, how='inner', on=KEY_COLUMNS)
+  df = df.drop(columns=KEY_COLUMNS).set_index('ekatte')
 
   df = df.loc[~df.index.duplicated(keep='first')]
 
@@ -126,7 +356,8 @@ def update_data_frame(input_data: Tuple[DataTuple, Dict[Any, Any]]) -> DataTuple
 
 
 def filter_disambiguated_sdts(
-  sdt_pairs: List[Tuple[SettlementDataTuple, SettlementDataTuple]]
+  sdt_pairs: List[Tuple[SettlementDataTuple, SettlementDataTuple]],
+  store: ArtifactStore
 ) -> List[Tuple[SettlementDataTuple, SettlementDataTuple]]:
   result = []
   failures = set()
@@ -138,86 +369,247 @@ def filter_disambiguated_sdts(
       result.append((new, old))
 
   if failures:
-    PickleWrapper.pickle_data(failures, 'failures')
+    store.store('failures', failures)
 
   return result
 
 
-def disambiguate_data(data_frame_list: List[DataTuple], config: Configuration) -> List[DataTuple]:
+def resolve_with_register(
+  sdts: List[SettlementDataTuple],
+  register: Optional[EkatteRegister],
+  dates: Dict[Tuple[str, str, str], datetime]
+) -> Tuple[List[Tuple[SettlementDataTuple, SettlementDataTuple]], List[SettlementDataTuple]]:
+  """Resolves the settlements found in the local EKATTE register, the rest are left for NSI's website.
+
+  Every settlement is matched with the name valid on the date of the tables it was found in.
+  """
+  if register is None:
+    return [], sdts
+
+  results = [(register.resolve(sdt, dates.get(sdt.key)), sdt) for sdt in sdts]
+  resolved = [(result, sdt) for result, sdt in results if result.data is not None]
+  pending = [sdt for result, sdt in results if result.data is None]
+
+  if sdts:
+    ambiguous = sum(sdt.key in register.ambiguous for _, sdt in resolved)
+    print(f'Resolved {len(resolved)} of {len(sdts)} settlements from the EKATTE register, '
+          f'{ambiguous} of them matching several codes')
 
-  settlement_disambiguation_pipeline = config['settlement_disambiguation']
+  return resolved, pending
 
-  processed_sdts, reverse_dict = load_ekatte_dicts()
 
-  sdt_list = make_settlements_data_tuple_list(data_frame_list)
+def group_by_query_name(sdts: List[SettlementDataTuple]) -> Dict[str, List[SettlementDataTuple]]:
+  groups: Dict[str, List[SettlementDataTuple]] = defaultdict(list)
 
-  wrapped_data_source = ((settlement_disambiguation_pipeline, sdt[0])
-                         for sdt in sdt_list if not check_sdt_availability(sdt[0], processed_sdts, reverse_dict))
+  for sdt in sdts:
+    groups[settlement_query_name(sdt.data)].append(sdt)
 
-  # Higher number of concurrent jobs leads to issues with failing request to NSI's website
-  results = execute_in_parallel(try_disambiguation, wrapped_data_source, 2)
+  return groups
 
-  if results is None:
-    raise UnexpectedNoneError('Settlement disambiguation failed!')
 
-  for value, sdt in filter_disambiguated_sdts(results):
+def needs_lookup(group: List[SettlementDataTuple], candidates: Optional[CandidateIndex], retry_unmatched: bool) -> bool:
+  if candidates is None:
+    return True
+
+  if not retry_unmatched:
+    return False
+
+  # NSI's website could have the names missing from the stored ones by now
+  return any(not candidates.matches(sdt.key) for sdt in group)
+
+
+def lookup_settlement_names(
+  groups: Dict[str, List[SettlementDataTuple]],
+  config: Configuration
+) -> Dict[str, CandidateIndex]:
+  """Fetches every name once from NSI's website, the parsed names are kept in the artifact store for the next runs.
+
+  The stored names are used as they are, those matching none of the settlements sharing them are only fetched again
+  with retry_unmatched_lookups set. Returns the candidates of every name found, indexed once for all its settlements.
+  """
+  store = artifact_store(config)
+  lookups = store.load('nsi_lookups') or {}
+  fetched: Dict[str, Any] = {}
+
+  def record(sdt: SettlementDataTuple, names: Optional[Dict[str, Any]]):
+    if names is None:
+      return
+
+    fetched[settlement_query_name(sdt.data)] = names
+    if len(fetched) % LOOKUPS_STORED_EVERY == 0:
+      # An interrupted run keeps the names looked up so far
+      store.store('nsi_lookups', {**lookups, **fetched})
+
+  max_in_flight = config['nsi_lookup_jobs'] or NSI_LOOKUP_JOBS
+  limiter = shared_rate_limiter(NSI_HOST, concurrency=min(2, max_in_flight), max_concurrency=max_in_flight)
+  retry_unmatched = bool(config['retry_unmatched_lookups'])
+  candidates = {name: CandidateIndex(lookups[name]) for name in groups if name in lookups}
+  pending = [group[0] for name, group in groups.items() if needs_lookup(group, candidates.get(name), retry_unmatched)]
+  lookup_settlements(pending, record, limiter, max_in_flight)
+
+  if fetched:
+    lookups.update(fetched)
+    store.store('nsi_lookups', lookups)
+    candidates.update((name, CandidateIndex(names)) for name, names in fetched.items() if name in groups)
+
+  print(f'Looked up {len(groups)} settlement names, {len(fetched)} of them on NSI\'s website')
+  if pending:
+    print(format_statistics(NSI_HOST, limiter.statistics()))
+
+  return candidates
+
+
+def match_with_lookup(sdt: SettlementDataTuple, candidates: Optional[CandidateIndex]) -> SettlementDataTuple:
+  if candidates is None:
+    # A failed lookup leaves the settlement without a code, as a failed disambiguation did
+    return SettlementDataTuple(sdt.key)
+
+  return candidates.match(sdt)
+
+
+def resolve_with_lookups(
+  sdts: List[SettlementDataTuple],
+  config: Configuration
+) -> List[Tuple[SettlementDataTuple, SettlementDataTuple]]:
+  if not sdts:
+    return []
+
+  groups = group_by_query_name(sdts)
+  candidates = lookup_settlement_names(groups, config)
+  results = [(match_with_lookup(sdt, candidates.get(name)), sdt) for name, group in groups.items() for sdt in group]
+
+  ambiguous = sum(sdt.key in candidates[name].ambiguous for name in candidates for sdt in groups[name])
+  if ambiguous:
+    print(f'{ambiguous} settlements matched several codes on NSI\'s website, the most recent names were taken')
+
+  return results
+
+
+def disambiguate_settlements(
+  sdt_list: List[Tuple[SettlementDataTuple, str, datetime]],
+  config: Configuration
+) -> pd.DataFrame:
+  store = artifact_store(config)
+  processed_sdts, reverse_dict = load_ekatte_dicts(store)
+
+  pending = [sdt[0] for sdt in sdt_list if not check_sdt_availability(sdt[0], processed_sdts, reverse_dict)]
+  # Spellings normalized to the same key are resolved on the latest date any of them was found on
+  dates: Dict[Tuple[str, str, str], datetime] = {}
+  for sdt, _, date in sdt_list:
+    dates[sdt.key] = max(dates.get(sdt.key, date), date)
+
+  resolved, pending = resolve_with_register(pending, config['ekatte_register'], dates)
+  results = resolve_with_lookups(pending, config)
+
+  for value, sdt in filter_disambiguated_sdts(resolved + results, store):
     processed_sdts[value.key] = value.data
     reverse_dict[value.data] = sdt[1]
 
-  PickleWrapper.pickle_data(processed_sdts, 'triple_to_ekatte')
-  PickleWrapper.pickle_data(reverse_dict, 'ekatte_to_triple')
+  store.store('triple_to_ekatte', processed_sdts)
+  store.store('ekatte_to_triple', reverse_dict)
+
+  return ekatte_key_frame(processed_sdts)
+
 
-  wrapped_data_tuple_source = ((dt, processed_sdts) for dt in data_frame_list)
-  disambiguated_data = execute_in_parallel(update_data_frame, wrapped_data_tuple_source)
+def disambiguate_data(data_frame_list: List[DataTuple], config: Configuration) -> List[DataTuple]:
+  sdt_list = make_settlements_data_tuple_list([dt for dt in data_frame_list if not is_disambiguated(dt)])
+  ekatte_keys = disambiguate_settlements(sdt_list, config)
+
+  wrapped_data_tuple_source = ((dt, ekatte_keys) for dt in data_frame_list if not is_disambiguated(dt))
+  # The merges are too quick to pay for pickling the tables to worker processes and back
+  updated_data = execute_in_parallel(update_data_frame, wrapped_data_tuple_source, backend=ExecutionBackendEnum.Threads)
 
-  if disambiguated_data is None:
+  if updated_data is None:
     raise UnexpectedNoneError('Updating DataFrames failed!')
 
-  PickleWrapper.pickle_data(disambiguated_data, 'data_frames_list_disambiguated')
+  updated_iterator = iter(updated_data)
+  disambiguated_data = compact_data_frames([dt if is_disambiguated(dt) else next(updated_iterator)
+                                            for dt in data_frame_list])
+
+  artifact_store(config).store('data_frames_list_disambiguated', disambiguated_data)
 
   return disambiguated_data
 
 
-def combine_data(processed_data: List[DataTuple], config: Configuration) -> List[DataTuple]:
-  combined: Optional[pd.DataFrame] = None
-  names = ['region', 'municipality', 'settlement']
+def assemble_combined_matrix(value_frames: List[pd.DataFrame]) -> pd.DataFrame:
+  # Every settlement gets its row in the sorted union of the keys, as the outer merges used to leave it
+  keys = pd.Index(np.sort(pd.unique(np.concatenate([df.index.to_numpy() for df in value_frames]))),
+                  name=value_frames[0].index.name)
+  columns_per_period = value_frames[0].shape[1]
 
-  for dt in processed_data:
-    if combined is None:
-      combined = dt.data.drop(labels=names, axis=1)
-    else:
-      df: pd.DataFrame = dt.data.drop(labels=names, axis=1)
-      combined = combined.merge(df,
-                                how='outer',
-                                copy=False,
-                                left_index=True,
-                                right_index=True)
-
-  if combined is None:
+  # Settlements missing from a period keep the 0 the merged NaNs used to be filled with
+  matrix = np.zeros((len(keys), len(value_frames), columns_per_period), dtype=np.int32)
+  for period, df in enumerate(value_frames):
+    matrix[keys.get_indexer(df.index), period, :] = df.to_numpy()
+
+  columns = list(chain.from_iterable(df.columns for df in value_frames))
+
+  # The reshape is a view, so the frame is built on the matrix without copying it
+  return pd.DataFrame(matrix.reshape(len(keys), len(value_frames) * columns_per_period), index=keys, columns=columns)
+
+
+def value_frame(data_frame: pd.DataFrame) -> pd.DataFrame:
+  return data_frame.drop(labels=NAME_COLUMNS, axis=1)
+
+
+def combine_data(processed_data: List[DataTuple], config: Configuration) -> List[DataTuple]:
+  if not processed_data:
     raise UnexpectedNoneError('Failed to combine DataFarmes')
 
-  combined.fillna(value=0, inplace=True)
-  for column in combined.columns.to_list():
-    combined[column] = combined[column].astype(int)
+  combined = assemble_combined_matrix([value_frame(dt.data) for dt in processed_data])
 
-  PickleWrapper.pickle_data(combined, 'combined_tables')
+  artifact_store(config).store('combined_tables', combined)
 
   return [DataTuple(combined, HeaderEnum(0), TableTypeEnum(0))]
 
 
+def store_table(df: pd.DataFrame, csv_path: str, config: Configuration) -> bool:
+  changed = store_csv_table(df, csv_path, config['csv_compression'])
+
+  if config['binary_tables']:
+    changed = store_binary_table(df, csv_path) or changed
+  else:
+    remove_binary_table(csv_path)
+
+  return changed
+
+
+def store_table_job(input_data: Tuple[pd.DataFrame, str, Configuration]) -> bool:
+  df, csv_path, config = input_data
+
+  return store_table(df, csv_path, config)
+
+
+def stored_table_path(data_frame: pd.DataFrame, config: Configuration) -> str:
+  return f'{config.processed_tables_path}/grao_data_{"_".join(data_frame.columns[-1].split("_")[1:])}.csv'
+
+
 def store_data_list(processed_data: List[DataTuple], config: Configuration) -> List[DataTuple]:
-  for dt in processed_data:
-    df: pd.DataFrame = dt.data
+  paths = [stored_table_path(dt.data, config) for dt in processed_data]
+
+  # Compressing and writing release the GIL, so threads overlap them without pickling the tables
+  changed = execute_in_parallel(store_table_job, ((dt.data, path, config) for dt, path in zip(processed_data, paths)),
+                                config['write_jobs'] or -1, ExecutionBackendEnum.Threads)
 
-    name = f'grao_data_{"_".join(df.columns[-1].split("_")[1:])}'
-    df.to_csv(f'{config.processed_tables_path}/{name}.csv')
+  if changed is None:
+    raise UnexpectedNoneError('Failed storing the processed tables!')
+
+  print(f'Stored {len(paths)} processed tables, {len(paths) - sum(changed)} of them unchanged')
 
   return processed_data
 
 
+def combined_table_path(config: Configuration) -> str:
+  return f'{config.combined_tables_path}/grao_data_combined.csv'
+
+
 def store_combined_data(processed_data: List[DataTuple], config: Configuration) -> List[DataTuple]:
   combined_data: pd.DataFrame = processed_data[0].data
 
-  combined_data.to_csv(f'{config.combined_tables_path}/grao_data_combined.csv')
+  if config['missing_tables']:
+    print('Not storing the combined table, the periods of the tables that failed downloading would be missing')
+    return processed_data
+
+  store_table(combined_data, combined_table_path(config), config)
 
   return processed_data
@@ -0,0 +1,92 @@
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from sys import getsizeof, intern
+from typing import Dict, List, Optional
+
+from grao_tables_processing.common.custom_types import DataTuple
+
+
+# Stored as codes into categories shared by the tables of all periods
+CATEGORICAL_COLUMNS = ['region', 'municipality', 'ekatte']
+COUNT_DTYPE = np.int32
+
+
+def column_values(df: pd.DataFrame, column: str) -> Optional[pd.Series]:
+  if column in df.columns:
+    return df[column]
+
+  if column in df.index.names:
+    return pd.Series(df.index.get_level_values(column))
+
+  return None
+
+
+def shared_categories(data_frames: List[pd.DataFrame]) -> Dict[str, pd.Index]:
+  categories = {}
+
+  for column in CATEGORICAL_COLUMNS:
+    values = [pd.unique(series) for df in data_frames if (series := column_values(df, column)) is not None]
+    if values:
+      categories[column] = pd.Index(sorted(set(np.concatenate(values).tolist())))
+
+  return categories
+
+
+def interned_names(values: pd.Series) -> np.ndarray:
+  # Equal names share one string object, within a table and across the tables of all periods
+  codes, uniques = pd.factorize(values)
+  # Missing names get the code -1, which picks the NaN after the names
+  interned = np.array([intern(name) for name in uniques] + [np.nan], dtype=object)
+
+  return interned[codes]
+
+
+def compact_column(values: pd.Series, categories: Optional[pd.Index]) -> pd.Series:
+  if categories is not None:
+    return pd.Series(pd.Categorical(values, categories=categories), index=values.index)
+
+  if pd.api.types.is_integer_dtype(values):
+    return values.astype(COUNT_DTYPE)
+
+  return pd.Series(interned_names(values), index=values.index)
+
+
+def compact_data_frame(df: pd.DataFrame, categories: Dict[str, pd.Index]) -> pd.DataFrame:
+  index_names = [name for name in df.index.names if name is not None]
+  flat = df.reset_index() if index_names else df.copy()
+
+  for column in flat.columns:
+    flat[column] = compact_column(flat[column], categories.get(column))
+
+  return flat.set_index(index_names) if index_names else flat
+
+
+def compact_data_frames(data_frame_list: List[DataTuple]) -> List[DataTuple]:
+  categories = shared_categories([dt.data for dt in data_frame_list])
+
+  return [DataTuple(compact_data_frame(dt.data, categories), dt.header_type, dt.table_type) for dt in data_frame_list]
+
+
+def _column_arrays(df: pd.DataFrame) -> List[np.ndarray]:
+  columns = [pd.Series(df.index.get_level_values(level)) for level in range(df.index.nlevels)]
+  columns += [df[name] for name in df.columns]
+  arrays = []
+
+  for column in columns:
+    values = column.array
+    if isinstance(values, pd.Categorical):
+      arrays += [values.codes, values.categories.to_numpy()]
+    else:
+      arrays.append(np.asarray(values))
+
+  return arrays
+
+
+def memory_usage(data_frames: List[pd.DataFrame]) -> int:
+  """Bytes held by the frames, counting shared categories and strings once unlike DataFrame.memory_usage(deep=True)."""
+  # Keeping the arrays referenced keeps their ids unique
+  arrays = {id(values): values for df in data_frames for values in _column_arrays(df)}
+  strings = {id(value): getsizeof(value) for values in arrays.values() if values.dtype == object for value in values}
+
+  return sum(values.nbytes for values in arrays.values()) + sum(strings.values())
@@ -1,11 +1,12 @@
 import matplotlib.pyplot as plt  # type: ignore
 
-from typing import Any, Dict, Iterable, List, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from os.path import exists
 from os import makedirs
 from numpy import arange  # type: ignore
 
-from grao_tables_processing.common.pickle_wrapper import PickleWrapper
+from grao_tables_processing.common.artifact_store import ArtifactStore
+from grao_tables_processing.common.binary_tables import load_binary_table
 from grao_tables_processing.common.configuration import Configuration
 from grao_tables_processing.common.custom_types import UnexpectedNoneError
 
@@ -21,9 +22,17 @@ def autolabel(ax, rects: Iterable[Any]):
                     ha='center', va='bottom')
 
 
-def load_processed_data() -> Tuple[Dict[Any, Any], Dict[Any, Any]]:
-  ekatte_to_triple = PickleWrapper.load_data('ekatte_to_triple')
-  combined = PickleWrapper.load_data('combined_tables')
+def load_processed_data(
+  store: ArtifactStore,
+  combined_tables_path: Optional[str] = None
+) -> Tuple[Dict[Any, Any], Dict[Any, Any]]:
+  ekatte_to_triple = store.load('ekatte_to_triple')
+
+  combined = None
+  if combined_tables_path is not None:
+    combined = load_binary_table(f'{combined_tables_path}/grao_data_combined.csv')
+  if combined is None:
+    combined = store.load('combined_tables')
 
   if ekatte_to_triple is None or combined is None:
     raise UnexpectedNoneError('There was an issue loading the data!')
@@ -113,7 +122,8 @@ def plot_comparison(
 
 
 def create_visualizations(config: Configuration):
-  ekatte_to_triple, combined_dict = load_processed_data()
+  store = config['artifact_store'] or ArtifactStore(config.pickled_data_path)
+  ekatte_to_triple, combined_dict = load_processed_data(store, config.combined_tables_path)
 
   plt.rcParams['figure.figsize'] = [45, 15]
 
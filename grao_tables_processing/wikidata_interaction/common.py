@@ -7,7 +7,8 @@ from os import listdir
 from grao_tables_processing.common.helper_functions import execute_in_parallel
 from grao_tables_processing.common.regex_pattern_wrapper import RegexPatternWrapper
 from grao_tables_processing.common.pipeline import Pipeline
-from grao_tables_processing.common.custom_types import UnexpectedNoneError
+from grao_tables_processing.common.custom_types import ExecutionBackendEnum, UnexpectedNoneError
+from grao_tables_processing.common.table_files import is_csv_file, uncompressed_csv_path
 
 
 def find_ref_url(path_to_file: str, file_prefix: str, url_list: List[str]) -> str:
@@ -62,9 +63,13 @@ def single_processed_file_info(input_data: Tuple[str, str, List[str]]) -> Tuple[
 
 
 def find_latest_processed_file_info(storage_directory: str, url_list: List[str]) -> Tuple[datetime, str, str]:
-  wrapped_data_generator = ((file, storage_directory, url_list) for file in listdir(storage_directory))
+  # The binary and compressed copies of the tables are found through the path of their CSVs
+  wrapped_data_generator = ((uncompressed_csv_path(file), storage_directory, url_list)
+                            for file in listdir(storage_directory) if is_csv_file(file))
 
-  processed_files = execute_in_parallel(single_processed_file_info, wrapped_data_generator)
+  # Parsing the file names takes less than starting a worker process
+  processed_files = execute_in_parallel(single_processed_file_info, wrapped_data_generator,
+                                        backend=ExecutionBackendEnum.Serial)
 
   if processed_files is None:
     raise UnexpectedNoneError(f'Couldn\'t processed files in {storage_directory}')
@@ -3,6 +3,8 @@ import pandas as pd  # type: ignore
 from typing import Dict, Any
 from numpy import str as np_str  # type: ignore
 
+from grao_tables_processing.common.binary_tables import indexed_by, load_binary_table
+from grao_tables_processing.common.table_files import existing_csv_path
 from grao_tables_processing.common.configuration import Configuration
 from grao_tables_processing.common.custom_types import UnexpectedNoneError
 
@@ -12,7 +14,11 @@ from grao_tables_processing.wikidata_interaction.common import find_date_suffix
 
 
 def dict_from_csv(csv_path: str, index_name: str) -> Dict[Any, Any]:
-  loaded_dict = pd.DataFrame(pd.read_csv(csv_path, dtype=np_str)).set_index(index_name).to_dict(orient='index', into=dict)
+  if (binary_table := load_binary_table(csv_path)) is not None:
+    loaded_dict = indexed_by(binary_table, index_name).astype(np_str).to_dict(orient='index', into=dict)
+  else:
+    loaded_df = pd.DataFrame(pd.read_csv(existing_csv_path(csv_path) or csv_path, dtype=np_str))
+    loaded_dict = loaded_df.set_index(index_name).to_dict(orient='index', into=dict)
 
   if not isinstance(loaded_dict, dict):
     result: Dict[Any, Any] = {}
@@ -1,5 +1,4 @@
 import pandas as pd  # type: ignore
-import time
 
 from typing import List, Any
 from datetime import datetime
@@ -7,6 +6,7 @@ from wikidataintegrator import wdi_core, wdi_login  # type: ignore
 
 
 from grao_tables_processing.common.configuration import Configuration
+from grao_tables_processing.common.rate_limiter import AdaptiveRateLimiter, format_statistics, shared_rate_limiter
 from grao_tables_processing.wikidata_interaction.common import find_latest_processed_file_info
 
 
@@ -25,10 +25,19 @@ def login_with_credentials(credentials_path: str) -> wdi_login.WDLogin:
   return wdi_login.WDLogin(username, password)
 
 
+WIKIDATA_HOST = 'www.wikidata.org'
+
+
+def wikidata_rate_limiter() -> AdaptiveRateLimiter:
+  # One edit every 15 seconds at most, slowed down further while Wikidata fails or lags
+  return shared_rate_limiter(WIKIDATA_HOST, rate=1 / 15, max_rate=1 / 15, min_rate=1 / 120, burst=1,
+                             concurrency=1, max_concurrency=1, slow_seconds=30)
+
+
 def update_item(login: wdi_login.WDLogin, settlement_qid: str, data: List[wdi_core.WDQuantity]):
-  item = wdi_core.WDItemEngine(wd_item_id=settlement_qid, data=data)
-  item.write(login, False)
-  time.sleep(15)
+  with wikidata_rate_limiter().request():
+    item = wdi_core.WDItemEngine(wd_item_id=settlement_qid, data=data)
+    item.write(login, False)
 
 
 def update_all_settlements(config: Configuration):
@@ -60,6 +69,8 @@ def update_all_settlements(config: Configuration):
       error_logs.append(settlement_qid)
       print("An error occurred for item : " + settlement_qid)
 
+  print(format_statistics(WIKIDATA_HOST, wikidata_rate_limiter().statistics()))
+
   if len(error_logs) > 0:
     print("Summarizing failures for specific IDs")
     for error in error_logs: